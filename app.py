@@ -4,12 +4,28 @@ import threading
 import time
 import os
 import json
+import queue
+import atexit
+import random
+import signal
 import streamlit.components.v1 as components
 from datetime import datetime, timedelta
 import urllib.parse
+import hashlib
+import itertools
+import functools
+import re
+import struct
+import asyncio
+import argparse
+import shutil
+import gzip
+import csv
 import requests
 import sqlite3
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
 
 # Install required packages
 try:
@@ -18,6 +34,12 @@ except ImportError:
     subprocess.check_call([sys.executable, "-m", "pip", "install", "streamlit"])
     import streamlit as st
 
+try:
+    import psutil
+except ImportError:
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "psutil"])
+    import psutil
+
 try:
     import google.auth
     from google.oauth2.credentials import Credentials
@@ -43,84 +65,340 @@ PREDEFINED_OAUTH_CONFIG = {
     }
 }
 
-# Initialize database for persistent logs
+# Storage: one long-lived, pre-configured SQLite connection per thread
+DB_PATH = "streaming_logs.db"
+DB_BUSY_TIMEOUT = 30
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHED_STATEMENTS = 256
+
+class Storage:
+    """Thread-local SQLite connections to one database file
+    
+    A thread opens its connection on first use and keeps it, so callers skip
+    connection setup and reuse the prepared statements in the connection's
+    statement cache. Writers wrap their statements in `with conn:` so an error
+    always rolls back rather than leaving a long-lived connection holding
+    the write lock. The schema is migrated once per process.
+    """
+    
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = str(db_path)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.migrate_lock = threading.Lock()
+        self.migrated = False
+        self.opened = 0
+    
+    def connection(self):
+        """This thread's connection, opened and configured on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT, cached_statements=DB_CACHED_STATEMENTS)
+            # Freed pages can be returned to the OS a little at a time; only
+            # takes effect on a new database, so it must precede WAL setup
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets the background log writer and UI readers work concurrently
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+            self.local.conn = conn
+            with self.lock:
+                self.opened += 1
+        return conn
+    
+    def migrate(self):
+        """Create and upgrade the schema unless this process already did"""
+        with self.migrate_lock:
+            if self.migrated:
+                return
+            conn = self.connection()
+            with conn:
+                migrate_schema(conn)
+            # Databases created before incremental auto-vacuum never shrink: convert them once
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                try:
+                    enable_incremental_vacuum(self.db_path)
+                except sqlite3.Error as e:
+                    st.warning(f"Could not enable incremental vacuum, retention will not shrink the database: {e}")
+            self.migrated = True
+
+@st.cache_resource
+def get_storage(db_path=DB_PATH):
+    """Process-wide storage shared by every session and worker thread"""
+    return Storage(db_path)
+
+def get_db(db_path=DB_PATH):
+    """The calling thread's connection to the logs database"""
+    # The argument-free call skips hashing a cache key on every query
+    storage = get_storage() if db_path == DB_PATH else get_storage(db_path)
+    return storage.connection()
+
 def init_database():
-    """Initialize SQLite database for persistent logs"""
+    """Initialize SQLite database for persistent logs; a no-op after the first call"""
     try:
-        db_path = Path("streaming_logs.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Create logs table
+        get_storage().migrate()
+    except Exception as e:
+        st.error(f"Database initialization error: {e}")
+
+def migrate_schema(conn):
+    """Create tables and indexes, upgrading databases written by older versions"""
+    cursor = conn.cursor()
+    
+    # Create logs table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS streaming_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            log_type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            video_file TEXT,
+            stream_key TEXT,
+            channel_name TEXT,
+            batch_index INTEGER
+        )
+    ''')
+    
+    # Databases created before batch tagging lack the column
+    log_columns = [row[1] for row in cursor.execute("PRAGMA table_info(streaming_logs)")]
+    if 'batch_index' not in log_columns:
+        cursor.execute("ALTER TABLE streaming_logs ADD COLUMN batch_index INTEGER")
+    
+    # Log queries filter by session or type and page newest first
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_streaming_logs_session
+        ON streaming_logs (session_id, timestamp)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_streaming_logs_type
+        ON streaming_logs (log_type, timestamp)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_streaming_logs_timestamp
+        ON streaming_logs (timestamp)
+    ''')
+    
+    # Full-text index over log messages, kept in step with streaming_logs by triggers
+    try:
+        fts_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'streaming_logs_fts'").fetchone()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS streaming_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                session_id TEXT NOT NULL,
-                log_type TEXT NOT NULL,
-                message TEXT NOT NULL,
-                video_file TEXT,
-                stream_key TEXT,
-                channel_name TEXT
-            )
+            CREATE VIRTUAL TABLE IF NOT EXISTS streaming_logs_fts
+            USING fts5(message, content='streaming_logs', content_rowid='id')
         ''')
-        
-        # Create streaming_sessions table
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS streaming_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT UNIQUE NOT NULL,
-                start_time TEXT NOT NULL,
-                end_time TEXT,
-                video_file TEXT,
-                stream_title TEXT,
-                stream_description TEXT,
-                tags TEXT,
-                category TEXT,
-                privacy_status TEXT,
-                made_for_kids BOOLEAN,
-                channel_name TEXT,
-                status TEXT DEFAULT 'active'
-            )
+            CREATE TRIGGER IF NOT EXISTS streaming_logs_fts_insert AFTER INSERT ON streaming_logs BEGIN
+                INSERT INTO streaming_logs_fts (rowid, message) VALUES (new.id, new.message);
+            END
         ''')
-        
-        # Create saved_channels table for persistent authentication
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS saved_channels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_name TEXT UNIQUE NOT NULL,
-                channel_id TEXT NOT NULL,
-                auth_data TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                last_used TEXT NOT NULL
-            )
+            CREATE TRIGGER IF NOT EXISTS streaming_logs_fts_delete AFTER DELETE ON streaming_logs BEGIN
+                INSERT INTO streaming_logs_fts (streaming_logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            END
         ''')
-        
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        st.error(f"Database initialization error: {e}")
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS streaming_logs_fts_update AFTER UPDATE OF message ON streaming_logs BEGIN
+                INSERT INTO streaming_logs_fts (streaming_logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+                INSERT INTO streaming_logs_fts (rowid, message) VALUES (new.id, new.message);
+            END
+        ''')
+        if not fts_exists:
+            # One-time backfill of rows logged before the index existed
+            cursor.execute("INSERT INTO streaming_logs_fts (streaming_logs_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: log search is unavailable
+        pass
+    
+    # Create ffmpeg_progress table for structured encoder telemetry
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ffmpeg_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            batch_index INTEGER NOT NULL,
+            frame INTEGER,
+            fps REAL,
+            bitrate_kbps REAL,
+            total_size INTEGER,
+            out_time_ms INTEGER,
+            speed REAL,
+            dup_frames INTEGER,
+            drop_frames INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ffmpeg_progress_batch
+        ON ffmpeg_progress (session_id, batch_index, timestamp)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ffmpeg_progress_timestamp
+        ON ffmpeg_progress (timestamp)
+    ''')
+    
+    # Create media_metadata table caching ffprobe results
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_metadata (
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            format_name TEXT,
+            duration REAL,
+            format_bitrate INTEGER,
+            video_codec TEXT,
+            video_profile TEXT,
+            pix_fmt TEXT,
+            width INTEGER,
+            height INTEGER,
+            fps REAL,
+            video_bitrate INTEGER,
+            keyframe_interval REAL,
+            audio_codec TEXT,
+            audio_bitrate INTEGER,
+            audio_sample_rate INTEGER,
+            audio_channels INTEGER,
+            probed_at TEXT NOT NULL,
+            PRIMARY KEY (path, size, mtime)
+        )
+    ''')
+    
+    # Create transcode_cache table for pre-encoded stream-ready files
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transcode_cache (
+            cache_key TEXT PRIMARY KEY,
+            source_path TEXT NOT NULL,
+            settings TEXT NOT NULL,
+            cache_path TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            last_used TEXT NOT NULL
+        )
+    ''')
+    
+    # Create encoder_benchmarks table for measured per-profile encode cost
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS encoder_benchmarks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            clip TEXT NOT NULL,
+            profile TEXT NOT NULL,
+            settings TEXT NOT NULL,
+            encoded_seconds REAL,
+            wall_seconds REAL,
+            achieved_fps REAL,
+            speed REAL,
+            cpu_seconds_per_second REAL,
+            peak_rss_mb REAL,
+            max_realtime_streams INTEGER,
+            host_cores INTEGER,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    
+    # Create stream_stalls table for encoders the watchdog had to restart
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stream_stalls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            job_key TEXT NOT NULL,
+            batches TEXT NOT NULL,
+            detected_at TEXT NOT NULL,
+            stalled_seconds REAL NOT NULL,
+            resume_position REAL,
+            recovered_at TEXT,
+            recovery_seconds REAL,
+            total_seconds REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stream_stalls_detected
+        ON stream_stalls (detected_at)
+    ''')
+    
+    # Create resource_rollups table for per-stream and host resource usage
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resource_rollups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            resolution TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            cpu_percent REAL,
+            rss_mb REAL,
+            read_kbps REAL,
+            write_kbps REAL,
+            threads INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_resource_rollups_subject
+        ON resource_rollups (subject, resolution, bucket_start)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_resource_rollups_bucket
+        ON resource_rollups (bucket_start)
+    ''')
+    
+    # Create uploaded_media table for the content-addressed upload store
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS uploaded_media (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            store_path TEXT NOT NULL,
+            original_name TEXT,
+            ingested_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_uploaded_media_size
+        ON uploaded_media (size)
+    ''')
+    
+    # Create streaming_sessions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS streaming_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            video_file TEXT,
+            stream_title TEXT,
+            stream_description TEXT,
+            tags TEXT,
+            category TEXT,
+            privacy_status TEXT,
+            made_for_kids BOOLEAN,
+            channel_name TEXT,
+            status TEXT DEFAULT 'active'
+        )
+    ''')
+    
+    # Create saved_channels table for persistent authentication
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS saved_channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_name TEXT UNIQUE NOT NULL,
+            channel_id TEXT NOT NULL,
+            auth_data TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            last_used TEXT NOT NULL
+        )
+    ''')
 
 def save_channel_auth(channel_name, channel_id, auth_data):
     """Save channel authentication data persistently"""
     try:
-        conn = sqlite3.connect("streaming_logs.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO saved_channels 
-            (channel_name, channel_id, auth_data, created_at, last_used)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            channel_name,
-            channel_id,
-            json.dumps(auth_data),
-            datetime.now().isoformat(),
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        conn.close()
+        conn = get_db()
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO saved_channels 
+                (channel_name, channel_id, auth_data, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                channel_name,
+                channel_id,
+                json.dumps(auth_data),
+                datetime.now().isoformat(),
+                datetime.now().isoformat()
+            ))
         return True
     except Exception as e:
         st.error(f"Error saving channel auth: {e}")
@@ -129,10 +407,7 @@ def save_channel_auth(channel_name, channel_id, auth_data):
 def load_saved_channels():
     """Load saved channel authentication data"""
     try:
-        conn = sqlite3.connect("streaming_logs.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = get_db().execute('''
             SELECT channel_name, channel_id, auth_data, last_used
             FROM saved_channels 
             ORDER BY last_used DESC
@@ -147,8 +422,6 @@ def load_saved_channels():
                 'auth': json.loads(auth_data),
                 'last_used': last_used
             })
-        
-        conn.close()
         return channels
     except Exception as e:
         st.error(f"Error loading saved channels: {e}")
@@ -157,99 +430,637 @@ def load_saved_channels():
 def update_channel_last_used(channel_name):
     """Update last used timestamp for a channel"""
     try:
-        conn = sqlite3.connect("streaming_logs.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE saved_channels 
-            SET last_used = ?
-            WHERE channel_name = ?
-        ''', (datetime.now().isoformat(), channel_name))
-        
-        conn.commit()
-        conn.close()
+        conn = get_db()
+        with conn:
+            conn.execute('''
+                UPDATE saved_channels 
+                SET last_used = ?
+                WHERE channel_name = ?
+            ''', (datetime.now().isoformat(), channel_name))
     except Exception as e:
         st.error(f"Error updating channel last used: {e}")
 
-def log_to_database(session_id, log_type, message, video_file=None, stream_key=None, channel_name=None):
-    """Log message to database"""
-    try:
-        conn = sqlite3.connect("streaming_logs.db")
-        cursor = conn.cursor()
+# Background log writer
+LOG_QUEUE_MAXSIZE = 10000
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 0.5
+LOG_BLOCK_TIMEOUT = 1.0
+
+# Log types that may be dropped immediately when the queue is full
+DROPPABLE_LOG_TYPES = {"FFMPEG"}
+
+# Insert statements the writer can batch, keyed by target table
+LOG_WRITER_STATEMENTS = {
+    'streaming_logs': '''
+        INSERT INTO streaming_logs 
+        (timestamp, session_id, log_type, message, video_file, stream_key, channel_name, batch_index)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'ffmpeg_progress': '''
+        INSERT INTO ffmpeg_progress 
+        (timestamp, session_id, batch_index, frame, fps, bitrate_kbps, total_size, out_time_ms, speed, dup_frames, drop_frames)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'resource_rollups': '''
+        INSERT INTO resource_rollups
+        (resolution, subject, bucket_start, samples, cpu_percent, rss_mb, read_kbps, write_kbps, threads)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'stream_stalls': '''
+        INSERT INTO stream_stalls
+        (session_id, job_key, batches, detected_at, stalled_seconds, resume_position, recovered_at, recovery_seconds, total_seconds)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+}
+
+class LogWriter:
+    """Drain queued log rows into SQLite from a single writer thread"""
+    
+    def __init__(self, db_path=DB_PATH, maxsize=LOG_QUEUE_MAXSIZE,
+                 batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+    
+    def submit(self, row, table='streaming_logs', droppable=False):
+        """Queue a row without ever blocking the caller for long; count drops
         
-        cursor.execute('''
-            INSERT INTO streaming_logs 
-            (timestamp, session_id, log_type, message, video_file, stream_key, channel_name)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        Callers on an asyncio loop never wait: a full queue would otherwise
+        stall every coroutine on that loop, including other encoders' readers.
+        """
+        try:
+            if droppable or self._on_event_loop():
+                self.queue.put_nowait((table, row))
+            else:
+                self.queue.put((table, row), timeout=LOG_BLOCK_TIMEOUT)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+    
+    @staticmethod
+    def _on_event_loop():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+    
+    def flush(self, timeout=5.0):
+        """Wait until every queued row has been written (or timeout expires)"""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+    
+    def stats(self):
+        """Return writer counters for display"""
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'last_error': self.last_error
+            }
+    
+    def _next_batch(self):
+        """Block for one row, then collect more until the batch is full or the interval ends"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        conn = get_db(self.db_path)
+        while True:
+            batch = self._next_batch()
+            rows_by_table = {}
+            for table, row in batch:
+                rows_by_table.setdefault(table, []).append(row)
+            try:
+                for table, rows in rows_by_table.items():
+                    conn.executemany(LOG_WRITER_STATEMENTS[table], rows)
+                conn.commit()
+                with self.lock:
+                    self.written += len(batch)
+            except sqlite3.Error as e:
+                conn.rollback()
+                with self.lock:
+                    self.failed += len(batch)
+                    self.last_error = str(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+@st.cache_resource
+def get_log_writer():
+    """Process-wide log writer shared by every session and FFmpeg thread"""
+    return LogWriter(DB_PATH)
+
+def log_to_database(session_id, log_type, message, video_file=None, stream_key=None, channel_name=None, batch_index=None):
+    """Queue log message for the background database writer"""
+    try:
+        get_log_writer().submit((
             datetime.now().isoformat(),
             session_id,
             log_type,
             message,
             video_file,
             stream_key,
-            channel_name
-        ))
-        
-        conn.commit()
-        conn.close()
+            channel_name,
+            batch_index
+        ), droppable=log_type in DROPPABLE_LOG_TYPES)
     except Exception as e:
         st.error(f"Error logging to database: {e}")
 
+def log_progress_to_database(session_id, batch_index, sample):
+    """Queue one FFmpeg progress sample for the background database writer"""
+    try:
+        get_log_writer().submit((
+            datetime.now().isoformat(),
+            session_id,
+            batch_index,
+            sample.get('frame'),
+            sample.get('fps'),
+            sample.get('bitrate_kbps'),
+            sample.get('total_size'),
+            sample.get('out_time_ms'),
+            sample.get('speed'),
+            sample.get('dup_frames'),
+            sample.get('drop_frames')
+        ), table='ffmpeg_progress', droppable=True)
+    except Exception as e:
+        st.error(f"Error logging progress to database: {e}")
+
+def get_progress_from_database(session_id, batch_index, limit=300):
+    """Get the most recent progress samples for a batch, oldest first"""
+    try:
+        cursor = get_db().cursor()
+        
+        cursor.execute('''
+            SELECT timestamp, frame, fps, bitrate_kbps, total_size, out_time_ms, speed, dup_frames, drop_frames
+            FROM ffmpeg_progress 
+            WHERE session_id = ? AND batch_index = ?
+            ORDER BY timestamp DESC 
+            LIMIT ?
+        ''', (session_id, batch_index, limit))
+        
+        samples = cursor.fetchall()
+        return list(reversed(samples))
+    except Exception as e:
+        st.error(f"Error getting progress from database: {e}")
+        return []
+
+LOG_PAGE_SIZE = 100
+LOG_QUERY_COLUMNS = ('id', 'timestamp', 'session_id', 'log_type', 'message', 'video_file', 'channel_name', 'batch_index')
+
+def build_log_filters(session_id=None, log_type=None, batch_index=None, channel_name=None, video_file=None, since=None, until=None):
+    """WHERE clause and parameters for log filters; every filter runs in SQL"""
+    clauses = []
+    params = []
+    for column, value in (('session_id', session_id), ('log_type', log_type), ('batch_index', batch_index),
+                          ('channel_name', channel_name), ('video_file', video_file)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since.isoformat() if isinstance(since, datetime) else since)
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(until.isoformat() if isinstance(until, datetime) else until)
+    return clauses, params
+
+def query_logs(limit=LOG_PAGE_SIZE, before=None, **filters):
+    """One page of logs, newest first; returns (rows, cursor for the next page)
+    
+    Rows are dicts with LOG_QUERY_COLUMNS. before is the (timestamp, id) of the
+    last row of the previous page, so each page is an index range scan rather
+    than an OFFSET that re-reads every earlier row. The next cursor is None on
+    the last page.
+    """
+    clauses, params = build_log_filters(**filters)
+    if before:
+        clauses.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+        params.extend([before[0], before[0], before[1]])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    
+    cursor = get_db().cursor()
+    cursor.execute(f'''
+        SELECT {", ".join(LOG_QUERY_COLUMNS)}
+        FROM streaming_logs
+        {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = [dict(zip(LOG_QUERY_COLUMNS, row)) for row in cursor.fetchall()]
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_cursor
+
+LOG_SEARCH_LIMIT = 50
+LOG_SEARCH_MARKERS = ("\x02", "\x03")
+LOG_SEARCH_CANDIDATES = 2000
+
+def build_fts_query(text):
+    """FTS5 query from free text: every word or "quoted phrase" must match"""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', text):
+        term = (phrase or word).replace('"', '""')
+        terms.append(f'"{term}"')
+    return " ".join(terms)
+
+def search_logs(text, limit=LOG_SEARCH_LIMIT, order="relevance", **filters):
+    """Full-text search over log messages with the same SQL filters as query_logs
+    
+    Rows are dicts with LOG_QUERY_COLUMNS plus 'highlighted', the message with
+    matches wrapped in LOG_SEARCH_MARKERS. order is "relevance" (bm25) or
+    "newest". Relevance ranks only the newest LOG_SEARCH_CANDIDATES matches, so
+    a term found in every progress line still answers from the index tail
+    instead of scoring the whole history.
+    """
+    fts_query = build_fts_query(text)
+    if not fts_query:
+        return []
+    clauses, params = build_log_filters(**filters)
+    # Filter columns exist only on streaming_logs, so they need no table prefix
+    where = "".join(f" AND {clause}" for clause in clauses)
+    # Log ids grow with time, so a date range also bounds the index rowids
+    # and the newest-first walk starts inside the range instead of after it
+    bounds = []
+    for key, condition in (('since', "streaming_logs_fts.rowid >= COALESCE(({}), (SELECT MAX(id) FROM streaming_logs) + 1)"),
+                           ('until', "streaming_logs_fts.rowid <= COALESCE(({}), (SELECT MAX(id) FROM streaming_logs))")):
+        value = filters.get(key)
+        if value:
+            where += " AND " + condition.format("SELECT id FROM streaming_logs WHERE timestamp >= ? ORDER BY timestamp LIMIT 1")
+            bounds.append(value.isoformat() if isinstance(value, datetime) else value)
+    columns = ", ".join(f"streaming_logs.{column}" for column in LOG_QUERY_COLUMNS)
+    
+    cursor = get_db().cursor()
+    # Rowid order on the index is newest-first for the same reason
+    cursor.execute(f'''
+        SELECT * FROM (
+            SELECT {columns},
+                   highlight(streaming_logs_fts, 0, ?, ?),
+                   bm25(streaming_logs_fts) AS score
+            FROM streaming_logs_fts
+            JOIN streaming_logs ON streaming_logs.id = streaming_logs_fts.rowid
+            WHERE streaming_logs_fts MATCH ?{where}
+            ORDER BY streaming_logs_fts.rowid DESC
+            LIMIT ?
+        )
+        ORDER BY {"score, id DESC" if order == "relevance" else "id DESC"}
+        LIMIT ?
+    ''', (*LOG_SEARCH_MARKERS, fts_query, *params, *bounds,
+          LOG_SEARCH_CANDIDATES if order == "relevance" else limit, limit))
+    rows = [dict(zip(LOG_QUERY_COLUMNS + ('highlighted',), row)) for row in cursor.fetchall()]
+    return rows
+
+def format_search_highlight(highlighted):
+    """Markdown for a highlighted message: matches in bold, everything else escaped"""
+    def escape(text):
+        return re.sub(r"([\\`*_{}\[\]()#+\-.!|<>~$:])", r"\\\1", text)
+    
+    start, end = LOG_SEARCH_MARKERS
+    parts = []
+    for segment in highlighted.split(start):
+        match, _, rest = segment.partition(end) if end in segment else ("", "", segment)
+        if match:
+            parts.append(f"**{escape(match)}**")
+        parts.append(escape(rest))
+    return "".join(parts)
+
 def get_logs_from_database(session_id=None, limit=100):
     """Get logs from database"""
     try:
-        conn = sqlite3.connect("streaming_logs.db")
-        cursor = conn.cursor()
-        
-        if session_id:
-            cursor.execute('''
-                SELECT timestamp, log_type, message, video_file, channel_name
-                FROM streaming_logs 
-                WHERE session_id = ?
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (session_id, limit))
-        else:
-            cursor.execute('''
-                SELECT timestamp, log_type, message, video_file, channel_name
-                FROM streaming_logs 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-        
-        logs = cursor.fetchall()
-        conn.close()
-        return logs
+        rows, _ = query_logs(limit=limit, session_id=session_id)
+        return [(row['timestamp'], row['log_type'], row['message'], row['video_file'], row['channel_name']) for row in rows]
     except Exception as e:
         st.error(f"Error getting logs from database: {e}")
         return []
 
+# Retention: how long rows are kept before they are archived and deleted
+LOG_RETENTION_DAYS = {
+    'FFMPEG': 1,
+    'INFO': 30,
+    'ADAPT': 30,
+    'ERROR': 90
+}
+LOG_RETENTION_DEFAULT_DAYS = 30
+PROGRESS_RETENTION_DAYS = 7
+ROLLUP_RETENTION_DAYS = 30
+STALL_RETENTION_DAYS = 90
+RETENTION_INTERVAL = 3600
+RETENTION_CHUNK_ROWS = 5000
+RETENTION_VACUUM_PAGES = 2000
+RETENTION_ARCHIVE_DIR = Path("log_archive")
+
+class RetentionEngine:
+    """Archive aged-out log, progress, rollup and stall rows to NDJSON.gz, delete them, then compact
+    
+    Work happens one day and one chunk at a time in short transactions, so the
+    log writer never waits long. Each day's rows go to one gzip file per table
+    and log type in the archive directory.
+    
+    Rows live in one table per kind rather than in per-day partitions that
+    could be dropped whole: the log writer, the FTS index triggers, keyset
+    paging and search all address a single table. Expiry is therefore a
+    chunked DELETE per day, and incremental vacuum returns the freed pages.
+    """
+    
+    def __init__(self, db_path=DB_PATH, archive_dir=RETENTION_ARCHIVE_DIR,
+                 log_policies=None, progress_days=PROGRESS_RETENTION_DAYS, rollup_days=ROLLUP_RETENTION_DAYS,
+                 stall_days=STALL_RETENTION_DAYS, interval=RETENTION_INTERVAL):
+        self.db_path = db_path
+        self.archive_dir = Path(archive_dir)
+        self.log_policies = dict(LOG_RETENTION_DAYS if log_policies is None else log_policies)
+        self.progress_days = progress_days
+        self.rollup_days = rollup_days
+        self.stall_days = stall_days
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.running = False
+        self.last_run = None
+        self.last_result = None
+        self.last_error = None
+        self.wake = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        """Run a pass now and every interval after that on a background thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="log-retention", daemon=True)
+            self.thread.start()
+        return self
+    
+    def trigger(self):
+        """Run a retention pass now instead of at the next interval"""
+        self.wake.set()
+    
+    def status(self):
+        with self.lock:
+            return {
+                'running': self.running,
+                'last_run': self.last_run,
+                'last_result': dict(self.last_result) if self.last_result else None,
+                'last_error': self.last_error
+            }
+    
+    def run_once(self):
+        """One full pass; returns archived/deleted row counts and pages vacuumed"""
+        result = {'archived': 0, 'deleted': 0, 'vacuumed_pages': 0}
+        conn = get_db(self.db_path)
+        try:
+            now = datetime.now()
+            for log_type in self._log_types(conn):
+                days = self.log_policies.get(log_type, LOG_RETENTION_DEFAULT_DAYS)
+                self._expire(conn, 'streaming_logs', now - timedelta(days=days), result, log_type=log_type)
+            self._expire(conn, 'ffmpeg_progress', now - timedelta(days=self.progress_days), result)
+            self._expire(conn, 'resource_rollups', now - timedelta(days=self.rollup_days), result, column='bucket_start')
+            self._expire(conn, 'stream_stalls', now - timedelta(days=self.stall_days), result, column='detected_at')
+            if result['deleted']:
+                result['vacuumed_pages'] = self._compact(conn)
+        except BaseException:
+            # The connection outlives this pass: never leave a chunk half-deleted and locked
+            conn.rollback()
+            raise
+        return result
+    
+    def _run(self):
+        while True:
+            with self.lock:
+                self.running = True
+            try:
+                result = self.run_once()
+                with self.lock:
+                    self.last_result = result
+                    self.last_error = None
+            except Exception as e:
+                with self.lock:
+                    self.last_error = str(e)
+            finally:
+                with self.lock:
+                    self.running = False
+                    self.last_run = datetime.now()
+            self.wake.wait(self.interval)
+            self.wake.clear()
+    
+    def _log_types(self, conn):
+        # Walk the (log_type, timestamp) index instead of scanning for DISTINCT
+        log_types = []
+        row = conn.execute("SELECT MIN(log_type) FROM streaming_logs").fetchone()
+        while row and row[0] is not None:
+            log_types.append(row[0])
+            row = conn.execute("SELECT MIN(log_type) FROM streaming_logs WHERE log_type > ?", (row[0],)).fetchone()
+        return log_types
+    
+    def _expire(self, conn, table, cutoff, result, log_type=None, column='timestamp'):
+        """Archive and delete rows whose column is older than cutoff, oldest day first"""
+        type_clause = "AND log_type = ?" if log_type else ""
+        type_params = (log_type,) if log_type else ()
+        cutoff = cutoff.isoformat()
+        row = conn.execute(f"SELECT MIN({column}) FROM {table} WHERE {column} < ? {type_clause}", (cutoff, *type_params)).fetchone()
+        if not row or row[0] is None:
+            return
+        
+        day = datetime.fromisoformat(row[0][:10])
+        suffix = f"-{log_type.lower()}" if log_type else ""
+        while day.isoformat() < cutoff:
+            day_end = min((day + timedelta(days=1)).isoformat(), cutoff)
+            archive_path = self.archive_dir / f"{table}-{day.strftime('%Y-%m-%d')}{suffix}.ndjson.gz"
+            while True:
+                cursor = conn.execute(f'''
+                    SELECT * FROM {table}
+                    WHERE {column} >= ? AND {column} < ? {type_clause}
+                    ORDER BY {column}
+                    LIMIT ?
+                ''', (day.isoformat(), day_end, *type_params, RETENTION_CHUNK_ROWS))
+                columns = [description[0] for description in cursor.description]
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                # Archive first: a crash between the two steps only duplicates archived rows
+                self.archive_dir.mkdir(parents=True, exist_ok=True)
+                with gzip.open(archive_path, "at", encoding="utf-8") as archive:
+                    for values in rows:
+                        archive.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + "\n")
+                ids = [values[columns.index('id')] for values in rows]
+                conn.execute(f"DELETE FROM {table} WHERE id IN ({', '.join('?' for _ in ids)})", ids)
+                conn.commit()
+                result['archived'] += len(rows)
+                result['deleted'] += len(rows)
+            day += timedelta(days=1)
+    
+    def _compact(self, conn):
+        """Return free pages to the filesystem in small steps; needs auto_vacuum=INCREMENTAL"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        vacuumed = 0
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free_pages:
+            # executescript steps the pragma to completion; execute() frees a single page
+            conn.executescript(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})")
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free_pages:
+                break
+            vacuumed += free_pages - remaining
+            free_pages = remaining
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        return vacuumed
+
+@st.cache_resource
+def get_retention_engine():
+    """Process-wide background retention for streaming_logs.db"""
+    return RetentionEngine().start()
+
+def enable_incremental_vacuum(db_path=DB_PATH):
+    """Switch an existing database to incremental auto-vacuum; rewrites the file once"""
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+def retention_cli(argv):
+    """Command line entry point: python app.py retention [--enable-incremental-vacuum]"""
+    parser = argparse.ArgumentParser(prog="app.py retention", description="Archive and delete aged-out log rows, then compact the database")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="one-time VACUUM that lets later passes shrink the file")
+    args = parser.parse_args(argv)
+    
+    init_database()
+    if args.enable_incremental_vacuum and enable_incremental_vacuum():
+        print("🧹 Incremental vacuum enabled")
+    result = RetentionEngine().run_once()
+    print(f"📦 Archived {result['archived']} rows to {RETENTION_ARCHIVE_DIR}/, deleted {result['deleted']}, vacuumed {result['vacuumed_pages']} pages")
+
+# Export: logs stream from one cursor into a gzip file, never into a Python string
+LOG_EXPORT_DIR = Path("log_exports")
+LOG_EXPORT_FORMATS = ("csv", "ndjson")
+LOG_EXPORT_BATCH_ROWS = 1000
+LOG_EXPORT_KEEP = 5
+# gzip's default level 9 is ~5x slower than 6 on log text for a ~1% smaller file
+LOG_EXPORT_COMPRESSLEVEL = 6
+
+def iter_logs(**filters):
+    """Yield matching logs oldest first, fetching LOG_EXPORT_BATCH_ROWS at a time"""
+    clauses, params = build_log_filters(**filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    
+    cursor = get_db().cursor()
+    try:
+        cursor.execute(f'''
+            SELECT {", ".join(LOG_QUERY_COLUMNS)}
+            FROM streaming_logs
+            {where}
+            ORDER BY timestamp, id
+        ''', params)
+        while True:
+            rows = cursor.fetchmany(LOG_EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(LOG_QUERY_COLUMNS, row))
+    finally:
+        cursor.close()
+
+def export_logs(fmt="csv", directory=LOG_EXPORT_DIR, **filters):
+    """Write matching logs to a gzip-compressed CSV or NDJSON file; returns (path, rows)
+    
+    Rows go straight from the cursor to the compressor, so memory stays flat
+    however many rows match. The file appears under its final name only once
+    complete, and only the newest LOG_EXPORT_KEEP exports are kept.
+    """
+    if fmt not in LOG_EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"streaming_logs_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.{fmt}.gz"
+    partial = path.with_name(path.name + ".part")
+    
+    rows = 0
+    try:
+        with gzip.open(partial, "wt", encoding="utf-8", newline="", compresslevel=LOG_EXPORT_COMPRESSLEVEL) as out:
+            if fmt == "csv":
+                writer = csv.writer(out)
+                writer.writerow(LOG_QUERY_COLUMNS)
+                for log in iter_logs(**filters):
+                    writer.writerow(log.values())
+                    rows += 1
+            else:
+                for log in iter_logs(**filters):
+                    out.write(json.dumps(log, ensure_ascii=False) + "\n")
+                    rows += 1
+        partial.replace(path)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    
+    exports = sorted(directory.glob("streaming_logs_*.gz"), key=lambda export: export.stat().st_mtime, reverse=True)
+    for old_export in exports[LOG_EXPORT_KEEP:]:
+        old_export.unlink(missing_ok=True)
+    return path, rows
+
+def export_cli(argv):
+    """Command line entry point: python app.py export [--format ndjson] [--type ERROR] [--since DATE] [--until DATE]"""
+    parser = argparse.ArgumentParser(prog="app.py export", description="Export logs to a gzip-compressed CSV or NDJSON file")
+    parser.add_argument("--format", choices=LOG_EXPORT_FORMATS, default="csv")
+    parser.add_argument("--session", help="only this session id")
+    parser.add_argument("--type", help="only this log type, e.g. ERROR")
+    parser.add_argument("--since", help="ISO date or timestamp, inclusive")
+    parser.add_argument("--until", help="ISO date or timestamp, exclusive")
+    parser.add_argument("--output-dir", type=Path, default=LOG_EXPORT_DIR)
+    args = parser.parse_args(argv)
+    
+    init_database()
+    path, rows = export_logs(args.format, args.output_dir, session_id=args.session, log_type=args.type, since=args.since, until=args.until)
+    print(f"📥 Exported {rows} rows to {path} ({path.stat().st_size / 1024:.1f} KB)")
+
 def save_streaming_session(session_id, video_file, stream_title, stream_description, tags, category, privacy_status, made_for_kids, channel_name):
     """Save streaming session to database"""
     try:
-        conn = sqlite3.connect("streaming_logs.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO streaming_sessions 
-            (session_id, start_time, video_file, stream_title, stream_description, tags, category, privacy_status, made_for_kids, channel_name)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            session_id,
-            datetime.now().isoformat(),
-            video_file,
-            stream_title,
-            stream_description,
-            tags,
-            category,
-            privacy_status,
-            made_for_kids,
-            channel_name
-        ))
-        
-        conn.commit()
-        conn.close()
+        conn = get_db()
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO streaming_sessions 
+                (session_id, start_time, video_file, stream_title, stream_description, tags, category, privacy_status, made_for_kids, channel_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                session_id,
+                datetime.now().isoformat(),
+                video_file,
+                stream_title,
+                stream_description,
+                tags,
+                category,
+                privacy_status,
+                made_for_kids,
+                channel_name
+            ))
     except Exception as e:
         st.error(f"Error saving streaming session: {e}")
 
@@ -539,85 +1350,3422 @@ def get_broadcast_stream_key(service, broadcast_id):
         st.error(f"Error getting broadcast stream key: {e}")
         return None
 
-def get_video_duration(video_path):
-    """Get video duration in seconds using ffprobe."""
-    try:
-        result = subprocess.run(
-            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", video_path],
-            capture_output=True,
-            text=True
-        )
-        return float(result.stdout.strip())
-    except Exception as e:
-        st.warning(f"Tidak dapat membaca durasi video: {e}")
-        return None
+# Media metadata cache
+MEDIA_PROBE_WORKERS = 4
+MEDIA_PROBE_ERRORS_KEEP = 256
+KEYFRAME_SCAN_SECONDS = 30
+
+MEDIA_METADATA_FIELDS = (
+    'format_name', 'duration', 'format_bitrate', 'video_codec', 'video_profile', 'pix_fmt',
+    'width', 'height', 'fps', 'video_bitrate', 'keyframe_interval',
+    'audio_codec', 'audio_bitrate', 'audio_sample_rate', 'audio_channels'
+)
+
+def get_media_key(video_path):
+    """(absolute path, size, mtime) identifying one version of a file, or None if missing"""
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+    return os.path.abspath(video_path), stat.st_size, stat.st_mtime
+
+def probe_media(video_path):
+    """Run ffprobe once and return the metadata the app needs"""
+    def to_number(value, cast):
+        try:
+            return cast(value)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+    
+    def to_rate(value):
+        numerator, _, denominator = (value or "").partition('/')
+        return float(numerator) / float(denominator or 1)
+    
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", video_path],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"ffprobe exited with {result.returncode}")
+    data = json.loads(result.stdout or "{}")
+    media_format = data.get('format', {})
+    streams = data.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), {})
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), {})
+    
+    info = {
+        'format_name': media_format.get('format_name'),
+        'duration': to_number(media_format.get('duration'), float),
+        'format_bitrate': to_number(media_format.get('bit_rate'), int),
+        'video_codec': video.get('codec_name'),
+        'video_profile': video.get('profile'),
+        'pix_fmt': video.get('pix_fmt'),
+        'width': to_number(video.get('width'), int),
+        'height': to_number(video.get('height'), int),
+        'fps': to_number(video.get('avg_frame_rate') or video.get('r_frame_rate'), to_rate),
+        'video_bitrate': to_number(video.get('bit_rate'), int),
+        'keyframe_interval': None,
+        'audio_codec': audio.get('codec_name'),
+        'audio_bitrate': to_number(audio.get('bit_rate'), int),
+        'audio_sample_rate': to_number(audio.get('sample_rate'), int),
+        'audio_channels': to_number(audio.get('channels'), int)
+    }
+    
+    # Average keyframe spacing from packet flags over the first seconds (no decoding)
+    if video:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-read_intervals", f"%+{KEYFRAME_SCAN_SECONDS}",
+             "-show_entries", "packet=pts_time,flags", "-of", "csv=print_section=0", video_path],
+            capture_output=True,
+            text=True
+        )
+        keyframes = []
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and to_number(pts_time, float) is not None:
+                keyframes.append(float(pts_time))
+        if len(keyframes) >= 2:
+            info['keyframe_interval'] = (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+    return info
+
+class MediaProbePool:
+    """Probe media files in parallel and cache the results in memory and SQLite"""
+    
+    def __init__(self, db_path=DB_PATH, max_workers=MEDIA_PROBE_WORKERS):
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ffprobe")
+        self.lock = threading.Lock()
+        self.memo = {}
+        self.pending = {}
+        self.errors = {}
+    
+    def get(self, video_path, wait=False):
+        """Cached metadata for a file; probe in the background (or wait) on a miss"""
+        media_key = get_media_key(video_path)
+        if media_key is None:
+            self.forget([video_path])
+            return None
+        with self.lock:
+            if media_key in self.memo:
+                return self.memo[media_key]
+        
+        info = self._load(media_key)
+        if info:
+            with self.lock:
+                self.memo[media_key] = info
+                self.errors.pop(media_key[0], None)
+            return info
+        
+        future = self._schedule(media_key)
+        if not wait:
+            return None
+        try:
+            return future.result()
+        except Exception:
+            return None
+    
+    def cached(self, media_key):
+        """Metadata already in memory for a (path, size, mtime) key; never touches storage"""
+        with self.lock:
+            return self.memo.get(media_key)
+    
+    def prefetch(self, video_paths):
+        """Queue probes for every file that is not cached yet"""
+        for video_path in video_paths:
+            self.get(video_path)
+    
+    def forget(self, video_paths):
+        """Drop the probe errors of files that no longer exist"""
+        with self.lock:
+            for video_path in video_paths:
+                self.errors.pop(os.path.abspath(video_path), None)
+    
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+    
+    def _load(self, media_key):
+        try:
+            row = get_db(self.db_path).execute(f'''
+                SELECT {", ".join(MEDIA_METADATA_FIELDS)}
+                FROM media_metadata 
+                WHERE path = ? AND size = ? AND mtime = ?
+            ''', media_key).fetchone()
+        except sqlite3.Error:
+            return None
+        return dict(zip(MEDIA_METADATA_FIELDS, row)) if row else None
+    
+    def _store(self, media_key, info):
+        conn = get_db(self.db_path)
+        with conn:
+            # Older versions of the same file are no longer useful
+            conn.execute("DELETE FROM media_metadata WHERE path = ?", (media_key[0],))
+            conn.execute(f'''
+                INSERT INTO media_metadata 
+                (path, size, mtime, {", ".join(MEDIA_METADATA_FIELDS)}, probed_at)
+                VALUES (?, ?, ?, {", ".join("?" for _ in MEDIA_METADATA_FIELDS)}, ?)
+            ''', (*media_key, *(info[field] for field in MEDIA_METADATA_FIELDS), datetime.now().isoformat()))
+    
+    def _probe(self, media_key):
+        try:
+            info = probe_media(media_key[0])
+            self._store(media_key, info)
+            with self.lock:
+                self.memo[media_key] = info
+                self.errors.pop(media_key[0], None)
+            return info
+        except Exception as e:
+            with self.lock:
+                # Re-insert so the oldest errors are the ones evicted
+                self.errors.pop(media_key[0], None)
+                self.errors[media_key[0]] = str(e)
+                while len(self.errors) > MEDIA_PROBE_ERRORS_KEEP:
+                    del self.errors[next(iter(self.errors))]
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(media_key, None)
+    
+    def _schedule(self, media_key):
+        with self.lock:
+            if media_key not in self.pending:
+                self.pending[media_key] = self.executor.submit(self._probe, media_key)
+            return self.pending[media_key]
+
+@st.cache_resource
+def get_media_probe_pool():
+    """Process-wide media metadata cache and ffprobe worker pool"""
+    return MediaProbePool()
+
+def get_media_info(video_path, wait=False):
+    """Cached ffprobe metadata for a video (None while it is still being probed)"""
+    return get_media_probe_pool().get(video_path, wait=wait)
+
+def get_video_duration(video_path, wait=True):
+    """Get video duration in seconds from the media metadata cache."""
+    info = get_media_info(video_path, wait=wait)
+    if info and info['duration']:
+        return info['duration']
+    if wait:
+        error = get_media_probe_pool().errors.get(os.path.abspath(video_path))
+        st.warning(f"Tidak dapat membaca durasi video: {error or 'durasi tidak diketahui'}")
+    return None
+
+# Media library indexed by a background poller
+VIDEO_EXTENSIONS = ('.mp4', '.flv', '.avi', '.mov', '.mkv')
+MEDIA_LIBRARY_ROOT = os.environ.get("MEDIA_LIBRARY_ROOT", ".")
+MEDIA_LIBRARY_POLL_INTERVAL = 10.0
+MEDIA_LIBRARY_FIRST_SCAN_WAIT = 2.0
+
+class MediaLibrary:
+    """In-memory index of the video files under a root directory
+    
+    A background thread rescans the root with os.scandir and compares each
+    file's size and mtime with the index to find added, changed and removed
+    files. New and changed files are probed through the media probe pool.
+    Readers only touch the index, so listing the library never hits storage.
+    """
+    
+    def __init__(self, root=MEDIA_LIBRARY_ROOT, poll_interval=MEDIA_LIBRARY_POLL_INTERVAL, recursive=False):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.recursive = recursive
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.paths = ()
+        self.scanned_at = None
+        self.scan_seconds = None
+        self.last_error = None
+        self.wake = threading.Event()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="media-library", daemon=True)
+        self.thread.start()
+    
+    def set_root(self, root, recursive=None):
+        """Index a different directory from the next scan on"""
+        with self.lock:
+            if root == self.root and (recursive is None or recursive == self.recursive):
+                return
+            self.root = root
+            if recursive is not None:
+                self.recursive = recursive
+            self.entries = {}
+            self.paths = ()
+            self.scanned_at = None
+            self.ready.clear()
+        self.wake.set()
+    
+    def refresh(self):
+        """Rescan now instead of at the next poll"""
+        self.wake.set()
+    
+    def files(self):
+        """Sorted paths of every indexed video"""
+        return self.paths
+    
+    def get(self, path):
+        """Index entry (path, size, mtime, info) for a path, or None"""
+        with self.lock:
+            entry = self.entries.get(path)
+            if not entry:
+                return None
+            entry = dict(entry)
+        if entry['info'] is None:
+            # Pick up a probe that finished since the last scan
+            entry['info'] = get_media_probe_pool().cached((os.path.abspath(path), entry['size'], entry['mtime']))
+            if entry['info']:
+                with self.lock:
+                    if path in self.entries:
+                        self.entries[path]['info'] = entry['info']
+        return entry
+    
+    def wait_ready(self, timeout):
+        """Wait up to timeout seconds for the first scan of the current root"""
+        return self.ready.wait(timeout)
+    
+    def add(self, path):
+        """Index a file right away (e.g. after an upload) instead of waiting for the poller"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        path = os.path.normpath(path)
+        with self.lock:
+            self.entries[path] = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'info': None}
+            self.paths = tuple(sorted(self.entries))
+        get_media_probe_pool().get(path)
+    
+    def stats(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            return {
+                'root': self.root,
+                'files': len(entries),
+                'total_bytes': sum(entry['size'] for entry in entries),
+                'unprobed': sum(1 for entry in entries if entry['info'] is None),
+                'scanned_at': self.scanned_at,
+                'scan_seconds': self.scan_seconds,
+                'last_error': self.last_error
+            }
+    
+    def _run(self):
+        while True:
+            try:
+                self._scan()
+            except Exception as e:
+                with self.lock:
+                    self.last_error = str(e)
+                # Unreadable root: show the error instead of waiting for a scan
+                self.ready.set()
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+    
+    def _walk(self, root, recursive):
+        # scandir reuses the directory listing, so only matching files are stat'ed
+        directories = [root]
+        while directories:
+            directory = directories.pop()
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    try:
+                        if entry.is_dir():
+                            if recursive and not entry.name.startswith('.'):
+                                directories.append(entry.path)
+                        elif entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                            stat = entry.stat()
+                            yield os.path.normpath(entry.path), stat.st_size, stat.st_mtime
+                    except OSError:
+                        continue
+    
+    def _scan(self):
+        started = time.monotonic()
+        with self.lock:
+            root, recursive = self.root, self.recursive
+            previous = dict(self.entries)
+        
+        probe_pool = get_media_probe_pool()
+        entries = {}
+        for path, size, mtime in self._walk(root, recursive):
+            entry = previous.get(path)
+            if entry and entry['size'] == size and entry['mtime'] == mtime:
+                if entry['info'] is None:
+                    # Probes finished since the last scan are already in memory
+                    entry = dict(entry, info=probe_pool.cached((os.path.abspath(path), size, mtime)))
+                entries[path] = entry
+            else:
+                # New or changed: metadata from the probe cache, misses are probed in the background
+                entries[path] = {'path': path, 'size': size, 'mtime': mtime, 'info': probe_pool.get(path)}
+        
+        probe_pool.forget(previous.keys() - entries.keys())
+        with self.lock:
+            if root != self.root or recursive != self.recursive:
+                return
+            self.entries = entries
+            self.paths = tuple(sorted(entries))
+            self.scanned_at = datetime.now()
+            self.scan_seconds = time.monotonic() - started
+            self.last_error = None
+        self.ready.set()
+
+@st.cache_resource
+def get_media_library():
+    """Process-wide media library index"""
+    return MediaLibrary()
+
+# Upload ingestion into a content-addressed store inside the library root
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_STORE_DIR = ".media_store"
+
+def find_stored_upload(sha256=None, size=None):
+    """Store paths of ingested uploads by content hash, or every one with a given size"""
+    try:
+        cursor = get_db().cursor()
+        if sha256:
+            cursor.execute("SELECT store_path FROM uploaded_media WHERE sha256 = ?", (sha256,))
+        else:
+            cursor.execute("SELECT store_path FROM uploaded_media WHERE size = ?", (size,))
+        rows = cursor.fetchall()
+    except sqlite3.Error:
+        return []
+    return [row[0] for row in rows if os.path.exists(row[0])]
+
+def link_upload(store_path, target_path):
+    """Point target_path at stored content: hardlink, or copy where links are unsupported"""
+    if os.path.exists(target_path) and os.path.samefile(store_path, target_path):
+        return
+    temp_path = f"{target_path}.{os.getpid()}.link"
+    try:
+        os.link(store_path, temp_path)
+    except OSError:
+        shutil.copyfile(store_path, temp_path)
+    os.replace(temp_path, target_path)
+
+def ingest_upload(uploaded_file, root):
+    """Write an uploaded file into the library once; returns (path, status)
+    
+    Content is streamed to disk in chunks while it is hashed and stored as
+    .media_store/<sha256><ext>; the visible file is a hardlink to it. Content
+    that was ingested before is only linked, never written again. status is
+    "stored" or "duplicate".
+    """
+    target_path = os.path.normpath(os.path.join(root, os.path.basename(uploaded_file.name)))
+    extension = os.path.splitext(target_path)[1].lower()
+    store_dir = os.path.join(root, UPLOAD_STORE_DIR)
+    os.makedirs(store_dir, exist_ok=True)
+    
+    def chunks():
+        uploaded_file.seek(0)
+        for chunk in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_SIZE), b""):
+            yield chunk
+    
+    # Identical content must have the same size; only then hash before deciding to write
+    sha256 = None
+    if find_stored_upload(size=uploaded_file.size):
+        digest = hashlib.sha256()
+        for chunk in chunks():
+            digest.update(chunk)
+        sha256 = digest.hexdigest()
+        existing = find_stored_upload(sha256=sha256)
+        if existing:
+            link_upload(existing[0], target_path)
+            return target_path, "duplicate"
+    
+    # Stream to a temporary file in the store, hashing along the way, unless
+    # the hash is already known and its content is on disk without a row
+    status = "stored"
+    temp_path = os.path.join(store_dir, f".incoming-{os.getpid()}-{threading.get_ident()}")
+    try:
+        if sha256 is None or not os.path.exists(os.path.join(store_dir, sha256 + extension)):
+            digest = hashlib.sha256()
+            with open(temp_path, "wb") as f:
+                for chunk in chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            sha256 = digest.hexdigest()
+        store_path = os.path.join(store_dir, sha256 + extension)
+        # Stored content is immutable: never copy over it, just link to it
+        if os.path.exists(store_path):
+            status = "duplicate"
+        else:
+            os.replace(temp_path, store_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    conn = get_db()
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO uploaded_media (sha256, size, store_path, original_name, ingested_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (sha256, uploaded_file.size, store_path, uploaded_file.name, datetime.now().isoformat()))
+    
+    link_upload(store_path, target_path)
+    return target_path, status
+
+# Default encoding profile used when no video settings are provided
+DEFAULT_VIDEO_SETTINGS = {
+    "resolution": "1080p",
+    "bitrate": "2500k",
+    "fps": "30",
+    "codec": "libx264",
+    "audio_bitrate": "128k",
+    "audio_codec": "aac"
+}
+
+# Output frame size for each resolution option
+RESOLUTION_SIZES = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "2160p": (3840, 2160)
+}
+
+def get_output_size(video_settings, is_shorts=False):
+    """(width, height) a stream is encoded at"""
+    if is_shorts:
+        return 720, 1280
+    return RESOLUTION_SIZES.get(video_settings.get("resolution"), (1920, 1080))
+
+def build_encoding_args(video_settings, is_shorts=False, threads=None, normalize=False, copy_video=False, copy_audio=False):
+    """Build FFmpeg output arguments for an encoding profile
+    
+    normalize scales/pads every frame to the profile size and resamples audio,
+    for inputs whose parameters change mid-stream (playlists). copy_video and
+    copy_audio pass those streams through untouched.
+    """
+    if copy_video:
+        args = ["-c:v", "copy"]
+    else:
+        args = [
+            "-c:v", video_settings["codec"], "-preset", video_settings.get("preset", "veryfast"), 
+            "-b:v", video_settings["bitrate"], "-maxrate", video_settings["bitrate"],
+            "-bufsize", str(int(video_settings["bitrate"].replace('k', '')) * 2) + "k",
+            "-r", video_settings["fps"], "-g", str(int(video_settings["fps"]) * 2),
+            "-keyint_min", str(int(video_settings["fps"]) * 2)
+        ]
+    if copy_audio:
+        args.extend(["-c:a", "copy"])
+    else:
+        args.extend(["-c:a", video_settings["audio_codec"], "-b:a", video_settings["audio_bitrate"]])
+    if copy_video:
+        return args
+    
+    # Add scaling for Shorts mode if enabled
+    if normalize:
+        width, height = get_output_size(video_settings, is_shorts)
+        args.extend([
+            "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1",
+            "-ar", "44100", "-ac", "2"
+        ])
+    elif is_shorts:
+        args.extend(["-vf", "scale=720:1280"])
+    elif video_settings.get("max_height"):
+        # Reduced adaptive tiers cap the frame height and keep the aspect ratio
+        args.extend(["-vf", f"scale=-2:'min({video_settings['max_height']},ih)',setsar=1"])
+    
+    # Match encoder threads to the cores this stream was given
+    if threads:
+        args.extend(["-threads", str(threads)])
+        if video_settings["codec"] == "libx264":
+            args.extend(["-x264-params", f"threads={threads}"])
+        elif video_settings["codec"] == "libx265":
+            args.extend(["-x265-params", f"pools={threads}"])
+    return args
+
+# Stream-copy passthrough for sources that already match the target profile
+PASSTHROUGH_MAX_BITRATE_RATIO = 1.5
+PASSTHROUGH_MAX_KEYFRAME_INTERVAL = 4.0
+PASSTHROUGH_FPS_TOLERANCE = 0.5
+PASSTHROUGH_H264_PROFILES = ("Constrained Baseline", "Baseline", "Main", "High")
+PASSTHROUGH_SAMPLE_RATES = (44100, 48000)
+
+# Source codec each target encoder can hand to FLV unchanged (HEVC has no classic FLV mapping)
+PASSTHROUGH_CODECS = {
+    "libx264": "h264",
+    "aac": "aac"
+}
+
+def parse_bitrate(value):
+    """Bits per second from a setting such as "2500k" """
+    value = str(value).strip().lower()
+    if value.endswith('k'):
+        return int(float(value[:-1]) * 1000)
+    if value.endswith('m'):
+        return int(float(value[:-1]) * 1000000)
+    return int(float(value))
+
+def analyze_passthrough(media_info, video_settings, is_shorts=False):
+    """Decide which streams of a source can be copied instead of encoded
+    
+    Returns {'video': bool, 'audio': bool, 'reasons': [...]}, where reasons
+    explain why a stream still has to be encoded.
+    """
+    if not media_info:
+        return {'video': False, 'audio': False, 'reasons': ["no media metadata"]}
+    reasons = []
+    
+    video_reasons = []
+    if PASSTHROUGH_CODECS.get(video_settings["codec"]) != media_info['video_codec']:
+        video_reasons.append(f"video codec {media_info['video_codec']} ≠ {video_settings['codec']}")
+    elif media_info['video_profile'] not in PASSTHROUGH_H264_PROFILES:
+        video_reasons.append(f"H.264 profile {media_info['video_profile']}")
+    if media_info['pix_fmt'] != "yuv420p":
+        video_reasons.append(f"pixel format {media_info['pix_fmt']}")
+    if (media_info['width'], media_info['height']) != get_output_size(video_settings, is_shorts):
+        video_reasons.append(f"resolution {media_info['width']}x{media_info['height']}")
+    if media_info['fps'] is None or abs(media_info['fps'] - int(video_settings["fps"])) > PASSTHROUGH_FPS_TOLERANCE:
+        video_reasons.append(f"{(media_info['fps'] or 0):.2f} fps")
+    video_bitrate = media_info['video_bitrate'] or (
+        media_info['format_bitrate'] - (media_info['audio_bitrate'] or 0) if media_info['format_bitrate'] else None
+    )
+    if video_bitrate is None or video_bitrate > parse_bitrate(video_settings["bitrate"]) * PASSTHROUGH_MAX_BITRATE_RATIO:
+        video_reasons.append(f"video bitrate {round(video_bitrate / 1000) if video_bitrate else '?'}k")
+    if media_info['keyframe_interval'] is None or media_info['keyframe_interval'] > PASSTHROUGH_MAX_KEYFRAME_INTERVAL:
+        video_reasons.append(f"keyframe interval {media_info['keyframe_interval'] or '?'}s")
+    reasons.extend(video_reasons)
+    
+    # A source without audio has nothing to encode
+    audio_reasons = []
+    if media_info['audio_codec']:
+        if PASSTHROUGH_CODECS.get(video_settings["audio_codec"]) != media_info['audio_codec']:
+            audio_reasons.append(f"audio codec {media_info['audio_codec']} ≠ {video_settings['audio_codec']}")
+        if media_info['audio_sample_rate'] not in PASSTHROUGH_SAMPLE_RATES:
+            audio_reasons.append(f"sample rate {media_info['audio_sample_rate']}")
+        if not media_info['audio_channels'] or media_info['audio_channels'] > 2:
+            audio_reasons.append(f"{media_info['audio_channels']} audio channels")
+        if media_info['audio_bitrate'] and media_info['audio_bitrate'] > parse_bitrate(video_settings["audio_bitrate"]) * PASSTHROUGH_MAX_BITRATE_RATIO:
+            audio_reasons.append(f"audio bitrate {round(media_info['audio_bitrate'] / 1000)}k")
+    reasons.extend(audio_reasons)
+    
+    return {'video': not video_reasons, 'audio': not audio_reasons, 'reasons': reasons}
+
+def get_passthrough_bitstream_filters(media_info, plan):
+    """Bitstream filters FLV needs for copied streams"""
+    # ADTS AAC (MPEG-TS, raw .aac) must become an AudioSpecificConfig stream in FLV
+    if plan['audio'] and media_info and media_info['audio_codec'] == "aac":
+        if any(name in (media_info['format_name'] or "").split(',') for name in ("mpegts", "aac")):
+            return ["-bsf:a", "aac_adtstoasc"]
+    return []
+
+def describe_passthrough(plan):
+    """Short label for the encode mode shown in the batch status"""
+    if plan['video'] and plan['audio']:
+        return "⏩ passthrough (video + audio copy)"
+    if plan['video']:
+        return "⏩ video copy, audio encode"
+    if plan['audio']:
+        return "🎛️ video encode, audio copy"
+    return "🎛️ encode"
+
+# Gapless playlist streaming
+PLAYLIST_SCHEME = "playlist://"
+PLAYLIST_DIR = Path("playlists")
+# Codecs the MPEG-TS pipe can carry as-is; anything else is re-encoded by the feeder
+PLAYLIST_TS_VIDEO_CODECS = {'h264', 'hevc', 'mpeg2video'}
+PLAYLIST_TS_AUDIO_CODECS = {'aac', 'mp3', 'mp2', 'ac3'}
+
+def is_playlist_source(video_path):
+    return str(video_path).startswith(PLAYLIST_SCHEME)
+
+class PlaylistStore:
+    """Ordered or shuffled playlists that can be edited while their stream runs"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.playlists = {}
+    
+    def update(self, playlist_id, items, shuffle=False):
+        """Create or edit a playlist; a running stream picks it up at the next item"""
+        items = list(items)
+        with self.lock:
+            playlist = self.playlists.get(playlist_id)
+            if playlist and playlist['items'] == items and playlist['shuffle'] == shuffle:
+                return False
+            if not playlist:
+                playlist = self.playlists[playlist_id] = {'current': None, 'played': 0, 'passes': 0}
+            playlist['items'] = items
+            playlist['shuffle'] = shuffle
+            playlist['order'] = self._new_pass(items, shuffle, after=playlist['current'])
+        # Probe queued items now so the feeder finds their codecs in the cache
+        get_media_probe_pool().prefetch(items)
+        return True
+    
+    def next_item(self, playlist_id):
+        """Pop the next item, starting a new (re-shuffled) pass when one ends"""
+        with self.lock:
+            playlist = self.playlists.get(playlist_id)
+            if not playlist or not playlist['items']:
+                return None
+            if not playlist['order']:
+                playlist['order'] = self._new_pass(playlist['items'], playlist['shuffle'])
+                playlist['passes'] += 1
+            playlist['current'] = playlist['order'].pop(0)
+            playlist['played'] += 1
+            return playlist['current']
+    
+    def get(self, playlist_id):
+        with self.lock:
+            playlist = self.playlists.get(playlist_id)
+            return dict(playlist, order=list(playlist['order'])) if playlist else None
+    
+    def _new_pass(self, items, shuffle, after=None):
+        if shuffle:
+            order = random.sample(items, len(items))
+        elif after in items:
+            # Continue after the item that is playing now
+            index = items.index(after) + 1
+            order = items[index:]
+        else:
+            order = list(items)
+        return order
+
+@st.cache_resource
+def get_playlist_store():
+    """Process-wide playlists shared by the UI and the stream feeders"""
+    return PlaylistStore()
+
+def get_playlist_fifo(playlist_id):
+    """Named pipe the playlist feeder writes MPEG-TS into"""
+    PLAYLIST_DIR.mkdir(exist_ok=True)
+    fifo_path = PLAYLIST_DIR / (hashlib.sha1(playlist_id.encode()).hexdigest()[:16] + ".ts")
+    if not fifo_path.exists():
+        os.mkfifo(fifo_path)
+    return fifo_path
+
+def feed_playlist(playlist_id, fifo_path, stop_event, log_callback, batch_index=0):
+    """Remux playlist items back to back into the encoder's input pipe
+    
+    Each item is stream-copied to MPEG-TS with its timestamps shifted past the
+    previous item, so the encoder sees one continuous input and the RTMP
+    session is never interrupted. Streams in codecs MPEG-TS cannot carry are
+    re-encoded; items that cannot be probed or played are skipped for the
+    rest of the pass.
+    """
+    store = get_playlist_store()
+    
+    # Wait for the encoder to open the pipe without blocking forever if it never does
+    fd = None
+    while fd is None and not stop_event.is_set():
+        try:
+            fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            stop_event.wait(0.2)
+    if fd is None:
+        return
+    os.set_blocking(fd, True)
+    
+    offset = 0.0
+    skipped = {}
+    try:
+        while not stop_event.is_set():
+            item = store.next_item(playlist_id)
+            if not item:
+                stop_event.wait(1)
+                continue
+            current_pass = store.get(playlist_id)['passes']
+            if skipped.get(item) == current_pass:
+                # Everything may be unplayable: don't spin through the playlist
+                stop_event.wait(0.1)
+                continue
+            if not os.path.exists(item):
+                log_callback(f"⚠️ Batch {batch_index}: Playlist item missing, skipped: {item}")
+                skipped[item] = current_pass
+                continue
+            info = get_media_info(item, wait=True)
+            if not info or not info['video_codec']:
+                error = get_media_probe_pool().errors.get(os.path.abspath(item))
+                log_callback(f"⚠️ Batch {batch_index}: Cannot read {item}, skipped this pass: {error or 'no video stream'}")
+                skipped[item] = current_pass
+                continue
+            
+            copy_video = info['video_codec'] in PLAYLIST_TS_VIDEO_CODECS
+            copy_audio = not info['audio_codec'] or info['audio_codec'] in PLAYLIST_TS_AUDIO_CODECS
+            codec_args = ["-c:v", "copy"] if copy_video else ["-c:v", "libx264", "-preset", "veryfast"]
+            codec_args += ["-c:a", "copy"] if copy_audio else ["-c:a", "aac"]
+            if not (copy_video and copy_audio):
+                log_callback(f"🔄 Batch {batch_index}: {info['video_codec']}/{info['audio_codec']} does not fit MPEG-TS, re-encoding {item}")
+            
+            log_callback(f"▶️ Batch {batch_index}: Now playing {item}")
+            started = time.monotonic()
+            result = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", item,
+                 "-map", "0:v:0", "-map", "0:a:0?", *codec_args,
+                 "-output_ts_offset", f"{offset:.3f}", "-f", "mpegts", "pipe:1"],
+                stdout=fd,
+                stderr=subprocess.PIPE,
+                text=True,
+                errors='replace'
+            )
+            if stop_event.is_set():
+                break
+            if result.returncode != 0:
+                log_callback(f"⚠️ Batch {batch_index}: Could not play {item}, skipped this pass: {result.stderr.strip()[-200:]}")
+                skipped[item] = current_pass
+                stop_event.wait(1)
+                continue
+            offset += info['duration'] or (time.monotonic() - started)
+    finally:
+        os.close(fd)
+
+# Pre-transcode cache
+TRANSCODE_CACHE_DIR = Path("transcode_cache")
+TRANSCODE_CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+@st.cache_data(show_spinner=False)
+def hash_file_content(path, size, mtime):
+    """SHA-256 of a file's content; size and mtime only invalidate the memo"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_transcode_cache_key(video_path, video_settings, is_shorts=False):
+    """Cache key from the source content hash plus the encoding profile"""
+    stat = os.stat(video_path)
+    content_hash = hash_file_content(os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+    profile = json.dumps({'settings': video_settings, 'is_shorts': is_shorts}, sort_keys=True)
+    return hashlib.sha256(f"{content_hash}:{profile}".encode()).hexdigest()[:32]
+
+def lookup_transcode_cache(cache_key):
+    """Return the cached file path for a key and mark it as recently used"""
+    try:
+        conn = get_db()
+        with conn:
+            row = conn.execute('''
+                SELECT cache_path FROM transcode_cache WHERE cache_key = ?
+            ''', (cache_key,)).fetchone()
+            
+            if row and os.path.exists(row[0]):
+                conn.execute('''
+                    UPDATE transcode_cache SET last_used = ? WHERE cache_key = ?
+                ''', (datetime.now().isoformat(), cache_key))
+                return row[0]
+            
+            # Forget entries whose file disappeared
+            if row:
+                conn.execute("DELETE FROM transcode_cache WHERE cache_key = ?", (cache_key,))
+            return None
+    except Exception:
+        return None
+
+def find_transcode_cache_entry(video_path, video_settings, is_shorts=False):
+    """Cached copy of a source and profile from the cache index alone; never hashes the file
+    
+    Entries created before the source's last modification are ignored. For
+    quick answers such as admission estimates; the encoder itself still looks
+    the copy up by content hash.
+    """
+    try:
+        settings = json.dumps({'settings': video_settings, 'is_shorts': is_shorts}, sort_keys=True)
+        row = get_db().execute('''
+            SELECT cache_path, created_at FROM transcode_cache
+            WHERE source_path = ? AND settings = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        ''', (video_path, settings)).fetchone()
+        if not row or not os.path.exists(row[0]):
+            return None
+        if datetime.fromisoformat(row[1]).timestamp() < os.path.getmtime(video_path):
+            return None
+        return row[0]
+    except (sqlite3.Error, OSError, ValueError):
+        return None
+
+def get_transcode_cache_stats():
+    """Return entry count and total size of the transcode cache"""
+    try:
+        count, total_bytes = get_db().execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM transcode_cache").fetchone()
+        return {'entries': count, 'size_bytes': total_bytes}
+    except Exception:
+        return {'entries': 0, 'size_bytes': 0}
+
+def evict_transcode_cache(max_bytes=TRANSCODE_CACHE_MAX_BYTES):
+    """Delete least recently used cache entries until the cache fits its size cap"""
+    conn = get_db()
+    entries = conn.execute("SELECT cache_key, cache_path, size_bytes FROM transcode_cache ORDER BY last_used ASC").fetchall()
+    total_bytes = sum(entry[2] for entry in entries)
+    
+    evicted = []
+    with conn:
+        for cache_key, cache_path, size_bytes in entries:
+            if total_bytes <= max_bytes:
+                break
+            # Running streams keep an open handle, so unlinking is safe on POSIX
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            conn.execute("DELETE FROM transcode_cache WHERE cache_key = ?", (cache_key,))
+            total_bytes -= size_bytes
+            evicted.append(cache_key)
+    return evicted
+
+class TranscodeWorker:
+    """Encode (video, profile) pairs into the cache one at a time in the background"""
+    
+    def __init__(self, cache_dir=TRANSCODE_CACHE_DIR, max_bytes=TRANSCODE_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, name="transcode-worker", daemon=True)
+        self.thread.start()
+    
+    def schedule(self, cache_key, video_path, video_settings, is_shorts=False):
+        """Queue a pre-transcode unless the same key is already pending"""
+        with self.lock:
+            if cache_key in self.pending:
+                return False
+            self.pending.add(cache_key)
+        self.queue.put((cache_key, video_path, video_settings, is_shorts))
+        return True
+    
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+    
+    def _transcode(self, cache_key, video_path, video_settings, is_shorts):
+        self.cache_dir.mkdir(exist_ok=True)
+        cache_path = self.cache_dir / f"{cache_key}.flv"
+        partial_path = self.cache_dir / f"{cache_key}.flv.part"
+        
+        cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", video_path]
+        cmd.extend(build_encoding_args(video_settings, is_shorts))
+        cmd.extend(["-f", "flv", str(partial_path)])
+        
+        # Run below live encoders so pre-transcoding never starves running streams
+        result = subprocess.run(cmd, capture_output=True, text=True, preexec_fn=lambda: os.nice(10))
+        if result.returncode != 0:
+            if partial_path.exists():
+                partial_path.unlink()
+            raise RuntimeError(result.stderr.strip()[-500:] or f"ffmpeg exited with {result.returncode}")
+        os.replace(partial_path, cache_path)
+        
+        now = datetime.now().isoformat()
+        conn = get_db()
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO transcode_cache 
+                (cache_key, source_path, settings, cache_path, size_bytes, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                cache_key,
+                video_path,
+                json.dumps({'settings': video_settings, 'is_shorts': is_shorts}, sort_keys=True),
+                str(cache_path),
+                cache_path.stat().st_size,
+                now,
+                now
+            ))
+        evict_transcode_cache(self.max_bytes)
+    
+    def _run(self):
+        while True:
+            cache_key, video_path, video_settings, is_shorts = self.queue.get()
+            try:
+                self._transcode(cache_key, video_path, video_settings, is_shorts)
+            except Exception as e:
+                self.last_error = f"{video_path}: {e}"
+            finally:
+                with self.lock:
+                    self.pending.discard(cache_key)
+
+@st.cache_resource
+def get_transcode_worker():
+    """Process-wide pre-transcode worker"""
+    return TranscodeWorker()
+
+# CPU-aware admission control
+ADMISSION_CPU_THRESHOLD = 0.85
+ADMISSION_POLL_INTERVAL = 2.0
+ADMISSION_WARMUP_SECONDS = 15
+ADMISSION_LEARNING_RATE = 0.2
+
+# Cores needed by a 1080p30 libx264 "faster" encode; other profiles scale from it
+BASE_ENCODE_CORES = 2.0
+STREAM_COPY_CORES = 0.05
+PRESET_COST_FACTORS = {
+    "ultrafast": 0.35,
+    "superfast": 0.5,
+    "veryfast": 0.7,
+    "faster": 1.0,
+    "fast": 1.3,
+    "medium": 1.6
+}
+CODEC_COST_FACTORS = {
+    "libx264": 1.0,
+    "libx265": 3.0
+}
+
+def get_encoding_profile(video_settings, is_shorts=False, stream_copy=False):
+    """Identify the encoding profile used to learn per-profile stream costs"""
+    if stream_copy:
+        return "copy"
+    resolution = "720x1280" if is_shorts else video_settings.get("resolution", "1080p")
+    return f"{video_settings['codec']}/{video_settings.get('preset', 'veryfast')}/{resolution}/{video_settings['fps']}"
+
+def estimate_stream_cost(video_settings, is_shorts=False, stream_copy=False):
+    """Estimate the CPU cores one stream needs from its encoding settings"""
+    if stream_copy:
+        return STREAM_COPY_CORES
+    width, height = get_output_size(video_settings, is_shorts)
+    pixels = width * height
+    return (
+        BASE_ENCODE_CORES
+        * (pixels / (1920 * 1080))
+        * (int(video_settings["fps"]) / 30)
+        * PRESET_COST_FACTORS.get(video_settings.get("preset", "veryfast"), 1.0)
+        * CODEC_COST_FACTORS.get(video_settings["codec"], 1.0)
+    )
+
+class CapacityPlanner:
+    """Admit streams while projected CPU use stays under a threshold, queue the rest"""
+    
+    def __init__(self, total_cores=None, threshold=ADMISSION_CPU_THRESHOLD):
+        self.total_cores = total_cores or psutil.cpu_count(logical=True) or 1
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.running = {}
+        self.waiting = []
+        # Measured/estimated cost ratio per encoding profile, seeded from the host benchmark
+        self.learned = load_benchmark_cost_factors()
+        self.thread = threading.Thread(target=self._run, name="capacity-planner", daemon=True)
+        self.thread.start()
+    
+    def estimate(self, video_settings, is_shorts=False, stream_copy=False):
+        """Return (profile, cores) for a stream, corrected by what was measured so far"""
+        profile = get_encoding_profile(video_settings, is_shorts, stream_copy)
+        base_cost = estimate_stream_cost(video_settings, is_shorts, stream_copy)
+        with self.lock:
+            return profile, base_cost * self.learned.get(profile, 1.0)
+    
+    def update_cost_factors(self, factors):
+        """Replace learned cost ratios with new measurements, e.g. from a benchmark"""
+        with self.lock:
+            self.learned.update(factors)
+    
+    def submit(self, job_key, video_settings, start_fn, is_shorts=False, stream_copy=False):
+        """Start a job now if capacity allows; return 0 when started or its queue position"""
+        profile, cost = self.estimate(video_settings, is_shorts, stream_copy)
+        job = {
+            'job_key': job_key,
+            'profile': profile,
+            'base_cost': estimate_stream_cost(video_settings, is_shorts, stream_copy),
+            'cost': cost,
+            'start_fn': start_fn,
+            'queued_at': datetime.now()
+        }
+        with self.lock:
+            self.waiting.append(job)
+        self._dispatch()
+        with self.lock:
+            for position, waiting_job in enumerate(self.waiting, start=1):
+                if waiting_job is job:
+                    return position
+        return 0
+    
+    def attach_process(self, job_key, pid):
+        """Associate a running job with its encoder PID for CPU measurement"""
+        with self.lock:
+            if job_key in self.running:
+                self.running[job_key]['pid'] = pid
+                self.running[job_key]['process'] = None
+    
+    def update_job(self, job_key, video_settings, is_shorts=False):
+        """Re-profile a running job whose encoder settings changed"""
+        profile, cost = self.estimate(video_settings, is_shorts)
+        with self.lock:
+            job = self.running.get(job_key)
+            if not job:
+                return
+            job['profile'] = profile
+            job['base_cost'] = estimate_stream_cost(video_settings, is_shorts)
+            job['cost'] = cost
+            job['measured'] = None
+            # Learn nothing until the new encoder has warmed up
+            job['started_at'] = time.monotonic()
+        self._dispatch()
+    
+    def release(self, job_key):
+        """Free a finished job's capacity and start queued jobs that now fit"""
+        with self.lock:
+            self.running.pop(job_key, None)
+        self._dispatch()
+    
+    def cancel(self, job_key):
+        """Remove a job from the queue before it was admitted"""
+        with self.lock:
+            self.waiting = [job for job in self.waiting if job['job_key'] != job_key]
+    
+    def projected_load(self):
+        with self.lock:
+            return self._projected_load_locked()
+    
+    def snapshot(self):
+        """Running jobs, queue positions and projected load for the status panel"""
+        with self.lock:
+            return {
+                'total_cores': self.total_cores,
+                'threshold': self.threshold,
+                'projected_load': self._projected_load_locked(),
+                'running': [
+                    {'job_key': key, 'profile': job['profile'], 'cost': job['cost'], 'measured': job.get('measured')}
+                    for key, job in self.running.items()
+                ],
+                'waiting': [
+                    {'job_key': job['job_key'], 'position': position, 'cost': job['cost'], 'queued_at': job['queued_at']}
+                    for position, job in enumerate(self.waiting, start=1)
+                ]
+            }
+    
+    def _projected_load_locked(self):
+        return sum(max(job['cost'], job.get('measured') or 0) for job in self.running.values())
+    
+    def _dispatch(self):
+        # Strict FIFO so queue positions stay meaningful
+        to_start = []
+        with self.lock:
+            while self.waiting:
+                job = self.waiting[0]
+                load = self._projected_load_locked()
+                fits = (load + job['cost']) / self.total_cores <= self.threshold
+                # An idle host always takes the next job so oversized jobs never starve
+                if not fits and self.running:
+                    break
+                self.waiting.pop(0)
+                job['started_at'] = time.monotonic()
+                self.running[job['job_key']] = job
+                to_start.append(job)
+        
+        for job in to_start:
+            try:
+                job['start_fn']()
+            except Exception:
+                self.release(job['job_key'])
+    
+    def _sample(self):
+        with self.lock:
+            jobs = [(job_key, job, job['pid'], job.get('process')) for job_key, job in self.running.items() if job.get('pid')]
+        
+        for job_key, job, pid, process in jobs:
+            try:
+                if process is None:
+                    process = psutil.Process(pid)
+                    process.cpu_percent(None)
+                    measured = None
+                else:
+                    measured = process.cpu_percent(None) / 100
+            except psutil.Error:
+                continue
+            
+            with self.lock:
+                # The job may have been released or re-attached to a new encoder meanwhile
+                if self.running.get(job_key) is not job or job.get('pid') != pid:
+                    continue
+                if measured is None:
+                    job['process'] = process
+                    continue
+                job['measured'] = measured
+                if time.monotonic() - job['started_at'] < ADMISSION_WARMUP_SECONDS or job['base_cost'] <= 0:
+                    continue
+                ratio = measured / job['base_cost']
+                previous = self.learned.get(job['profile'], 1.0)
+                self.learned[job['profile']] = previous + ADMISSION_LEARNING_RATE * (ratio - previous)
+    
+    def _run(self):
+        while True:
+            time.sleep(ADMISSION_POLL_INTERVAL)
+            self._sample()
+            self._dispatch()
+
+@st.cache_resource
+def get_capacity_planner():
+    """Process-wide admission controller shared by every session"""
+    return CapacityPlanner()
+
+# Encoder benchmark
+BENCHMARK_CLIP_SECONDS = 20
+BENCHMARK_MAX_CLIPS = 2
+BENCHMARK_PROBE_LIMIT = 8
+BENCHMARK_MEMORY_HEADROOM = 0.8
+
+# Default profile matrix; every combination is encoded once per clip
+BENCHMARK_MATRIX = {
+    "codec": ["libx264"],
+    "preset": ["ultrafast", "veryfast", "faster"],
+    "resolution": ["720p", "1080p"],
+    "fps": ["30", "60"],
+    "bitrate": ["2500k", "6000k"]
+}
+
+def iter_benchmark_settings(matrix=None):
+    """Video settings for every combination in the benchmark matrix"""
+    matrix = {**BENCHMARK_MATRIX, **(matrix or {})}
+    keys = list(BENCHMARK_MATRIX)
+    for values in itertools.product(*(matrix[key] for key in keys)):
+        yield {**DEFAULT_VIDEO_SETTINGS, **dict(zip(keys, values))}
+
+def select_benchmark_clips(max_clips=BENCHMARK_MAX_CLIPS, probe_limit=BENCHMARK_PROBE_LIMIT):
+    """Pick representative library clips: the highest resolutions first, one per resolution
+    
+    Uses metadata the library has already probed, and waits for at most
+    probe_limit uncached files while fewer than max_clips resolutions are known.
+    """
+    candidates = {}
+    
+    def consider(name, info):
+        if info and info['height']:
+            best = candidates.get(info['height'])
+            duration = info['duration'] or 0
+            if best is None or (duration, name) > best:
+                candidates[info['height']] = (duration, name)
+    
+    uncached = []
+    for name in get_media_library().files():
+        if name.lower().endswith(VIDEO_EXTENSIONS):
+            info = get_media_info(name)
+            if info is None:
+                uncached.append(name)
+            consider(name, info)
+    for name in uncached[:probe_limit]:
+        if len(candidates) >= max_clips:
+            break
+        consider(name, get_media_info(name, wait=True))
+    return [candidates[height][1] for height in sorted(candidates, reverse=True)[:max_clips]]
+
+def benchmark_profile(clip, video_settings, seconds=BENCHMARK_CLIP_SECONDS):
+    """Encode part of a clip as fast as possible into the null muxer and measure the cost"""
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-stream_loop", "-1", "-t", str(seconds), "-i", clip]
+    cmd.extend(build_encoding_args(video_settings, normalize=True))
+    cmd.extend(["-progress", "pipe:1", "-nostats", "-loglevel", "error", "-f", "null", "-"])
+    
+    started = time.monotonic()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace')
+    fields = {}
+    sample = None
+    for line in process.stdout:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        fields[key] = value.strip()
+        if key == 'progress':
+            sample = parse_progress_sample(fields)
+            fields = {}
+    # wait4 reports the child's own CPU time and peak RSS
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_seconds = time.monotonic() - started
+    stderr = process.stderr.read()
+    if process.returncode != 0 or not sample or not sample['out_time_ms']:
+        raise RuntimeError(stderr.strip()[-300:] or f"ffmpeg exited with {process.returncode}")
+    
+    encoded_seconds = sample['out_time_ms'] / 1000
+    cpu_per_second = (usage.ru_utime + usage.ru_stime) / encoded_seconds
+    peak_rss_mb = usage.ru_maxrss / 1024
+    total_cores = psutil.cpu_count(logical=True) or 1
+    cpu_limit = total_cores * ADMISSION_CPU_THRESHOLD / cpu_per_second
+    memory_limit = psutil.virtual_memory().total * BENCHMARK_MEMORY_HEADROOM / (peak_rss_mb * 1024 * 1024)
+    return {
+        'encoded_seconds': encoded_seconds,
+        'wall_seconds': wall_seconds,
+        'achieved_fps': (sample['frame'] or 0) / wall_seconds,
+        'speed': encoded_seconds / wall_seconds,
+        'cpu_seconds_per_second': cpu_per_second,
+        'peak_rss_mb': peak_rss_mb,
+        'max_realtime_streams': int(min(cpu_limit, memory_limit)),
+        'host_cores': total_cores
+    }
+
+def run_encoder_benchmark(clips=None, matrix=None, seconds=BENCHMARK_CLIP_SECONDS, log_callback=print, stop_event=None):
+    """Benchmark every matrix profile on each clip and store the results; returns the run id"""
+    clips = clips or select_benchmark_clips()
+    if not clips:
+        raise RuntimeError("No video files to benchmark")
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    jobs = [(clip, settings) for clip in clips for settings in iter_benchmark_settings(matrix)]
+    
+    for number, (clip, settings) in enumerate(jobs, start=1):
+        if stop_event and stop_event.is_set():
+            log_callback("⏹️ Benchmark stopped")
+            break
+        profile = get_encoding_profile(settings)
+        label = f"[{number}/{len(jobs)}] {clip} · {profile} @ {settings['bitrate']}"
+        try:
+            result = benchmark_profile(clip, settings, seconds)
+        except Exception as e:
+            log_callback(f"❌ {label}: {e}")
+            continue
+        log_callback(
+            f"🧪 {label}: {result['achieved_fps']:.0f} fps, {result['speed']:.2f}x, "
+            f"{result['cpu_seconds_per_second']:.2f} CPU s/s, {result['peak_rss_mb']:.0f} MB, "
+            f"max {result['max_realtime_streams']} real-time streams"
+        )
+        conn = get_db()
+        with conn:
+            conn.execute('''
+                INSERT INTO encoder_benchmarks 
+                (run_id, clip, profile, settings, encoded_seconds, wall_seconds, achieved_fps, speed,
+                 cpu_seconds_per_second, peak_rss_mb, max_realtime_streams, host_cores, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                run_id, clip, profile, json.dumps(settings, sort_keys=True),
+                result['encoded_seconds'], result['wall_seconds'], result['achieved_fps'], result['speed'],
+                result['cpu_seconds_per_second'], result['peak_rss_mb'], result['max_realtime_streams'],
+                result['host_cores'], datetime.now().isoformat()
+            ))
+    return run_id
+
+def get_capacity_report():
+    """Worst case per profile from each profile's latest benchmark run on this host"""
+    try:
+        cursor = get_db().cursor()
+        cursor.execute('''
+            SELECT b.profile, MAX(b.cpu_seconds_per_second), MAX(b.peak_rss_mb),
+                   MIN(b.achieved_fps), MIN(b.speed), MIN(b.max_realtime_streams), MAX(b.created_at)
+            FROM encoder_benchmarks b
+            WHERE b.host_cores = ? AND b.run_id = (
+                SELECT MAX(latest.run_id) FROM encoder_benchmarks latest WHERE latest.profile = b.profile AND latest.host_cores = b.host_cores
+            )
+            GROUP BY b.profile
+            ORDER BY b.profile
+        ''', (psutil.cpu_count(logical=True) or 1,))
+        rows = cursor.fetchall()
+    except sqlite3.Error:
+        return {}
+    return {
+        row[0]: {
+            'cpu_seconds_per_second': row[1],
+            'peak_rss_mb': row[2],
+            'achieved_fps': row[3],
+            'speed': row[4],
+            'max_realtime_streams': row[5],
+            'measured_at': row[6]
+        }
+        for row in rows
+    }
+
+def load_benchmark_cost_factors():
+    """Measured/estimated cost ratio per profile, used to seed admission control"""
+    factors = {}
+    for profile, report in get_capacity_report().items():
+        codec, preset, resolution, fps = profile.split('/')
+        settings = {**DEFAULT_VIDEO_SETTINGS, "codec": codec, "preset": preset, "resolution": resolution, "fps": fps}
+        base_cost = estimate_stream_cost(settings, is_shorts=resolution == "720x1280")
+        if base_cost > 0 and report['cpu_seconds_per_second']:
+            factors[profile] = report['cpu_seconds_per_second'] / base_cost
+    return factors
+
+class BenchmarkRunner:
+    """Run the encoder benchmark in the background for the UI"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.log = deque(maxlen=200)
+        self.last_error = None
+    
+    def start(self, matrix=None, seconds=BENCHMARK_CLIP_SECONDS):
+        with self.lock:
+            if self.running():
+                return False
+            self.stop_event.clear()
+            self.last_error = None
+            self.log.clear()
+            self.thread = threading.Thread(target=self._run, args=(matrix, seconds), name="encoder-benchmark", daemon=True)
+            self.thread.start()
+        return True
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def running(self):
+        return bool(self.thread and self.thread.is_alive())
+    
+    def _run(self, matrix, seconds):
+        try:
+            run_encoder_benchmark(matrix=matrix, seconds=seconds, log_callback=self.log.append, stop_event=self.stop_event)
+            # Let admission control use the new measurements right away
+            get_capacity_planner().update_cost_factors(load_benchmark_cost_factors())
+        except Exception as e:
+            self.last_error = str(e)
+
+@st.cache_resource
+def get_benchmark_runner():
+    """Process-wide background benchmark"""
+    return BenchmarkRunner()
+
+def benchmark_cli(argv):
+    """Command line entry point: python app.py benchmark [options] [clips...]"""
+    parser = argparse.ArgumentParser(prog="app.py benchmark", description="Measure what this host can encode in real time")
+    parser.add_argument("clips", nargs="*", help="clips to encode (default: representative files from the media library)")
+    parser.add_argument("--seconds", type=int, default=BENCHMARK_CLIP_SECONDS, help="seconds of output per run")
+    for key, values in BENCHMARK_MATRIX.items():
+        parser.add_argument(f"--{key}", nargs="+", default=values, help=f"matrix values (default: {' '.join(values)})")
+    args = parser.parse_args(argv)
+    
+    init_database()
+    matrix = {key: getattr(args, key) for key in BENCHMARK_MATRIX}
+    try:
+        run_encoder_benchmark(args.clips, matrix, args.seconds)
+    except RuntimeError as e:
+        parser.exit(1, f"❌ {e}\n")
+    
+    print(f"\n{'profile':<34} {'CPU s/s':>8} {'RSS MB':>8} {'fps':>7} {'speed':>7} {'streams':>8}")
+    for profile, report in get_capacity_report().items():
+        print(
+            f"{profile:<34} {report['cpu_seconds_per_second']:>8.2f} {report['peak_rss_mb']:>8.0f} "
+            f"{report['achieved_fps']:>7.0f} {report['speed']:>6.2f}x {report['max_realtime_streams']:>8}"
+        )
+
+# Core partitioning across concurrent encoders
+def partition_cores(cores, weights):
+    """Split cores into contiguous blocks proportional to each job's weight
+    
+    weights is an ordered dict of job key -> estimated cost. Every job gets at
+    least one core; with more jobs than cores, jobs share cores round-robin.
+    """
+    jobs = list(weights)
+    if not jobs or not cores:
+        return {}
+    if len(jobs) >= len(cores):
+        return {job: [cores[i % len(cores)]] for i, job in enumerate(jobs)}
+    
+    total_weight = sum(weights.values()) or len(jobs)
+    exact = {job: len(cores) * (weights[job] or total_weight / len(jobs)) / total_weight for job in jobs}
+    shares = {job: max(1, int(exact[job])) for job in jobs}
+    while sum(shares.values()) > len(cores):
+        largest = max((job for job in jobs if shares[job] > 1), key=lambda job: shares[job])
+        shares[largest] -= 1
+    while sum(shares.values()) < len(cores):
+        neediest = max(jobs, key=lambda job: exact[job] - shares[job])
+        shares[neediest] += 1
+    
+    assignment = {}
+    offset = 0
+    for job in jobs:
+        assignment[job] = cores[offset:offset + shares[job]]
+        offset += shares[job]
+    return assignment
+
+def format_core_list(cores):
+    """Compact core list such as "0-3,8" """
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+class CoreScheduler:
+    """Give each active encoder its own block of cores and a matching thread budget"""
+    
+    def __init__(self):
+        self.supports_affinity = hasattr(os, 'sched_setaffinity')
+        if self.supports_affinity:
+            self.cores = sorted(os.sched_getaffinity(0))
+        else:
+            self.cores = list(range(psutil.cpu_count(logical=True) or 1))
+        self.lock = threading.Lock()
+        self.jobs = {}
+    
+    def add(self, job_key, weight):
+        """Register an encoder and rebalance every running job"""
+        with self.lock:
+            self.jobs[job_key] = {'weight': weight, 'pid': None, 'cores': [], 'speed': None}
+        self.rebalance()
+    
+    def remove(self, job_key):
+        with self.lock:
+            self.jobs.pop(job_key, None)
+        self.rebalance()
+    
+    def reweight(self, job_key, weight):
+        """Change a job's weight (e.g. after an encoder tier change) and rebalance"""
+        with self.lock:
+            if job_key not in self.jobs:
+                return
+            self.jobs[job_key]['weight'] = weight
+        self.rebalance()
+    
+    def cores_for(self, job_key):
+        """Cores currently assigned to a job (used for affinity and -threads at spawn)"""
+        with self.lock:
+            job = self.jobs.get(job_key)
+            return list(job['cores']) if job else None
+    
+    def attach(self, job_key, pid):
+        with self.lock:
+            if job_key in self.jobs:
+                self.jobs[job_key]['pid'] = pid
+    
+    def record_speed(self, job_key, speed):
+        with self.lock:
+            if job_key in self.jobs:
+                self.jobs[job_key]['speed'] = speed
+    
+    def rebalance(self):
+        """Recompute the partition and move running encoders onto their new cores
+        
+        Affinity is applied to every thread immediately; thread counts follow
+        on the encoder's next start.
+        """
+        with self.lock:
+            assignment = partition_cores(self.cores, {key: job['weight'] for key, job in self.jobs.items()})
+            moves = []
+            for job_key, cores in assignment.items():
+                job = self.jobs[job_key]
+                if cores != job['cores']:
+                    job['cores'] = cores
+                    if job['pid']:
+                        moves.append((job['pid'], cores))
+        
+        if not self.supports_affinity:
+            return
+        for pid, cores in moves:
+            try:
+                for thread in psutil.Process(pid).threads():
+                    os.sched_setaffinity(thread.id, cores)
+            except (psutil.Error, OSError):
+                pass
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                job_key: {'cores': list(job['cores']), 'threads': len(job['cores']), 'speed': job['speed']}
+                for job_key, job in self.jobs.items()
+            }
+
+@st.cache_resource
+def get_core_scheduler():
+    """Process-wide core partitioner shared by every encoder"""
+    return CoreScheduler()
+
+# Per-stream resource sampling
+RESOURCE_SAMPLE_INTERVAL = 1.0
+RESOURCE_HOST = "host"
+# Resolution -> (bucket seconds, points kept in memory); each tier rolls up into the next
+RESOURCE_RESOLUTIONS = {
+    '1s': (1, 300),
+    '1m': (60, 180),
+    '1h': (3600, 168)
+}
+
+def rollup_resource_points(bucket_start, points):
+    """Combine points into one: sample-weighted mean CPU and I/O, peak memory and threads"""
+    samples = sum(point['samples'] for point in points)
+    
+    def mean(field):
+        values = [(point[field], point['samples']) for point in points if point[field] is not None]
+        weight = sum(count for _, count in values)
+        return sum(value * count for value, count in values) / weight if weight else None
+    
+    def peak(field):
+        values = [point[field] for point in points if point[field] is not None]
+        return max(values) if values else None
+    
+    return {
+        'time': bucket_start,
+        'samples': samples,
+        'cpu_percent': mean('cpu_percent'),
+        'rss_mb': peak('rss_mb'),
+        'read_kbps': mean('read_kbps'),
+        'write_kbps': mean('write_kbps'),
+        'threads': peak('threads')
+    }
+
+class ResourceSampler:
+    """Sample CPU, memory, I/O and threads of every encoder plus host totals
+    
+    Points are kept per subject (job key or "host") in ring buffers at 1s, 1m
+    and 1h resolution. Completed 1m and 1h buckets are also persisted to
+    SQLite through the log writer; the UI reads only the in-memory tiers.
+    """
+    
+    def __init__(self, interval=RESOURCE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.processes = {}
+        self.series = {}
+        self.pending = {}
+        self.host_io = None
+        psutil.cpu_percent(None)
+        self.thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+    
+    def attach(self, job_key, pid):
+        """Start sampling a job's current encoder process"""
+        try:
+            process = psutil.Process(pid)
+            process.cpu_percent(None)
+        except psutil.Error:
+            return
+        with self.lock:
+            self.processes[job_key] = {'process': process, 'io': None}
+    
+    def remove(self, job_key):
+        """Stop sampling a finished job and persist its partial buckets"""
+        with self.lock:
+            self.processes.pop(job_key, None)
+            self.series.pop(job_key, None)
+            pending = self.pending.pop(job_key, {})
+        self._persist_pending(job_key, pending)
+    
+    def flush(self):
+        """Persist every partial bucket (used at shutdown)"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for subject, buckets in pending.items():
+            self._persist_pending(subject, buckets)
+    
+    def series_for(self, subject, resolution='1s', field='cpu_percent'):
+        """Values of one field at one resolution, oldest first"""
+        with self.lock:
+            points = list(self.series.get(subject, {}).get(resolution, ()))
+        return [point[field] for point in points]
+    
+    def latest(self, subject):
+        with self.lock:
+            points = self.series.get(subject, {}).get('1s')
+            return dict(points[-1]) if points else None
+    
+    def _run(self):
+        next_sample = time.monotonic()
+        while True:
+            next_sample += self.interval
+            time.sleep(max(0, next_sample - time.monotonic()))
+            try:
+                self._sample_once()
+            except Exception:
+                pass
+    
+    def _io_rates(self, previous, counters, now):
+        # kB/s read and written since the previous sample
+        if counters is None or previous is None:
+            return None, None
+        elapsed = now - previous[0]
+        if elapsed <= 0:
+            return None, None
+        return (
+            (counters.read_bytes - previous[1].read_bytes) / 1024 / elapsed,
+            (counters.write_bytes - previous[1].write_bytes) / 1024 / elapsed
+        )
+    
+    def _sample_once(self):
+        now = time.time()
+        with self.lock:
+            jobs = list(self.processes.items())
+        
+        points = {}
+        for job_key, job in jobs:
+            process = job['process']
+            try:
+                with process.oneshot():
+                    cpu = process.cpu_percent(None)
+                    rss = process.memory_info().rss
+                    threads = process.num_threads()
+                    try:
+                        io = process.io_counters()
+                    except (psutil.AccessDenied, AttributeError):
+                        io = None
+            except psutil.Error:
+                continue
+            read_kbps, write_kbps = self._io_rates(job['io'], io, now)
+            job['io'] = (now, io) if io else None
+            points[job_key] = {
+                'time': now,
+                'samples': 1,
+                'cpu_percent': cpu,
+                'rss_mb': rss / 1024 / 1024,
+                'read_kbps': read_kbps,
+                'write_kbps': write_kbps,
+                'threads': threads
+            }
+        
+        # Host totals: whole-machine CPU, used memory and disk I/O, threads across encoders
+        try:
+            host_io = psutil.disk_io_counters()
+        except (RuntimeError, OSError):
+            host_io = None
+        read_kbps, write_kbps = self._io_rates(self.host_io, host_io, now)
+        self.host_io = (now, host_io) if host_io else None
+        points[RESOURCE_HOST] = {
+            'time': now,
+            'samples': 1,
+            'cpu_percent': psutil.cpu_percent(None),
+            'rss_mb': psutil.virtual_memory().used / 1024 / 1024,
+            'read_kbps': read_kbps,
+            'write_kbps': write_kbps,
+            'threads': sum(point['threads'] for point in points.values())
+        }
+        
+        completed = []
+        with self.lock:
+            for subject, point in points.items():
+                if subject != RESOURCE_HOST and subject not in self.processes:
+                    continue
+                completed.extend(self._add_point_locked(subject, '1s', point))
+        for subject, resolution, point in completed:
+            self._persist(subject, resolution, point)
+    
+    def _add_point_locked(self, subject, resolution, point):
+        """Append a point and roll finished buckets into the next resolution; returns them"""
+        resolutions = list(RESOURCE_RESOLUTIONS)
+        series = self.series.setdefault(subject, {
+            name: deque(maxlen=keep) for name, (_, keep) in RESOURCE_RESOLUTIONS.items()
+        })
+        series[resolution].append(point)
+        position = resolutions.index(resolution)
+        if position + 1 == len(resolutions):
+            return []
+        
+        coarser = resolutions[position + 1]
+        bucket_seconds = RESOURCE_RESOLUTIONS[coarser][0]
+        bucket_start = point['time'] // bucket_seconds * bucket_seconds
+        pending = self.pending.setdefault(subject, {})
+        current = pending.get(coarser)
+        if current and current[0] == bucket_start:
+            current[1].append(point)
+            return []
+        
+        pending[coarser] = (bucket_start, [point])
+        if not current:
+            return []
+        rolled = rollup_resource_points(*current)
+        return [(subject, coarser, rolled)] + self._add_point_locked(subject, coarser, rolled)
+    
+    def _persist_pending(self, subject, pending):
+        """Persist partial buckets finest first, folding each into the next coarser one"""
+        resolutions = list(RESOURCE_RESOLUTIONS)
+        for position, resolution in enumerate(resolutions):
+            if resolution not in pending:
+                continue
+            rolled = rollup_resource_points(*pending.pop(resolution))
+            self._persist(subject, resolution, rolled)
+            if position + 1 == len(resolutions):
+                continue
+            
+            coarser = resolutions[position + 1]
+            bucket_seconds = RESOURCE_RESOLUTIONS[coarser][0]
+            bucket_start = rolled['time'] // bucket_seconds * bucket_seconds
+            current = pending.get(coarser)
+            if current and current[0] == bucket_start:
+                current[1].append(rolled)
+            else:
+                if current:
+                    self._persist(subject, coarser, rollup_resource_points(*current))
+                pending[coarser] = (bucket_start, [rolled])
+    
+    def _persist(self, subject, resolution, point):
+        get_log_writer().submit((
+            resolution,
+            subject,
+            datetime.fromtimestamp(point['time']).isoformat(),
+            point['samples'],
+            point['cpu_percent'],
+            point['rss_mb'],
+            point['read_kbps'],
+            point['write_kbps'],
+            point['threads']
+        ), table='resource_rollups', droppable=True)
+
+@st.cache_resource
+def get_resource_sampler():
+    """Process-wide sampler feeding the per-batch resource sparklines"""
+    return ResourceSampler()
+
+# Adaptive encoder tiers
+ADAPTIVE_WARMUP_SECONDS = 20
+ADAPTIVE_SLOW_SPEED = 0.95
+ADAPTIVE_HEALTHY_SPEED = 0.99
+ADAPTIVE_DROP_RATIO = 0.02
+ADAPTIVE_DOWNGRADE_AFTER = 15
+ADAPTIVE_UPGRADE_AFTER = 300
+ADAPTIVE_UPGRADE_MAX_WAIT = 3600
+ADAPTIVE_MIN_BITRATE_KBPS = 500
+
+# Each tier is cheaper than the one before; tier 0 is the configured profile
+ENCODER_TIERS = [
+    {"label": "configured"},
+    {"label": "faster preset", "preset": "superfast"},
+    {"label": "fastest preset", "preset": "ultrafast"},
+    {"label": "reduced bitrate", "preset": "ultrafast", "bitrate_scale": 0.7},
+    {"label": "720p", "preset": "ultrafast", "bitrate_scale": 0.5, "resolution": "720p"},
+    {"label": "480p / 30 fps", "preset": "ultrafast", "bitrate_scale": 0.35, "resolution": "480p", "max_fps": 30}
+]
+
+def get_tier_settings(video_settings, tier, is_shorts=False):
+    """Video settings for an encoder tier; a tier never raises cost above the configured profile"""
+    settings = dict(video_settings)
+    step = ENCODER_TIERS[tier]
+    
+    preset = step.get("preset")
+    current_preset = settings.get("preset", "veryfast")
+    if preset and PRESET_COST_FACTORS.get(preset, 1.0) < PRESET_COST_FACTORS.get(current_preset, 1.0):
+        settings["preset"] = preset
+    
+    if "bitrate_scale" in step:
+        bitrate = int(str(settings["bitrate"]).replace('k', ''))
+        settings["bitrate"] = f"{max(ADAPTIVE_MIN_BITRATE_KBPS, int(bitrate * step['bitrate_scale']))}k"
+    
+    resolution = step.get("resolution")
+    if resolution and not is_shorts and RESOLUTION_SIZES[resolution][1] < get_output_size(settings)[1]:
+        settings["resolution"] = resolution
+        settings["max_height"] = RESOLUTION_SIZES[resolution][1]
+    
+    if "max_fps" in step and int(settings["fps"]) > step["max_fps"]:
+        settings["fps"] = str(step["max_fps"])
+    return settings
+
+class EncoderTierManager:
+    """Move encoders down to cheaper tiers when they fall behind real time, and back up when CPU allows
+    
+    Decisions are driven by FFmpeg's progress samples: sustained speed below
+    real time or a rising dropped-frame ratio steps a batch down one tier;
+    a long healthy period with spare projected CPU steps it back up.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.decisions = deque(maxlen=50)
+    
+    def register(self, job_key, video_settings, is_shorts, on_change, has_headroom):
+        """Track a job; on_change(settings, message) applies a tier, has_headroom(settings) gates upgrades"""
+        tiers = []
+        for tier in range(len(ENCODER_TIERS)):
+            settings = get_tier_settings(video_settings, tier, is_shorts)
+            # Skip tiers that would not change anything for this profile
+            if not tiers or settings != tiers[-1][1]:
+                tiers.append((tier, settings))
+        with self.lock:
+            self.jobs[job_key] = {
+                'tiers': tiers,
+                'level': 0,
+                'on_change': on_change,
+                'has_headroom': has_headroom,
+                'process_start': None,
+                'pressure_since': None,
+                'healthy_since': None,
+                'last_change': None,
+                'last_upgrade': None,
+                'upgrade_wait': ADAPTIVE_UPGRADE_AFTER,
+                'last_frames': None,
+                'last_drops': None
+            }
+    
+    def remove(self, job_key):
+        with self.lock:
+            self.jobs.pop(job_key, None)
+    
+    def settings_for(self, job_key):
+        """(tier, settings) the next encoder start should use, or None for unmanaged jobs"""
+        with self.lock:
+            job = self.jobs.get(job_key)
+            return job['tiers'][job['level']] if job else None
+    
+    def process_started(self, job_key):
+        """Reset the measurement window whenever an encoder (re)starts"""
+        with self.lock:
+            job = self.jobs.get(job_key)
+            if job:
+                job['process_start'] = time.monotonic()
+                job['pressure_since'] = None
+                job['healthy_since'] = None
+                job['last_frames'] = None
+                job['last_drops'] = None
+    
+    def observe(self, job_key, sample):
+        """Feed one progress sample and change tier when the trend is sustained"""
+        now = time.monotonic()
+        with self.lock:
+            job = self.jobs.get(job_key)
+            if not job or job['process_start'] is None or sample['speed'] is None:
+                return
+            
+            drop_ratio = 0.0
+            if sample['frame'] is not None and sample['drop_frames'] is not None:
+                if job['last_frames'] is not None and sample['frame'] > job['last_frames']:
+                    drop_ratio = (sample['drop_frames'] - job['last_drops']) / (sample['frame'] - job['last_frames'])
+                job['last_frames'] = sample['frame']
+                job['last_drops'] = sample['drop_frames']
+            
+            if now - job['process_start'] < ADAPTIVE_WARMUP_SECONDS:
+                return
+            
+            under_pressure = sample['speed'] < ADAPTIVE_SLOW_SPEED or drop_ratio > ADAPTIVE_DROP_RATIO
+            healthy = sample['speed'] >= ADAPTIVE_HEALTHY_SPEED and drop_ratio == 0
+            job['pressure_since'] = (job['pressure_since'] or now) if under_pressure else None
+            job['healthy_since'] = (job['healthy_since'] or now) if healthy else None
+            
+            target = None
+            if job['pressure_since'] and now - job['pressure_since'] >= ADAPTIVE_DOWNGRADE_AFTER and job['level'] < len(job['tiers']) - 1:
+                target = job['level'] + 1
+                reason = f"speed {sample['speed']:.2f}x, {drop_ratio:.1%} frames dropped for {now - job['pressure_since']:.0f}s"
+                # Falling back soon after stepping up means the upgrade did not fit; wait longer next time
+                if job['last_upgrade'] and now - job['last_upgrade'] < 2 * job['upgrade_wait']:
+                    job['upgrade_wait'] = min(ADAPTIVE_UPGRADE_MAX_WAIT, job['upgrade_wait'] * 2)
+            elif (
+                job['healthy_since'] and job['level'] > 0
+                and now - job['healthy_since'] >= job['upgrade_wait']
+                and now - (job['last_change'] or 0) >= job['upgrade_wait']
+            ):
+                target = job['level'] - 1
+                reason = f"speed {sample['speed']:.2f}x for {now - job['healthy_since']:.0f}s"
+            if target is None:
+                return
+            
+            level = job['level']
+            has_headroom = job['has_headroom']
+            on_change = job['on_change']
+            current_tier = job['tiers'][level][0]
+            new_tier, settings = job['tiers'][target]
+        
+        if target < level and not has_headroom(settings):
+            return
+        
+        direction = "⬇️ down" if target > level else "⬆️ up"
+        message = (
+            f"{direction} {job_batch_key(job_key)}: encoder tier {current_tier} → {new_tier} "
+            f"({ENCODER_TIERS[new_tier]['label']}: {settings.get('preset', 'veryfast')}, {settings['bitrate']}, "
+            f"{settings.get('resolution', '-')}, {settings['fps']} fps) — {reason}"
+        )
+        with self.lock:
+            if self.jobs.get(job_key) is not job or job['level'] != level:
+                return
+            if target < level:
+                job['last_upgrade'] = now
+            job['level'] = target
+            job['last_change'] = now
+            job['pressure_since'] = None
+            job['healthy_since'] = None
+            self.decisions.appendleft({'time': datetime.now(), 'job_key': job_key, 'message': message})
+        on_change(settings, message)
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                job_key: {
+                    'tier': job['tiers'][job['level']][0],
+                    'label': ENCODER_TIERS[job['tiers'][job['level']][0]]['label'],
+                    'max_tier': job['tiers'][-1][0],
+                    'under_pressure': job['pressure_since'] is not None
+                }
+                for job_key, job in self.jobs.items()
+            }
+    
+    def recent_decisions(self, session_id=None):
+        with self.lock:
+            return [d for d in self.decisions if not session_id or d['job_key'].startswith(f"{session_id}/")]
+
+@st.cache_resource
+def get_encoder_tier_manager():
+    """Process-wide adaptive encoder controller"""
+    return EncoderTierManager()
+
+# Seconds between human-readable progress summaries in the live logs
+PROGRESS_LOG_INTERVAL = 10
+
+# FFmpeg messages that mean the RTMP session is gone
+RTMP_FAILURE_PATTERNS = (
+    "Broken pipe",
+    "Connection reset by peer",
+    "Connection refused",
+    "Connection timed out",
+    "RTMP_SendPacket"
+)
+
+def parse_progress_sample(fields):
+    """Convert one block of FFmpeg -progress key=value pairs into typed metrics"""
+    def to_number(value, cast):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return None
+    
+    bitrate = fields.get('bitrate', '')
+    speed = fields.get('speed', '')
+    return {
+        'frame': to_number(fields.get('frame'), int),
+        'fps': to_number(fields.get('fps'), float),
+        'bitrate_kbps': to_number(bitrate.replace('kbits/s', ''), float),
+        'total_size': to_number(fields.get('total_size'), int),
+        # out_time_ms is reported in microseconds by FFmpeg, prefer out_time_us when present
+        'out_time_ms': to_number(fields.get('out_time_us', fields.get('out_time_ms')), lambda v: int(v) // 1000),
+        'speed': to_number(speed.replace('x', ''), float),
+        'dup_frames': to_number(fields.get('dup_frames'), int),
+        'drop_frames': to_number(fields.get('drop_frames'), int),
+        'progress': fields.get('progress')
+    }
+
+def format_progress_sample(sample):
+    """Format a progress sample as a single log line"""
+    def show(value, unit=""):
+        return "N/A" if value is None else f"{value}{unit}"
+    
+    out_time = str(timedelta(milliseconds=sample['out_time_ms'] or 0)).split('.')[0]
+    return (
+        f"frame={show(sample['frame'])} fps={show(sample['fps'])} bitrate={show(sample['bitrate_kbps'], 'kbps')} "
+        f"time={out_time} speed={show(sample['speed'], 'x')} dup={show(sample['dup_frames'])} drop={show(sample['drop_frames'])}"
+    )
+
+def build_tee_output(output_urls):
+    """Build a tee muxer target that sends one encode to every RTMP URL"""
+    def escape(url):
+        for char in ('\\', '|', '[', ']'):
+            url = url.replace(char, '\\' + char)
+        return url
+    
+    # onfail=ignore keeps the remaining outputs alive when one ingest fails
+    return "|".join(f"[f=flv:onfail=ignore]{escape(url)}" for url in output_urls)
+
+# Event loop that owns every encoder pipe
+STREAM_EVENT_BUFFER = 2000
+
+class StreamSubscription:
+    """Bounded buffer of stream events for one consumer; the oldest events go first when full"""
+    
+    def __init__(self, session_id=None, maxlen=STREAM_EVENT_BUFFER):
+        self.session_id = session_id
+        self.events = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+    
+    def put(self, event):
+        if self.session_id and event.get('session_id') != self.session_id:
+            return
+        with self.lock:
+            self.events.append(event)
+    
+    def drain(self):
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+class StreamManager:
+    """One asyncio loop that runs, reads and stops every FFmpeg process
+    
+    Encoders are started with asyncio.create_subprocess_exec and their
+    progress/event pipes are read by coroutines, so the thread count stays
+    constant however many streams run. Parsed events are published to
+    subscribers instead of being written into Streamlit state from threads.
+    """
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        self.processes = {}
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started,), name="stream-manager", daemon=True)
+        self.thread.start()
+        started.wait()
+    
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        # Python < 3.12 would otherwise start one waiter thread per child process
+        if sys.version_info < (3, 12) and hasattr(asyncio, "PidfdChildWatcher"):
+            try:
+                os.close(os.pidfd_open(os.getpid()))
+                watcher = asyncio.PidfdChildWatcher()
+                watcher.attach_loop(self.loop)
+                asyncio.set_child_watcher(watcher)
+            except (AttributeError, OSError):
+                pass
+        started.set()
+        self.loop.run_forever()
+    
+    def submit(self, coro):
+        """Schedule a coroutine on the manager loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def subscribe(self, key, session_id=None):
+        """Get or create a named subscription (e.g. one per Streamlit session)"""
+        with self.lock:
+            if key not in self.subscriptions:
+                self.subscriptions[key] = StreamSubscription(session_id)
+            return self.subscriptions[key]
+    
+    def unsubscribe(self, key):
+        with self.lock:
+            self.subscriptions.pop(key, None)
+    
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.values())
+        for subscription in subscriptions:
+            subscription.put(event)
+    
+    def process_count(self):
+        with self.lock:
+            return len(self.processes)
+    
+    async def spawn(self, job_key, cmd, cpu_cores=None):
+        # Pin before exec so every encoder thread inherits the affinity
+        preexec_fn = None
+        if cpu_cores and hasattr(os, 'sched_setaffinity'):
+            preexec_fn = lambda: os.sched_setaffinity(0, cpu_cores)
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=preexec_fn
+        )
+        with self.lock:
+            self.processes[job_key] = process
+        return process
+    
+    def forget(self, job_key, process):
+        with self.lock:
+            if self.processes.get(job_key) is process:
+                del self.processes[job_key]
+
+@st.cache_resource
+def get_stream_manager():
+    """Process-wide event loop for encoder processes"""
+    return StreamManager()
+
+# Live log lines kept in memory per session channel ("stream" or "batch_N")
+LOG_BUS_CAPACITY = 200
+LOG_BUS_MAX_CHANNELS = 512
+LOG_BUS_STREAM = "stream"
+
+class LogBus:
+    """Process-wide live log lines in fixed-size ring buffers, one per session channel
+    
+    Every line gets a monotonically increasing sequence number so readers can
+    fetch only what is newer than the last line they saw. Channels that have
+    not been written to for longest are evicted past LOG_BUS_MAX_CHANNELS, so
+    memory stays bounded however many streams run or how long they run.
+    
+    The buffers are not lock-free: one lock guards the channels, because a
+    deque raises if it is appended to while a reader iterates it. The lock is
+    held for one append, or while a reader collects the entries it asked for.
+    """
+    
+    def __init__(self, capacity=LOG_BUS_CAPACITY, max_channels=LOG_BUS_MAX_CHANNELS):
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.channels = OrderedDict()
+    
+    def append(self, session_id, channel, message):
+        """Add one line; returns its sequence number"""
+        line = f"[{datetime.now().strftime('%H:%M:%S')}] {message}"
+        key = (session_id, channel)
+        with self.lock:
+            self.sequence += 1
+            buffer = self.channels.get(key)
+            if buffer is None:
+                buffer = self.channels[key] = deque(maxlen=self.capacity)
+                while len(self.channels) > self.max_channels:
+                    self.channels.popitem(last=False)
+            else:
+                self.channels.move_to_end(key)
+            buffer.append((self.sequence, line))
+            return self.sequence
+    
+    def read(self, session_id, channel, after=0, limit=None):
+        """(sequence, line) entries newer than after, oldest first, at most limit of the newest"""
+        with self.lock:
+            buffer = self.channels.get((session_id, channel))
+            if not buffer or buffer[-1][0] <= after:
+                return []
+            entries = []
+            for entry in reversed(buffer):
+                if entry[0] <= after or (limit and len(entries) >= limit):
+                    break
+                entries.append(entry)
+        entries.reverse()
+        return entries
+    
+    def count(self, session_id, channel):
+        with self.lock:
+            return len(self.channels.get((session_id, channel), ()))
+    
+    def clear(self, session_id, channel):
+        with self.lock:
+            self.channels.pop((session_id, channel), None)
+
+@st.cache_resource
+def get_log_bus():
+    """Process-wide live log bus shared by every session and encoder"""
+    return LogBus()
+
+def read_live_logs(channel, limit):
+    """The newest lines of one of this session's log channels (script thread only)
+    
+    Only entries newer than the previous read are fetched from the bus.
+    """
+    views = st.session_state.setdefault('log_views', {})
+    view = views.get(channel)
+    if view is None or view['lines'].maxlen != limit:
+        view = views[channel] = {'sequence': 0, 'lines': deque(maxlen=limit)}
+    entries = get_log_bus().read(st.session_state['session_id'], channel, after=view['sequence'], limit=limit)
+    if entries:
+        view['sequence'] = entries[-1][0]
+        view['lines'].extend(line for _, line in entries)
+    return list(view['lines'])
+
+def clear_live_logs(channel):
+    """Drop a channel's lines from the bus and from this session's view"""
+    get_log_bus().clear(st.session_state['session_id'], channel)
+    st.session_state.setdefault('log_views', {}).pop(channel, None)
+
+def make_stream_callbacks(session_id, batch_keys=None):
+    """log/progress callbacks that never touch Streamlit state
+    
+    Log lines go to the log bus; progress samples are published as stream
+    events. batch_keys=None targets the single stream view; otherwise both fan
+    out to every listed batch.
+    """
+    manager = get_stream_manager()
+    log_bus = get_log_bus()
+    
+    def log_callback(msg):
+        for channel in batch_keys or [LOG_BUS_STREAM]:
+            log_bus.append(session_id, channel, msg)
+    
+    def progress_callback(sample):
+        manager.publish({'session_id': session_id, 'batch_keys': batch_keys, 'type': 'progress', 'time': datetime.now(), 'sample': sample})
+    
+    return log_callback, progress_callback
 
-def run_ffmpeg(video_path, stream_key, is_shorts, log_callback, rtmp_url=None, session_id=None, duration_limit=None, video_settings=None, batch_index=0):
-    """Run FFmpeg for streaming with optional duration limit and custom video settings."""
-    output_url = rtmp_url or f"rtmp://a.rtmp.youtube.com/live2/{stream_key}"
+def apply_stream_events():
+    """Move this session's published progress events into st.session_state (script thread only)"""
+    session_id = st.session_state['session_id']
+    subscription = get_stream_manager().subscribe(f"session:{session_id}", session_id)
+    for event in subscription.drain():
+        if event['batch_keys'] is None:
+            st.session_state['stream_progress'] = event['sample']
+            continue
+        
+        batch_streams = st.session_state.setdefault('batch_streams', {})
+        for batch_key in event['batch_keys']:
+            batch = batch_streams.setdefault(batch_key, {})
+            batch['progress'] = event['sample']
+            batch.setdefault('progress_history', deque(maxlen=LIVE_PROGRESS_POINTS)).append(event['sample'])
+
+def build_ffmpeg_command(video_path, is_shorts, log_callback, output_urls, duration_limit=None, video_settings=None, batch_index=0, use_transcode_cache=True, cpu_cores=None, start_offset=None):
+    """Build the FFmpeg command for a stream; returns (cmd, mode, playlist_fifo)
     
+    This probes media and consults the transcode cache, so it blocks and runs
+    off the event loop. start_offset seeks into a file source before the first
+    loop (playlists always start at their current item).
+    """
     # Default video settings
     if video_settings is None:
-        video_settings = {
-            "resolution": "1080p",
-            "bitrate": "2500k",
-            "fps": "30",
-            "codec": "libx264",
-            "audio_bitrate": "128k",
-            "audio_codec": "aac"
-        }
+        video_settings = DEFAULT_VIDEO_SETTINGS
     
-    # Build FFmpeg command with custom settings
-    cmd = [
-        "ffmpeg", "-re", "-stream_loop", "-1", "-i", video_path,
-        "-c:v", video_settings["codec"], "-preset", "veryfast", 
-        "-b:v", video_settings["bitrate"], "-maxrate", video_settings["bitrate"],
-        "-bufsize", str(int(video_settings["bitrate"].replace('k', '')) * 2) + "k",
-        "-r", video_settings["fps"], "-g", str(int(video_settings["fps"]) * 2),
-        "-keyint_min", str(int(video_settings["fps"]) * 2),
-        "-c:a", video_settings["audio_codec"], "-b:a", video_settings["audio_bitrate"],
-        "-f", "flv"
-    ]
+    # Copy whatever the source already delivers in the target format
+    media_info = None
+    passthrough = {'video': False, 'audio': False, 'reasons': []}
+    if not is_playlist_source(video_path):
+        media_info = get_media_info(video_path, wait=True)
+        passthrough = analyze_passthrough(media_info, video_settings, is_shorts)
+    full_passthrough = passthrough['video'] and passthrough['audio']
     
-    # Add scaling for Shorts mode if enabled
-    if is_shorts:
-        cmd.extend(["-vf", "scale=720:1280"])
+    # Stream a pre-transcoded copy when one exists, otherwise encode live and cache for next time
+    cached_path = None
+    if use_transcode_cache and not is_playlist_source(video_path) and not full_passthrough:
+        try:
+            cache_key = get_transcode_cache_key(video_path, video_settings, is_shorts)
+            cached_path = lookup_transcode_cache(cache_key)
+            if not cached_path and get_transcode_worker().schedule(cache_key, video_path, video_settings, is_shorts):
+                log_callback(f"🗄️ Batch {batch_index}: Pre-transcode scheduled for {video_path}")
+        except OSError as e:
+            log_callback(f"⚠️ Batch {batch_index}: Transcode cache unavailable: {e}")
+    
+    # Build FFmpeg command with custom settings
+    playlist_fifo = None
+    seek = ["-ss", f"{start_offset:.3f}"] if start_offset else []
+    if is_playlist_source(video_path):
+        # One long-lived encoder reads the playlist as a continuous MPEG-TS pipe
+        playlist_fifo = get_playlist_fifo(video_path[len(PLAYLIST_SCHEME):])
+        threads = len(cpu_cores) if cpu_cores else None
+        cmd = ["ffmpeg", "-re"]
+        if threads:
+            cmd.extend(["-threads", str(threads)])
+        cmd.extend(["-f", "mpegts", "-i", str(playlist_fifo)])
+        cmd.extend(build_encoding_args(video_settings, is_shorts, threads, normalize=True))
+        mode = "🎛️ encode (playlist)"
+    elif cached_path:
+        log_callback(f"🗄️ Batch {batch_index}: Using pre-transcoded cache entry (stream copy)")
+        cmd = ["ffmpeg", "-re", "-stream_loop", "-1", *seek, "-i", cached_path, "-c", "copy"]
+        mode = "🗄️ cached copy"
+    else:
+        # Copied video needs no encoder threads
+        threads = len(cpu_cores) if cpu_cores and not passthrough['video'] else None
+        cmd = ["ffmpeg", "-re", "-stream_loop", "-1"]
+        if threads:
+            cmd.extend(["-threads", str(threads)])
+        cmd.extend([*seek, "-i", video_path])
+        cmd.extend(build_encoding_args(video_settings, is_shorts, threads, copy_video=passthrough['video'], copy_audio=passthrough['audio']))
+        cmd.extend(get_passthrough_bitstream_filters(media_info, passthrough))
+        mode = describe_passthrough(passthrough)
+        if passthrough['video'] or passthrough['audio']:
+            detail = f" — encoding because of {', '.join(passthrough['reasons'])}" if passthrough['reasons'] else ""
+            log_callback(f"⏩ Batch {batch_index}: Source matches the target profile, {mode[2:]}{detail}")
     
     # Add duration limit if specified
     if duration_limit:
         cmd.insert(1, str(duration_limit))
         cmd.insert(1, "-t")
     
-    cmd.append(output_url)
+    # Machine-readable progress on stdout, only warnings and errors on stderr
+    cmd.extend(["-progress", "pipe:1", "-nostats", "-loglevel", "warning"])
     
-    start_msg = f"🚀 Batch {batch_index}: Starting FFmpeg with settings: {' '.join(cmd[:8])}... [RTMP URL hidden for security]"
-    log_callback(start_msg)
-    if session_id:
-        log_to_database(session_id, "INFO", f"Batch {batch_index}: {start_msg}", video_path)
+    # Single FLV output, or one encode fanned out to every URL through the tee muxer
+    if len(output_urls) > 1:
+        cmd.extend(["-map", "0:v:0", "-map", "0:a:0?", "-f", "tee", build_tee_output(output_urls)])
+    else:
+        cmd.extend(["-f", "flv", output_urls[0]])
+    return cmd, mode, playlist_fifo
+
+async def run_ffmpeg(video_path, stream_key, is_shorts, log_callback, rtmp_url=None, session_id=None, duration_limit=None, video_settings=None, batch_index=0, progress_callback=None, output_urls=None, use_transcode_cache=True, process_callback=None, cpu_cores=None, mode_callback=None, job_key=None, start_offset=None):
+    """Run FFmpeg for streaming on the stream manager loop; returns its exit code."""
+    if not output_urls:
+        output_urls = [rtmp_url or f"rtmp://a.rtmp.youtube.com/live2/{stream_key}"]
+    manager = get_stream_manager()
+    job_key = job_key or make_job_key(session_id, batch_index)
+    loop = asyncio.get_running_loop()
     
+    exit_code = None
+    process = None
+    feeder_stop = threading.Event()
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        for line in process.stdout:
-            log_callback(f"Batch {batch_index}: {line.strip()}")
-            if session_id:
-                log_to_database(session_id, "FFMPEG", f"Batch {batch_index}: {line.strip()}", video_path)
-        process.wait()
+        cmd, mode, playlist_fifo = await loop.run_in_executor(
+            None,
+            lambda: build_ffmpeg_command(video_path, is_shorts, log_callback, output_urls, duration_limit, video_settings, batch_index, use_transcode_cache, cpu_cores, start_offset)
+        )
+        if mode_callback:
+            mode_callback(mode)
         
-        end_msg = f"✅ Batch {batch_index}: Streaming completed successfully"
-        log_callback(end_msg)
+        start_msg = f"🚀 Batch {batch_index}: Starting FFmpeg with settings: {' '.join(cmd[:8])}... [RTMP URL hidden for security]"
+        log_callback(start_msg)
         if session_id:
-            log_to_database(session_id, "INFO", f"Batch {batch_index}: {end_msg}", video_path)
+            log_to_database(session_id, "INFO", f"Batch {batch_index}: {start_msg}", video_path, batch_index=batch_index)
+        
+        process = await manager.spawn(job_key, cmd, cpu_cores)
+        if process_callback:
+            process_callback(process)
+        
+        if playlist_fifo:
+            # Remuxing playlist items blocks on the FIFO, so the feeder keeps its own thread
+            threading.Thread(
+                target=feed_playlist,
+                args=(video_path[len(PLAYLIST_SCHEME):], playlist_fifo, feeder_stop, log_callback, batch_index),
+                daemon=True
+            ).start()
+        
+        async def relay_events():
+            # Everything FFmpeg prints at warning level or above is a real event
+            while True:
+                raw = await process.stderr.readline()
+                if not raw:
+                    break
+                line = raw.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                log_callback(f"Batch {batch_index}: {line}")
+                if session_id:
+                    log_to_database(session_id, "FFMPEG", f"Batch {batch_index}: {line}", video_path, batch_index=batch_index)
+                
+                # A broken single RTMP session will not recover; exit so the supervisor reconnects.
+                # Tee outputs ignore single-slave failures on purpose.
+                if len(output_urls) == 1 and any(pattern in line for pattern in RTMP_FAILURE_PATTERNS):
+                    if process.returncode is None:
+                        log_callback(f"🔌 Batch {batch_index}: RTMP connection failed, stopping encoder")
+                        process.terminate()
+        
+        async def read_progress():
+            fields = {}
+            last_summary = 0
+            while True:
+                raw = await process.stdout.readline()
+                if not raw:
+                    break
+                key, sep, value = raw.decode('utf-8', 'replace').strip().partition('=')
+                if not sep:
+                    continue
+                fields[key] = value.strip()
+                if key != 'progress':
+                    continue
+                
+                # A "progress" key closes one sample
+                sample = parse_progress_sample(fields)
+                fields = {}
+                if session_id:
+                    log_progress_to_database(session_id, batch_index, sample)
+                if progress_callback:
+                    progress_callback(sample)
+                if time.monotonic() - last_summary >= PROGRESS_LOG_INTERVAL or sample['progress'] == 'end':
+                    last_summary = time.monotonic()
+                    log_callback(f"Batch {batch_index}: {format_progress_sample(sample)}")
+        
+        await asyncio.gather(read_progress(), relay_events())
+        exit_code = await process.wait()
+        
+        if exit_code == 0:
+            end_msg = f"✅ Batch {batch_index}: Streaming completed successfully"
+            log_callback(end_msg)
+            if session_id:
+                log_to_database(session_id, "INFO", f"Batch {batch_index}: {end_msg}", video_path, batch_index=batch_index)
+        else:
+            end_msg = f"⚠️ Batch {batch_index}: FFmpeg exited with code {exit_code}"
+            log_callback(end_msg)
+            if session_id:
+                log_to_database(session_id, "ERROR", f"Batch {batch_index}: {end_msg}", video_path, batch_index=batch_index)
             
     except Exception as e:
         error_msg = f"❌ Batch {batch_index}: FFmpeg Error: {e}"
         log_callback(error_msg)
         if session_id:
-            log_to_database(session_id, "ERROR", f"Batch {batch_index}: {error_msg}", video_path)
+            log_to_database(session_id, "ERROR", f"Batch {batch_index}: {error_msg}", video_path, batch_index=batch_index)
     finally:
+        feeder_stop.set()
+        if process:
+            manager.forget(job_key, process)
         final_msg = f"⏹️ Batch {batch_index}: Streaming session ended"
         log_callback(final_msg)
         if session_id:
-            log_to_database(session_id, "INFO", f"Batch {batch_index}: {final_msg}", video_path)
+            log_to_database(session_id, "INFO", f"Batch {batch_index}: {final_msg}", video_path, batch_index=batch_index)
+    return exit_code
+
+# FFmpeg process supervisor
+RESTART_BACKOFF_BASE = 2.0
+RESTART_BACKOFF_MAX = 60.0
+RESTART_RESET_AFTER = 60.0
+STOP_GRACE_SECONDS = 5.0
+SUPERVISOR_LIVE_STATES = ('queued', 'starting', 'running', 'backoff')
+
+# Stall watchdog: seconds without forward progress before an encoder is killed
+STALL_WINDOW_SECONDS = 15.0
+STALL_STARTUP_GRACE = 30.0
+STALL_CHECK_INTERVAL = 1.0
+
+def make_job_key(session_id, batch_index):
+    """Process-wide key for one batch so sessions never collide"""
+    return f"{session_id}/batch_{batch_index}"
+
+def job_batch_key(job_key):
+    """The session-local batch key ("batch_N") of a job key"""
+    return job_key.rsplit('/', 1)[-1]
+
+def job_batch_index(job_key):
+    return int(job_batch_key(job_key).replace('batch_', ''))
+
+async def stop_ffmpeg_process(process):
+    """Ask FFmpeg to quit ("q"), then SIGINT, then SIGKILL"""
+    try:
+        if process.stdin:
+            process.stdin.write(b"q")
+            await process.stdin.drain()
+    except (OSError, ValueError, ConnectionError):
+        pass
+    for escalate in (lambda: process.send_signal(signal.SIGINT), process.kill):
+        try:
+            await asyncio.wait_for(process.wait(), STOP_GRACE_SECONDS)
+            return
+        except asyncio.TimeoutError:
+            try:
+                escalate()
+            except ProcessLookupError:
+                return
+    await process.wait()
+
+class StreamSupervisor:
+    """Own every encoder process, restart failures with backoff, stop batches individually
+    
+    Supervision loops are coroutines on the stream manager's event loop.
+    """
+    
+    def __init__(self, stall_window=STALL_WINDOW_SECONDS):
+        self.lock = threading.Lock()
+        self.handles = {}
+        self.manager = get_stream_manager()
+        self.stall_window = stall_window
+        self.manager.submit(self._watchdog())
+    
+    def create(self, job_key, outputs, run_fn, log_callback, session_id=None, on_process=None, on_exit=None, on_cancel=None):
+        """Register a supervised stream
+        
+        outputs maps each member batch key to its RTMP URL. run_fn is a coroutine
+        function called as run_fn(output_urls, process_callback, resume) that
+        returns FFmpeg's exit code; resume is None or the media position and
+        streamed seconds to continue from after a stall.
+        """
+        # Restarting a batch replaces its previous encoder
+        with self.lock:
+            previous = self.handles.get(job_key)
+        self.stop(job_key)
+        handle = {
+            'job_key': job_key,
+            'outputs': dict(outputs),
+            'run_fn': run_fn,
+            'log_callback': log_callback,
+            'session_id': session_id,
+            'on_process': on_process,
+            'on_exit': on_exit,
+            'on_cancel': on_cancel,
+            'state': 'queued',
+            'process': None,
+            'restarts': 0,
+            'failures': 0,
+            'first_start': None,
+            'process_start': None,
+            'last_exit_code': None,
+            'stop_event': threading.Event(),
+            'restart_now': False,
+            'mode': None,
+            'task': None,
+            # Watchdog state
+            'last_advance': None,
+            'last_out_time': 0,
+            'last_size': 0,
+            'streamed_seconds': 0.0,
+            'run_offset': 0.0,
+            'resume': None,
+            'stalls': 0,
+            'pending_stall': None,
+            'last_stall_seconds': None,
+            'exited': False
+        }
+        # The previous encoder may take a few seconds to wind down. Release what it
+        # holds under this job key now, before the new job claims it, so its late
+        # exit cannot release the new encoder's planner slot, cores and tier.
+        if previous and previous['task'] is not None:
+            self._exit(previous)
+        with self.lock:
+            self.handles[job_key] = handle
+        return handle
+    
+    def launch(self, job_key):
+        """Start supervising a registered stream (used as the admission start function)"""
+        with self.lock:
+            handle = self.handles[job_key]
+            handle['task'] = self.manager.submit(self._supervise(handle))
+    
+    def stop(self, job_key, batch_key=None):
+        """Stop a stream gracefully, or remove one member output from a shared encoder"""
+        with self.lock:
+            handle = self.handles.get(job_key)
+            if not handle or handle['state'] in ('stopped', 'finished'):
+                return False
+            if handle['state'] == 'queued':
+                # Never admitted: just leave the admission queue
+                handle['state'] = 'stopped'
+                handle['stop_event'].set()
+                del self.handles[job_key]
+                if handle['on_cancel']:
+                    handle['on_cancel']()
+                return True
+            if batch_key and batch_key in handle['outputs'] and len(handle['outputs']) > 1:
+                # Other batches still use this encoder: restart it without this output
+                del handle['outputs'][batch_key]
+                handle['resume'] = self._resume_point(handle)
+                handle['restart_now'] = True
+                message = f"⏹️ {batch_key}: removed from shared encoder, restarting remaining outputs"
+            else:
+                handle['stop_event'].set()
+                message = f"⏹️ {job_batch_key(job_key)}: stop requested"
+            process = handle['process']
+        
+        self._log(handle, "INFO", message)
+        if process and process.returncode is None:
+            self.manager.submit(stop_ffmpeg_process(process))
+        return True
+    
+    def restart(self, job_key, reason, resume=False):
+        """Restart a running encoder so its next start picks up new settings
+        
+        With resume, the new encoder continues from the current media position
+        and only streams what is left of the duration limit.
+        """
+        with self.lock:
+            handle = self.handles.get(job_key)
+            if not handle or handle['state'] != 'running':
+                return False
+            if resume:
+                handle['resume'] = self._resume_point(handle)
+            handle['restart_now'] = True
+            process = handle['process']
+        
+        self._log(handle, "INFO", f"🔄 {job_batch_key(job_key)}: restarting encoder ({reason})")
+        if process and process.returncode is None:
+            self.manager.submit(stop_ffmpeg_process(process))
+        return True
+    
+    def set_mode(self, job_key, mode):
+        """Record how the current encoder handles its input (copy, encode, ...)"""
+        with self.lock:
+            if job_key in self.handles:
+                self.handles[job_key]['mode'] = mode
+    
+    def find_job(self, batch_key, session_id):
+        """Job key of the encoder currently serving a session's batch"""
+        with self.lock:
+            for job_key, handle in self.handles.items():
+                if handle['session_id'] == session_id and batch_key in handle['outputs'] and handle['state'] not in ('stopped', 'finished'):
+                    return job_key
+        return None
+    
+    def stop_batch(self, batch_key, session_id):
+        job_key = self.find_job(batch_key, session_id)
+        return self.stop(job_key, batch_key) if job_key else False
+    
+    def stop_session(self, session_id, exclude=()):
+        """Stop every stream owned by a session"""
+        with self.lock:
+            job_keys = [key for key, handle in self.handles.items() if handle['session_id'] == session_id and job_batch_key(key) not in exclude]
+        return [job_key for job_key in job_keys if self.stop(job_key)]
+    
+    def active(self, session_id=None):
+        """Number of encoders that are queued, running or waiting to restart"""
+        with self.lock:
+            return sum(
+                1 for handle in self.handles.values()
+                if handle['state'] in SUPERVISOR_LIVE_STATES and (not session_id or handle['session_id'] == session_id)
+            )
+    
+    def snapshot(self, session_id=None):
+        """Per-batch state, restart count and uptime for the status panel"""
+        now = time.monotonic()
+        rows = []
+        with self.lock:
+            for job_key, handle in self.handles.items():
+                if session_id and handle['session_id'] != session_id:
+                    continue
+                running = handle['state'] == 'running' and handle['process_start']
+                rows.append({
+                    'job_key': job_key,
+                    'batches': sorted(handle['outputs']),
+                    'state': handle['state'],
+                    'pid': handle['process'].pid if handle['process'] else None,
+                    'restarts': handle['restarts'],
+                    'mode': handle['mode'],
+                    'uptime': now - handle['process_start'] if running else 0,
+                    'since_first_start': now - handle['first_start'] if handle['first_start'] else 0,
+                    'last_exit_code': handle['last_exit_code'],
+                    'stalls': handle['stalls'],
+                    'last_stall_seconds': handle['last_stall_seconds']
+                })
+        return rows
+    
+    def record_progress(self, job_key, sample):
+        """Note forward progress (media time or output bytes) from an encoder's progress report"""
+        with self.lock:
+            handle = self.handles.get(job_key)
+            if not handle:
+                return
+            out_time = sample.get('out_time_ms') or 0
+            size = sample.get('total_size') or 0
+            if out_time <= handle['last_out_time'] and size <= handle['last_size']:
+                return
+            handle['last_advance'] = time.monotonic()
+            handle['last_out_time'] = max(out_time, handle['last_out_time'])
+            handle['last_size'] = max(size, handle['last_size'])
+            recovered = handle['pending_stall'] is not None
+        if recovered:
+            self._finish_stall(handle, recovered=True)
+    
+    def _finish_stall(self, handle, recovered):
+        """Record a stall once its encoder is producing again, or when the stream ends"""
+        with self.lock:
+            stall, handle['pending_stall'] = handle['pending_stall'], None
+            if not stall:
+                return
+            recovery_seconds = time.monotonic() - stall['detected'] if recovered else None
+            total_seconds = stall['stalled_seconds'] + recovery_seconds if recovered else None
+            if recovered:
+                handle['last_stall_seconds'] = total_seconds
+        self._record_stall(handle, stall, recovery_seconds, total_seconds)
+    
+    def _record_stall(self, handle, stall, recovery_seconds=None, total_seconds=None):
+        recovered = recovery_seconds is not None
+        if recovered:
+            self._log(handle, "INFO", f"✅ {job_batch_key(handle['job_key'])}: encoder recovered {recovery_seconds:.1f}s after the stall ({total_seconds:.1f}s without progress in total)")
+        try:
+            get_log_writer().submit((
+                handle['session_id'],
+                handle['job_key'],
+                ",".join(sorted(handle['outputs'])),
+                stall['detected_at'],
+                stall['stalled_seconds'],
+                stall['resume_position'],
+                datetime.now().isoformat() if recovered else None,
+                recovery_seconds,
+                total_seconds
+            ), table='stream_stalls')
+        except Exception as e:
+            handle['log_callback'](f"⚠️ Could not record stall: {e}")
+    
+    async def _watchdog(self):
+        """Kill encoders that are alive but no longer advance, so supervision restarts them"""
+        while True:
+            await asyncio.sleep(STALL_CHECK_INTERVAL)
+            now = time.monotonic()
+            stalled = []
+            with self.lock:
+                for handle in self.handles.values():
+                    process = handle['process']
+                    if handle['state'] != 'running' or not process or process.returncode is not None:
+                        continue
+                    if handle['stop_event'].is_set() or handle['restart_now']:
+                        continue
+                    # Give a fresh encoder time to open inputs and connect before its first report
+                    if handle['last_advance'] is None:
+                        since, window = handle['process_start'], max(self.stall_window, STALL_STARTUP_GRACE)
+                    else:
+                        since, window = handle['last_advance'], self.stall_window
+                    if now - since < window:
+                        continue
+                    
+                    handle['resume'] = self._resume_point(handle)
+                    handle['restart_now'] = True
+                    handle['stalls'] += 1
+                    # The restarted encoder froze too: the earlier stall never recovered
+                    previous = handle['pending_stall']
+                    handle['pending_stall'] = {
+                        'detected': now,
+                        'detected_at': datetime.now().isoformat(),
+                        'stalled_seconds': now - since,
+                        'resume_position': handle['resume']['position']
+                    }
+                    stalled.append((handle, process, now - since, previous))
+            
+            for handle, process, stalled_for, previous in stalled:
+                if previous:
+                    self._record_stall(handle, previous)
+                self._log(handle, "ERROR", f"🧊 {job_batch_key(handle['job_key'])}: no progress for {stalled_for:.0f}s, killing encoder and resuming at {handle['resume']['position']:.0f}s (stall #{handle['stalls']})")
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+    
+    def _resume_point(self, handle):
+        """Media position and streamed seconds of the running encoder; call with the lock held"""
+        out_time = handle['last_out_time'] / 1000
+        return {
+            'position': handle['run_offset'] + out_time,
+            'elapsed': handle['streamed_seconds'] + out_time
+        }
+    
+    def _log(self, handle, log_type, message):
+        handle['log_callback'](message)
+        if handle['session_id']:
+            log_to_database(handle['session_id'], log_type, message, batch_index=job_batch_index(handle['job_key']))
+    
+    def _process_started(self, handle, process):
+        with self.lock:
+            handle['process'] = process
+            handle['state'] = 'running'
+            handle['process_start'] = time.monotonic()
+            handle['last_advance'] = None
+            handle['last_out_time'] = 0
+            handle['last_size'] = 0
+            if handle['first_start'] is None:
+                handle['first_start'] = handle['process_start']
+            stop_requested = handle['stop_event'].is_set()
+        # A replaced handle's resources now belong to its successor
+        if handle['on_process'] and not handle['exited']:
+            handle['on_process'](process)
+        # A stop may have arrived between launch and spawn
+        if stop_requested:
+            self.manager.submit(stop_ffmpeg_process(process))
+    
+    async def _supervise(self, handle):
+        try:
+            while not handle['stop_event'].is_set():
+                with self.lock:
+                    handle['state'] = 'starting'
+                    handle['restart_now'] = False
+                    output_urls = list(handle['outputs'].values())
+                    resume, handle['resume'] = handle['resume'], None
+                    handle['run_offset'] = resume['position'] if resume else 0.0
+                
+                exit_code = await handle['run_fn'](output_urls, lambda process: self._process_started(handle, process), resume)
+                
+                with self.lock:
+                    handle['last_exit_code'] = exit_code
+                    handle['process'] = None
+                    handle['streamed_seconds'] += handle['last_out_time'] / 1000
+                    ran_for = time.monotonic() - handle['process_start'] if handle['process_start'] else 0
+                    restart_now = handle['restart_now']
+                
+                if handle['stop_event'].is_set():
+                    break
+                if restart_now:
+                    continue
+                if exit_code == 0:
+                    # Duration limit reached or FFmpeg finished on its own
+                    with self.lock:
+                        handle['state'] = 'finished'
+                    return
+                
+                # A long healthy run resets the backoff ladder
+                if ran_for >= RESTART_RESET_AFTER:
+                    handle['failures'] = 0
+                handle['failures'] += 1
+                delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** (handle['failures'] - 1))
+                delay *= random.uniform(0.5, 1.0)
+                
+                with self.lock:
+                    handle['state'] = 'backoff'
+                    handle['restarts'] += 1
+                self._log(handle, "ERROR", f"🔁 {job_batch_key(handle['job_key'])}: encoder exited with code {exit_code}, restart #{handle['restarts']} in {delay:.1f}s")
+                # stop_event is set from other threads, so poll it instead of blocking the loop
+                deadline = time.monotonic() + delay
+                while not handle['stop_event'].is_set() and time.monotonic() < deadline:
+                    await asyncio.sleep(min(0.5, deadline - time.monotonic()))
+            
+            with self.lock:
+                handle['state'] = 'stopped'
+        finally:
+            if handle['state'] not in ('stopped', 'finished'):
+                with self.lock:
+                    handle['state'] = 'stopped'
+            # A stall that never recovered is still recorded
+            self._finish_stall(handle, recovered=False)
+            self._exit(handle)
+    
+    def _exit(self, handle):
+        """Run a handle's on_exit exactly once and forget the handle, whether it ended or was replaced"""
+        with self.lock:
+            if handle['exited']:
+                return
+            handle['exited'] = True
+            # A successor registered under the same key stays
+            if self.handles.get(handle['job_key']) is handle:
+                del self.handles[handle['job_key']]
+        if handle['on_exit']:
+            handle['on_exit']()
+
+@st.cache_resource
+def get_stream_supervisor():
+    """Process-wide supervisor that owns every FFmpeg process"""
+    return StreamSupervisor()
+
+def start_supervised_stream(session_id, batch_index, video_path, outputs, log_callback, progress_callback=None, is_shorts=False, duration_limit=None, video_settings=None):
+    """Register a stream with the supervisor and admit it through the capacity planner
+    
+    Returns the admission queue position, 0 when the stream started immediately.
+    """
+    planner = get_capacity_planner()
+    supervisor = get_stream_supervisor()
+    scheduler = get_core_scheduler()
+    tiers = get_encoder_tier_manager()
+    job_key = make_job_key(session_id, batch_index)
+    profile_settings = video_settings or DEFAULT_VIDEO_SETTINGS
+    # Cached copies and sources whose video passes through cost almost no CPU. This
+    # runs on the script thread, so only already-known answers count: a source that
+    # has not been probed yet is admitted at its full encoding cost.
+    stream_copy = not is_playlist_source(video_path) and (
+        find_transcode_cache_entry(video_path, profile_settings, is_shorts) is not None
+        or analyze_passthrough(get_media_info(video_path), profile_settings, is_shorts)['video']
+    )
+    
+    def track_progress(sample):
+        supervisor.record_progress(job_key, sample)
+        scheduler.record_speed(job_key, sample['speed'])
+        tiers.observe(job_key, sample)
+        if progress_callback:
+            progress_callback(sample)
+    
+    async def run_fn(output_urls, process_callback, resume=None):
+        # Live encodes run at the tier chosen by the adaptive controller; the cache only holds tier 0
+        tier, settings = tiers.settings_for(job_key) or (0, profile_settings)
+        # After a stall, continue near where the frozen encoder stopped instead of from the top
+        start_offset = None
+        limit = duration_limit
+        if resume:
+            media_duration = None if is_playlist_source(video_path) else (get_media_info(video_path) or {}).get('duration')
+            if media_duration:
+                start_offset = resume['position'] % media_duration
+            if limit:
+                limit = max(1, int(limit - resume['elapsed']))
+        return await run_ffmpeg(video_path, None, is_shorts, log_callback, None, session_id, limit, settings, batch_index, track_progress, output_urls, use_transcode_cache=tier == 0, process_callback=process_callback, cpu_cores=scheduler.cores_for(job_key), mode_callback=lambda mode: supervisor.set_mode(job_key, mode), job_key=job_key, start_offset=start_offset)
+    
+    def on_process(process):
+        planner.attach_process(job_key, process.pid)
+        scheduler.attach(job_key, process.pid)
+        get_resource_sampler().attach(job_key, process.pid)
+        tiers.process_started(job_key)
+    
+    def on_exit():
+        get_resource_sampler().remove(job_key)
+        tiers.remove(job_key)
+        scheduler.remove(job_key)
+        planner.release(job_key)
+    
+    def has_headroom(settings):
+        # Step up only if the costlier tier still fits under the admission threshold
+        current = tiers.settings_for(job_key)
+        if not current:
+            return False
+        _, current_cost = planner.estimate(current[1], is_shorts)
+        _, new_cost = planner.estimate(settings, is_shorts)
+        return (planner.projected_load() + new_cost - current_cost) / planner.total_cores <= planner.threshold
+    
+    def on_tier_change(settings, message):
+        log_callback(message)
+        log_to_database(session_id, "ADAPT", message, video_path, batch_index=batch_index)
+        planner.update_job(job_key, settings, is_shorts)
+        scheduler.reweight(job_key, planner.estimate(settings, is_shorts)[1])
+        supervisor.restart(job_key, "encoder tier change", resume=True)
+    
+    def launch():
+        # Claim a share of the cores before the first encoder starts
+        _, cost = planner.estimate(profile_settings, is_shorts, stream_copy)
+        scheduler.add(job_key, cost)
+        # Stream copies from the cache are already cheap; only live encodes adapt
+        if not stream_copy:
+            tiers.register(job_key, profile_settings, is_shorts, on_tier_change, has_headroom)
+        supervisor.launch(job_key)
+    
+    supervisor.create(
+        job_key,
+        outputs,
+        run_fn,
+        log_callback,
+        session_id=session_id,
+        on_process=on_process,
+        on_exit=on_exit,
+        on_cancel=lambda: planner.cancel(job_key)
+    )
+    
+    # Start now if the host has capacity, otherwise wait in the admission queue
+    return planner.submit(
+        job_key,
+        profile_settings,
+        launch,
+        is_shorts=is_shorts,
+        stream_copy=stream_copy
+    )
+
+# Local RTMP ingest sink for offline throughput and soak testing
+INGEST_DEFAULT_PORT = 1935
+INGEST_GAP_MS = 500
+INGEST_BITRATE_WINDOW = 10
+INGEST_STATS_FILE = "ingest_stats.json"
+INGEST_SERVER_CHUNK_SIZE = 4096
+INGEST_WINDOW_ACK_SIZE = 2500000
+
+def amf0_read(data, offset, size):
+    """size bytes at offset and the offset after them; ValueError if data ends first"""
+    end = offset + size
+    if end > len(data):
+        raise ValueError(f"Truncated AMF0 value: {size} bytes needed at offset {offset}, {len(data) - offset} left")
+    return data[offset:end], end
+
+def amf0_decode(data, offset=0):
+    """Decode one AMF0 value; returns (value, next offset)"""
+    marker, offset = amf0_read(data, offset, 1)
+    marker = marker[0]
+    if marker == 0x00:
+        raw, offset = amf0_read(data, offset, 8)
+        return struct.unpack(">d", raw)[0], offset
+    if marker == 0x01:
+        raw, offset = amf0_read(data, offset, 1)
+        return bool(raw[0]), offset
+    if marker in (0x02, 0x0C):
+        # String has a 16-bit length, long string a 32-bit one
+        raw, offset = amf0_read(data, offset, 2 if marker == 0x02 else 4)
+        raw, offset = amf0_read(data, offset, int.from_bytes(raw, 'big'))
+        return raw.decode('utf-8', 'replace'), offset
+    if marker in (0x03, 0x08):
+        if marker == 0x08:
+            _, offset = amf0_read(data, offset, 4)
+        value = {}
+        while True:
+            raw, offset = amf0_read(data, offset, 2)
+            raw, offset = amf0_read(data, offset, int.from_bytes(raw, 'big'))
+            key = raw.decode('utf-8', 'replace')
+            if not key and data[offset:offset + 1] == b"\x09":
+                return value, offset + 1
+            value[key], offset = amf0_decode(data, offset)
+    if marker in (0x05, 0x06):
+        return None, offset
+    if marker == 0x0A:
+        raw, offset = amf0_read(data, offset, 4)
+        items = []
+        for _ in range(int.from_bytes(raw, 'big')):
+            item, offset = amf0_decode(data, offset)
+            items.append(item)
+        return items, offset
+    if marker == 0x0B:
+        # Date: milliseconds as a double, then a 16-bit time zone
+        raw, offset = amf0_read(data, offset, 10)
+        return struct.unpack_from(">d", raw)[0], offset
+    raise ValueError(f"Unsupported AMF0 marker 0x{marker:02x}")
+
+def amf0_decode_all(data):
+    values = []
+    offset = 0
+    while offset < len(data):
+        value, offset = amf0_decode(data, offset)
+        values.append(value)
+    return values
+
+def amf0_encode(*values):
+    out = bytearray()
+    for value in values:
+        if value is None:
+            out.append(0x05)
+        elif isinstance(value, bool):
+            out += bytes([0x01, int(value)])
+        elif isinstance(value, (int, float)):
+            out.append(0x00)
+            out += struct.pack(">d", value)
+        elif isinstance(value, str):
+            encoded = value.encode('utf-8')
+            out.append(0x02)
+            out += struct.pack(">H", len(encoded)) + encoded
+        elif isinstance(value, dict):
+            out.append(0x03)
+            for key, item in value.items():
+                encoded = key.encode('utf-8')
+                out += struct.pack(">H", len(encoded)) + encoded + amf0_encode(item)
+            out += b"\x00\x00\x09"
+        else:
+            raise TypeError(f"Cannot encode {type(value).__name__} as AMF0")
+    return bytes(out)
+
+class RtmpIngestSink:
+    """Minimal RTMP server that accepts any number of publishers and measures what arrives
+    
+    Media is discarded after measurement. Stats are kept per stream path
+    ("app/stream_key") and survive reconnects so disconnects can be counted.
+    """
+    
+    def __init__(self, host="127.0.0.1", port=INGEST_DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.streams = {}
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.last_error = None
+    
+    @property
+    def url(self):
+        return f"rtmp://{self.host}:{self.port}/live"
+    
+    def start(self):
+        """Start serving on a background thread; returns False if already running"""
+        if self.running():
+            return False
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._serve, args=(started,), name="rtmp-ingest-sink", daemon=True)
+        self.thread.start()
+        started.wait(timeout=5)
+        if self.last_error:
+            raise OSError(self.last_error)
+        return True
+    
+    def stop(self):
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+    
+    def running(self):
+        return bool(self.thread and self.thread.is_alive())
+    
+    def reset(self):
+        with self.lock:
+            self.streams.clear()
+    
+    def snapshot(self):
+        """Per-stream measurements, ready for display or assertions"""
+        now = time.monotonic()
+        with self.lock:
+            result = {}
+            for path, stream in self.streams.items():
+                recent = [size for second, size in stream['buckets'] if second >= int(now) - INGEST_BITRATE_WINDOW]
+                duration = (now if stream['connected'] else stream['ended_at']) - stream['first_seen']
+                intervals = stream['interval_count']
+                mean_interval = stream['interval_sum'] / intervals if intervals else None
+                jitter = None
+                if intervals > 1:
+                    jitter = max(0.0, stream['interval_sum_sq'] / intervals - mean_interval ** 2) ** 0.5
+                media_span = stream['media_seconds'] + (stream['last_video_ts'] - stream['session_first_ts']) / 1000 if stream['last_video_ts'] is not None else stream['media_seconds']
+                result[path] = {
+                    'connected': stream['connected'],
+                    'publishes': stream['publishes'],
+                    'disconnects': stream['disconnects'],
+                    'unexpected_disconnects': stream['unexpected_disconnects'],
+                    'bytes': stream['bytes'],
+                    'bitrate_kbps': sum(recent) * 8 / 1000 / INGEST_BITRATE_WINDOW if stream['connected'] else 0.0,
+                    'average_bitrate_kbps': stream['bytes'] * 8 / 1000 / duration if duration > 0 else 0.0,
+                    'video_frames': stream['video_frames'],
+                    'keyframes': stream['keyframes'],
+                    'audio_frames': stream['audio_frames'],
+                    'fps': 1000 / mean_interval if mean_interval else None,
+                    'frame_jitter_ms': jitter,
+                    'max_timestamp_gap_ms': stream['max_gap'],
+                    'timestamp_gaps': stream['gaps'],
+                    'timestamp_regressions': stream['regressions'],
+                    'max_arrival_gap_ms': stream['max_arrival_gap'] * 1000,
+                    'media_seconds': media_span,
+                    'wall_seconds': duration,
+                    'metadata': dict(stream['metadata'])
+                }
+            return result
+    
+    def write_stats(self, path=INGEST_STATS_FILE):
+        """Dump the snapshot as JSON for external assertions"""
+        stats = {'generated_at': datetime.now().isoformat(), 'url': self.url, 'streams': self.snapshot()}
+        partial = f"{path}.part"
+        with open(partial, 'w') as f:
+            json.dump(stats, f, indent=2)
+        os.replace(partial, path)
+        return stats
+    
+    # Server side
+    def _serve(self, started):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.last_error = None
+        except OSError as e:
+            self.last_error = f"Cannot listen on {self.host}:{self.port}: {e}"
+            started.set()
+            return
+        started.set()
+        try:
+            self.loop.run_until_complete(self.server.serve_forever())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+    
+    def _stream(self, path):
+        return self.streams.setdefault(path, {
+            'connected': False,
+            'publishes': 0,
+            'disconnects': 0,
+            'unexpected_disconnects': 0,
+            'bytes': 0,
+            'buckets': deque(maxlen=INGEST_BITRATE_WINDOW + 2),
+            'first_seen': time.monotonic(),
+            'last_arrival': None,
+            'ended_at': None,
+            'max_arrival_gap': 0.0,
+            'video_frames': 0,
+            'keyframes': 0,
+            'audio_frames': 0,
+            'last_video_ts': None,
+            'session_first_ts': None,
+            'media_seconds': 0.0,
+            'interval_sum': 0,
+            'interval_sum_sq': 0,
+            'interval_count': 0,
+            'max_gap': 0,
+            'gaps': 0,
+            'regressions': 0,
+            'metadata': {}
+        })
+    
+    def _record_media(self, path, msg_type, timestamp, payload):
+        now = time.monotonic()
+        with self.lock:
+            stream = self._stream(path)
+            stream['bytes'] += len(payload)
+            second = int(now)
+            if stream['buckets'] and stream['buckets'][-1][0] == second:
+                stream['buckets'][-1][1] += len(payload)
+            else:
+                stream['buckets'].append([second, len(payload)])
+            if stream['last_arrival'] is not None:
+                stream['max_arrival_gap'] = max(stream['max_arrival_gap'], now - stream['last_arrival'])
+            stream['last_arrival'] = now
+            
+            if msg_type == 8:
+                # AAC sequence headers carry no audio
+                if payload and not (payload[0] >> 4 == 10 and len(payload) > 1 and payload[1] == 0):
+                    stream['audio_frames'] += 1
+                return
+            if not payload or (payload[0] & 0x0F == 7 and len(payload) > 1 and payload[1] != 1):
+                # AVC sequence header / end of sequence
+                return
+            stream['video_frames'] += 1
+            if payload[0] >> 4 == 1:
+                stream['keyframes'] += 1
+            if stream['last_video_ts'] is None:
+                stream['session_first_ts'] = timestamp
+            else:
+                delta = timestamp - stream['last_video_ts']
+                if delta < 0:
+                    stream['regressions'] += 1
+                else:
+                    stream['interval_sum'] += delta
+                    stream['interval_sum_sq'] += delta * delta
+                    stream['interval_count'] += 1
+                    stream['max_gap'] = max(stream['max_gap'], delta)
+                    if delta > INGEST_GAP_MS:
+                        stream['gaps'] += 1
+            stream['last_video_ts'] = timestamp
+    
+    def _publish_started(self, path):
+        with self.lock:
+            stream = self._stream(path)
+            # Carry media time from earlier sessions; a new publisher restarts timestamps
+            if stream['last_video_ts'] is not None:
+                stream['media_seconds'] += (stream['last_video_ts'] - stream['session_first_ts']) / 1000
+            stream['last_video_ts'] = None
+            stream['last_arrival'] = None
+            stream['connected'] = True
+            stream['publishes'] += 1
+    
+    def _publish_ended(self, path, clean):
+        with self.lock:
+            stream = self._stream(path)
+            stream['connected'] = False
+            stream['ended_at'] = time.monotonic()
+            stream['disconnects'] += 1
+            if not clean:
+                stream['unexpected_disconnects'] += 1
+    
+    async def _handle(self, reader, writer):
+        path = None
+        clean = False
+        try:
+            # Plain handshake: zero version bytes in S1 tell clients to skip digest checks
+            c0c1 = await reader.readexactly(1537)
+            s1 = struct.pack(">I", 0) + b"\x00" * 4 + os.urandom(1528)
+            writer.write(b"\x03" + s1 + c0c1[1:])
+            await writer.drain()
+            await reader.readexactly(1536)
+            
+            state = {'chunk_size': 128, 'channels': {}, 'received': 0, 'acked': 0, 'window': None}
+            app_name = ""
+            while True:
+                msg_type, stream_id, timestamp, payload = await self._read_message(reader, state)
+                if state['window'] and state['received'] - state['acked'] >= state['window']:
+                    state['acked'] = state['received']
+                    self._send(writer, 2, 3, struct.pack(">I", state['received'] & 0xFFFFFFFF))
+                
+                if msg_type in (8, 9):
+                    if path:
+                        self._record_media(path, msg_type, timestamp, payload)
+                elif msg_type == 1:
+                    state['chunk_size'] = struct.unpack(">I", payload[:4])[0] & 0x7FFFFFFF
+                elif msg_type == 5:
+                    state['window'] = struct.unpack(">I", payload[:4])[0]
+                elif msg_type == 18 and path:
+                    values = amf0_decode_all(payload)
+                    metadata = next((value for value in values if isinstance(value, dict)), None)
+                    if metadata:
+                        with self.lock:
+                            self._stream(path)['metadata'] = metadata
+                elif msg_type in (17, 20):
+                    values = amf0_decode_all(payload[1:] if msg_type == 17 else payload)
+                    command, transaction = values[0], values[1] if len(values) > 1 else 0
+                    if command == "connect":
+                        app_name = str((values[2] or {}).get("app", "")).strip('/')
+                        self._send(writer, 2, 5, struct.pack(">I", INGEST_WINDOW_ACK_SIZE))
+                        self._send(writer, 2, 6, struct.pack(">IB", INGEST_WINDOW_ACK_SIZE, 2))
+                        self._send(writer, 2, 1, struct.pack(">I", INGEST_SERVER_CHUNK_SIZE))
+                        self._send(writer, 3, 20, amf0_encode(
+                            "_result", transaction,
+                            {"fmsVer": "FMS/3,0,1,123", "capabilities": 31},
+                            {"level": "status", "code": "NetConnection.Connect.Success", "description": "Connection succeeded.", "objectEncoding": 0}
+                        ))
+                    elif command == "createStream":
+                        self._send(writer, 3, 20, amf0_encode("_result", transaction, None, 1))
+                    elif command in ("releaseStream", "FCPublish"):
+                        self._send(writer, 3, 20, amf0_encode("_result", transaction, None, None))
+                    elif command == "publish":
+                        stream_name = str(values[3]) if len(values) > 3 else ""
+                        path = f"{app_name}/{stream_name.split('?')[0]}"
+                        self._publish_started(path)
+                        self._send(writer, 5, 20, amf0_encode(
+                            "onStatus", 0, None,
+                            {"level": "status", "code": "NetStream.Publish.Start", "description": f"{stream_name} is now published."}
+                        ), stream_id=stream_id)
+                    elif command in ("FCUnpublish", "deleteStream", "closeStream"):
+                        clean = True
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self.last_error = f"{path or 'connection'}: {e}"
+        finally:
+            if path:
+                self._publish_ended(path, clean)
+            writer.close()
+    
+    async def _read_message(self, reader, state):
+        """Read chunks until one complete message is assembled"""
+        while True:
+            first = (await reader.readexactly(1))[0]
+            fmt, csid = first >> 6, first & 0x3F
+            if csid == 0:
+                csid = 64 + (await reader.readexactly(1))[0]
+            elif csid == 1:
+                extra = await reader.readexactly(2)
+                csid = 64 + extra[0] + extra[1] * 256
+            channel = state['channels'].setdefault(csid, {
+                'timestamp': 0, 'ts_field': 0, 'length': 0, 'type': 0, 'stream_id': 0, 'extended': False, 'buffer': bytearray()
+            })
+            
+            ts_field = channel['ts_field']
+            if fmt <= 2:
+                header = await reader.readexactly((11, 7, 3)[fmt])
+                ts_field = int.from_bytes(header[0:3], 'big')
+                if fmt <= 1:
+                    channel['length'] = int.from_bytes(header[3:6], 'big')
+                    channel['type'] = header[6]
+                if fmt == 0:
+                    channel['stream_id'] = int.from_bytes(header[7:11], 'little')
+                channel['extended'] = ts_field == 0xFFFFFF
+            if channel['extended']:
+                extended = int.from_bytes(await reader.readexactly(4), 'big')
+                if fmt <= 2:
+                    ts_field = extended
+            
+            if not channel['buffer']:
+                # Same rule as FFmpeg: type 0 carries an absolute timestamp, the rest a delta
+                channel['timestamp'] = ts_field if fmt == 0 else channel['timestamp'] + ts_field
+            channel['ts_field'] = ts_field
+            
+            size = min(state['chunk_size'], channel['length'] - len(channel['buffer']))
+            channel['buffer'] += await reader.readexactly(size)
+            state['received'] += size
+            if len(channel['buffer']) >= channel['length']:
+                payload = bytes(channel['buffer'])
+                channel['buffer'].clear()
+                return channel['type'], channel['stream_id'], channel['timestamp'], payload
+    
+    @staticmethod
+    def _send(writer, csid, msg_type, payload, stream_id=0, chunk_size=INGEST_SERVER_CHUNK_SIZE):
+        # Only Set Chunk Size and smaller messages go out before the client learns our chunk size
+        header = bytes([csid]) + (0).to_bytes(3, 'big') + len(payload).to_bytes(3, 'big') + bytes([msg_type]) + stream_id.to_bytes(4, 'little')
+        parts = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)] or [b""]
+        writer.write(header + parts[0] + b"".join(bytes([0xC0 | csid]) + part for part in parts[1:]))
+
+@st.cache_resource
+def get_ingest_sink(port=INGEST_DEFAULT_PORT):
+    """Process-wide local ingest sink for offline testing"""
+    return RtmpIngestSink(port=port)
+
+def check_ingest_stats(stream, expected_kbps=None, min_bitrate_ratio=0.8, max_gap_ms=INGEST_GAP_MS, max_disconnects=0, min_speed=0.95):
+    """Failed assertions (as messages) for one stream's ingest measurements"""
+    failures = []
+    if stream['unexpected_disconnects'] > max_disconnects:
+        failures.append(f"{stream['unexpected_disconnects']} unexpected disconnects")
+    if stream['max_timestamp_gap_ms'] > max_gap_ms:
+        failures.append(f"timestamp gap {stream['max_timestamp_gap_ms']} ms")
+    if stream['timestamp_regressions']:
+        failures.append(f"{stream['timestamp_regressions']} timestamp regressions")
+    if expected_kbps and stream['average_bitrate_kbps'] < expected_kbps * min_bitrate_ratio:
+        failures.append(f"average bitrate {stream['average_bitrate_kbps']:.0f} kbps < {expected_kbps * min_bitrate_ratio:.0f} kbps")
+    if stream['wall_seconds'] > 0 and stream['media_seconds'] / stream['wall_seconds'] < min_speed:
+        failures.append(f"media/wall ratio {stream['media_seconds'] / stream['wall_seconds']:.2f}")
+    return failures
+
+def format_ingest_table(streams):
+    width = max([len(path) for path in streams] + [6])
+    lines = [f"{'stream':<{width}} {'conn':>4} {'kbps':>8} {'avg kbps':>9} {'fps':>6} {'jitter':>7} {'max gap':>8} {'disc':>5}"]
+    for path, stream in sorted(streams.items()):
+        fps = f"{stream['fps']:.1f}" if stream['fps'] else "-"
+        jitter = f"{stream['frame_jitter_ms']:.1f}" if stream['frame_jitter_ms'] is not None else "-"
+        lines.append(
+            f"{path:<{width}} {'yes' if stream['connected'] else 'no':>4} {stream['bitrate_kbps']:>8.0f} {stream['average_bitrate_kbps']:>9.0f} "
+            f"{fps:>6} {jitter:>7} {stream['max_timestamp_gap_ms']:>8} {stream['disconnects']:>5}"
+        )
+    return "\n".join(lines)
+
+def ingest_sink_cli(argv):
+    """Command line entry point: python app.py ingest-sink [--host H] [--port P]"""
+    parser = argparse.ArgumentParser(prog="app.py ingest-sink", description="Local RTMP receiver that measures every published stream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=INGEST_DEFAULT_PORT)
+    parser.add_argument("--stats-file", default=INGEST_STATS_FILE, help="JSON file refreshed with per-stream stats")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between stats refreshes")
+    args = parser.parse_args(argv)
+    
+    sink = RtmpIngestSink(args.host, args.port)
+    try:
+        sink.start()
+    except OSError as e:
+        parser.exit(1, f"❌ {e}\n")
+    print(f"📥 Ingest sink listening on {sink.url}/<stream_key> (stats: {args.stats_file})")
+    try:
+        while True:
+            time.sleep(args.interval)
+            stats = sink.write_stats(args.stats_file)
+            if stats['streams']:
+                print(format_ingest_table(stats['streams']) + "\n")
+    except KeyboardInterrupt:
+        sink.write_stats(args.stats_file)
+
+def soak_cli(argv):
+    """Command line entry point: python app.py soak VIDEO [--batches N] [--seconds S]"""
+    parser = argparse.ArgumentParser(prog="app.py soak", description="Stream many batches into the local ingest sink and check what arrives")
+    parser.add_argument("video")
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--seconds", type=int, default=600)
+    parser.add_argument("--port", type=int, default=INGEST_DEFAULT_PORT)
+    parser.add_argument("--stats-file", default=INGEST_STATS_FILE)
+    parser.add_argument("--min-kbps", type=float, help="fail streams whose average bitrate is lower")
+    args = parser.parse_args(argv)
+    
+    init_database()
+    sink = RtmpIngestSink(port=args.port)
+    try:
+        sink.start()
+    except OSError as e:
+        parser.exit(1, f"❌ {e}\n")
+    session_id = f"soak-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    
+    def log_callback(msg):
+        # Only problems; 50 encoders of progress lines would drown them
+        if msg.startswith(("❌", "⚠️", "🔁", "🔌")) or "⚠️" in msg or "❌" in msg:
+            print(msg)
+    
+    for batch_index in range(1, args.batches + 1):
+        position = start_supervised_stream(
+            session_id, batch_index, args.video,
+            {f"batch_{batch_index}": f"{sink.url}/{session_id}_batch_{batch_index}"},
+            log_callback
+        )
+        if position:
+            print(f"⏳ Batch {batch_index}: queued for CPU capacity at position {position}")
+    
+    deadline = time.monotonic() + args.seconds
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(min(30, max(0, deadline - time.monotonic())))
+            streams = sink.write_stats(args.stats_file)['streams']
+            connected = sum(1 for stream in streams.values() if stream['connected'])
+            total_kbps = sum(stream['bitrate_kbps'] for stream in streams.values())
+            print(f"📥 {connected}/{args.batches} streams connected, {total_kbps / 1000:.1f} Mbps received")
+    except KeyboardInterrupt:
+        print("⏹️ Soak interrupted")
+    finally:
+        get_stream_supervisor().stop_session(session_id)
+        time.sleep(STOP_GRACE_SECONDS)
+    
+    streams = sink.write_stats(args.stats_file)['streams']
+    print(format_ingest_table(streams))
+    failed = 0
+    for batch_index in range(1, args.batches + 1):
+        stream = streams.get(f"live/{session_id}_batch_{batch_index}")
+        failures = check_ingest_stats(stream, args.min_kbps, min_bitrate_ratio=1.0) if stream else ["never published"]
+        if failures:
+            failed += 1
+            print(f"❌ batch_{batch_index}: {'; '.join(failures)}")
+    print(f"{'✅' if not failed else '❌'} {args.batches - failed}/{args.batches} batches passed")
+    sys.exit(1 if failed else 0)
 
 def auto_process_auth_code():
     """Automatically process authorization code from URL"""
@@ -765,8 +4913,14 @@ def get_youtube_categories():
     }
 
 # Fungsi untuk auto start streaming
-def auto_start_streaming(video_path, stream_key, is_shorts=False, custom_rtmp=None, session_id=None, duration_limit=None, video_settings=None, batch_index=0):
-    """Auto start streaming dengan konfigurasi default"""
+def auto_start_streaming(video_path, stream_key, is_shorts=False, custom_rtmp=None, session_id=None, duration_limit=None, video_settings=None, batch_index=0, shared_batches=None, rtmp_app=None):
+    """Auto start streaming dengan konfigurasi default
+    
+    shared_batches is a list of (batch_index, stream_key) pairs that reuse this
+    batch's encoder; their outputs are fanned out with the tee muxer.
+    rtmp_app is an RTMP application URL (such as the local ingest sink) that
+    every batch publishes to under its own key instead of YouTube ingest.
+    """
     if not video_path or not stream_key:
         st.error("❌ Video atau stream key tidak ditemukan!")
         return False
@@ -775,43 +4929,64 @@ def auto_start_streaming(video_path, stream_key, is_shorts=False, custom_rtmp=No
     if 'batch_streams' not in st.session_state:
         st.session_state['batch_streams'] = {}
     
-    batch_key = f"batch_{batch_index}"
-    st.session_state['batch_streams'][batch_key] = {
-        'streaming': True,
-        'stream_start_time': datetime.now(),
-        'live_logs': []
-    }
+    members = [(batch_index, stream_key)] + list(shared_batches or [])
+    batch_keys = [f"batch_{index}" for index, _ in members]
+    for batch_key in batch_keys:
+        clear_live_logs(batch_key)
+        st.session_state['batch_streams'][batch_key] = {
+            'streaming': True,
+            'stream_start_time': datetime.now(),
+            'encoder_batch': batch_index,
+            'shared_with': [index for index, _ in members if f"batch_{index}" != batch_key]
+        }
     
-    def log_callback(msg):
-        if 'batch_streams' not in st.session_state:
-            st.session_state['batch_streams'] = {}
-        if batch_key not in st.session_state['batch_streams']:
-            st.session_state['batch_streams'][batch_key] = {'live_logs': []}
-        if 'live_logs' not in st.session_state['batch_streams'][batch_key]:
-            st.session_state['batch_streams'][batch_key]['live_logs'] = []
-            
-        st.session_state['batch_streams'][batch_key]['live_logs'].append(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
-        # Keep only last 100 logs in memory
-        if len(st.session_state['batch_streams'][batch_key]['live_logs']) > 100:
-            st.session_state['batch_streams'][batch_key]['live_logs'] = st.session_state['batch_streams'][batch_key]['live_logs'][-100:]
-    
-    # Jalankan FFmpeg di thread terpisah
-    ffmpeg_thread = threading.Thread(
-        target=run_ffmpeg, 
-        args=(video_path, stream_key, is_shorts, log_callback, custom_rtmp or None, session_id, duration_limit, video_settings, batch_index), 
-        daemon=True
-    )
-    ffmpeg_thread.start()
+    # Encoder output arrives on the stream manager loop; apply_stream_events copies it into session state
+    log_callback, progress_callback = make_stream_callbacks(session_id, batch_keys)
     
-    # Simpan referensi thread
-    if 'ffmpeg_threads' not in st.session_state:
-        st.session_state['ffmpeg_threads'] = {}
-    st.session_state['ffmpeg_threads'][batch_key] = ffmpeg_thread
+    if rtmp_app:
+        outputs = {f"batch_{index}": f"{rtmp_app.rstrip('/')}/{key}" for index, key in members}
+    # Custom RTMP only applies to a single output; fan-out always targets YouTube ingest
+    elif len(members) > 1:
+        outputs = {f"batch_{index}": f"rtmp://a.rtmp.youtube.com/live2/{key}" for index, key in members}
+    else:
+        outputs = {f"batch_{batch_index}": custom_rtmp or f"rtmp://a.rtmp.youtube.com/live2/{stream_key}"}
+    
+    # Supervisor owns the FFmpeg process; admission decides when it starts
+    queue_position = start_supervised_stream(
+        session_id,
+        batch_index,
+        video_path,
+        outputs,
+        log_callback,
+        progress_callback,
+        is_shorts=is_shorts,
+        duration_limit=duration_limit,
+        video_settings=video_settings
+    )
+    if queue_position:
+        log_callback(f"⏳ Batch {batch_index}: Waiting for CPU capacity (queue position {queue_position})")
+        log_to_database(session_id, "INFO", f"Batch {batch_index}: Queued for CPU capacity at position {queue_position}", batch_index=batch_index)
     
     # Log ke database
-    log_to_database(session_id, "INFO", f"Batch {batch_index}: Auto streaming started: {video_path}")
+    if len(members) > 1:
+        shared_list = ", ".join(str(index) for index, _ in members)
+        log_to_database(session_id, "INFO", f"Batch {batch_index}: Auto streaming started: {video_path} (one encoder shared by batches {shared_list})", batch_index=batch_index)
+    else:
+        log_to_database(session_id, "INFO", f"Batch {batch_index}: Auto streaming started: {video_path}", batch_index=batch_index)
     return True
 
+def group_batches_by_encoding(batch_starts, video_settings):
+    """Group (batch_index, video, stream_key) entries that can share one encoder
+    
+    Batches streaming the same video with the same encoding profile produce
+    identical output, so they are encoded once and fanned out.
+    """
+    profile = json.dumps(video_settings, sort_keys=True)
+    groups = {}
+    for batch_index, video, stream_key in batch_starts:
+        groups.setdefault((video, profile), []).append((batch_index, stream_key))
+    return [(video, members) for (video, _), members in groups.items()]
+
 # Fungsi untuk auto create live broadcast dengan setting manual/otomatis
 def auto_create_live_broadcast(service, use_custom_settings=True, custom_settings=None, session_id=None, batch_index=0):
     """Auto create live broadcast dengan setting manual atau otomatis"""
@@ -852,7 +5027,7 @@ def auto_create_live_broadcast(service, use_custom_settings=True, custom_setting
                     st.session_state['batch_live_info'] = {}
                 st.session_state['batch_live_info'][f"batch_{batch_index}"] = live_info
                 st.success(f"🎉 Batch {batch_index}: Auto YouTube Live Broadcast Created Successfully!")
-                log_to_database(session_id, "INFO", f"Batch {batch_index}: Auto YouTube Live created: {live_info['watch_url']}")
+                log_to_database(session_id, "INFO", f"Batch {batch_index}: Auto YouTube Live created: {live_info['watch_url']}", batch_index=batch_index)
                 return live_info
             else:
                 st.error(f"❌ Batch {batch_index}: Failed to create auto live broadcast")
@@ -860,9 +5035,181 @@ def auto_create_live_broadcast(service, use_custom_settings=True, custom_setting
     except Exception as e:
         error_msg = f"Batch {batch_index}: Error creating auto YouTube Live: {e}"
         st.error(error_msg)
-        log_to_database(session_id, "ERROR", error_msg)
+        log_to_database(session_id, "ERROR", error_msg, batch_index=batch_index)
         return None
 
+# Live panels rebuilt by Streamlit fragments from in-memory state only
+LIVE_REFRESH_SECONDS = 2
+LIVE_PROGRESS_POINTS = 300
+
+def get_live_refresh_interval():
+    """Seconds between live panel refreshes, or None while this session runs nothing"""
+    # Session flags stay set after a stream ends on its own; the supervisor knows what is live
+    if get_stream_supervisor().active(st.session_state['session_id']):
+        return LIVE_REFRESH_SECONDS
+    return None
+
+def run_live_fragment(render_fn):
+    """Render a live panel as a fragment that polls only while this session has live encoders"""
+    run_every = get_live_refresh_interval()
+    
+    @functools.wraps(render_fn)
+    def render():
+        render_fn()
+        # A fragment keeps its run_every until the whole page reruns: rerun once when the last encoder ends
+        if run_every and get_live_refresh_interval() is None:
+            st.rerun()
+    
+    st.fragment(render, run_every=run_every)()
+
+def render_stream_status():
+    """LIVE/OFFLINE state, encoder progress and admission queue"""
+    apply_stream_events()
+    streaming = st.session_state.get('streaming', False)
+    if streaming:
+        st.error("🔴 LIVE")
+        
+        # Live stats
+        if 'stream_start_time' in st.session_state:
+            duration = datetime.now() - st.session_state['stream_start_time']
+            st.metric("⏱️ Duration", str(duration).split('.')[0])
+        
+        # Encoder health from the latest progress sample
+        if 'stream_progress' in st.session_state:
+            progress = st.session_state['stream_progress']
+            col_prog1, col_prog2 = st.columns(2)
+            with col_prog1:
+                st.metric("⚡ Speed", f"{progress['speed']}x" if progress['speed'] is not None else "N/A")
+            with col_prog2:
+                st.metric("🎞️ FPS", progress['fps'] if progress['fps'] is not None else "N/A")
+    else:
+        st.success("⚫ OFFLINE")
+    
+    # Batch Streaming Status
+    if 'batch_streams' in st.session_state:
+        active_batches = sum(1 for batch in st.session_state['batch_streams'].values() if batch.get('streaming', False))
+        if active_batches > 0:
+            st.warning(f"🔴 BATCH LIVE ({active_batches} active)")
+        else:
+            st.success("⚫ BATCH OFFLINE")
+    
+    # Admission control: projected CPU load and queued streams
+    capacity = get_capacity_planner().snapshot()
+    load_ratio = capacity['projected_load'] / capacity['total_cores']
+    st.progress(min(load_ratio, 1.0), text=f"🧮 Projected CPU load: {capacity['projected_load']:.1f} / {capacity['total_cores']} cores ({load_ratio:.0%}, limit {capacity['threshold']:.0%})")
+    if capacity['waiting']:
+        st.warning(f"⏳ {len(capacity['waiting'])} stream(s) waiting for CPU capacity")
+        for job in capacity['waiting']:
+            batch_index = job_batch_key(job['job_key']).replace('batch_', '')
+            st.caption(f"#{job['position']} · Batch {batch_index} · needs ~{job['cost']:.1f} cores · queued {job['queued_at'].strftime('%H:%M:%S')}")
+
+def render_encoder_supervisor():
+    """Per-batch encoder state, placement, tier and resource usage with stop buttons"""
+    supervised = get_stream_supervisor().snapshot(st.session_state['session_id'])
+    placement = get_core_scheduler().snapshot()
+    encoder_tiers = get_encoder_tier_manager().snapshot()
+    sampler = get_resource_sampler()
+    if supervised:
+        st.subheader("🛡️ Encoder Supervisor")
+        for row in supervised:
+            batch_labels = ", ".join(key.replace('batch_', '') for key in row['batches'])
+            uptime = str(timedelta(seconds=int(row['uptime'])))
+            col_sup1, col_sup2 = st.columns([3, 1])
+            with col_sup1:
+                st.write(f"**Batch {batch_labels}** · {row['state']}" + (f" · {row['mode']}" if row['mode'] else ""))
+                st.caption(f"Uptime {uptime} · Restarts {row['restarts']} · PID {row['pid'] or '-'} · Last exit {row['last_exit_code'] if row['last_exit_code'] is not None else '-'}")
+                if row['stalls']:
+                    last_stall = f" · last {row['last_stall_seconds']:.0f}s without progress" if row['last_stall_seconds'] is not None else " · recovering"
+                    st.caption(f"🧊 Stalls {row['stalls']}{last_stall}")
+                if row['job_key'] in placement:
+                    cores = placement[row['job_key']]
+                    speed = f"{cores['speed']}x" if cores['speed'] is not None else "N/A"
+                    st.caption(f"Cores {format_core_list(cores['cores'])} ({cores['threads']} threads) · Speed {speed}")
+                if row['job_key'] in encoder_tiers:
+                    tier = encoder_tiers[row['job_key']]
+                    pressure = " · ⚠️ below real time" if tier['under_pressure'] else ""
+                    st.caption(f"Encoder tier {tier['tier']}/{tier['max_tier']} ({tier['label']}){pressure}")
+                usage = sampler.latest(row['job_key'])
+                if usage:
+                    io = f"{usage['read_kbps']:.0f}/{usage['write_kbps']:.0f} kB/s" if usage['read_kbps'] is not None else "N/A"
+                    st.caption(f"CPU {usage['cpu_percent']:.0f}% · RSS {usage['rss_mb']:.0f} MB · I/O r/w {io} · {usage['threads']} threads")
+                    st.line_chart({'CPU %': sampler.series_for(row['job_key'])}, height=80)
+            with col_sup2:
+                if row['state'] not in ('stopped', 'finished'):
+                    for batch_key in row['batches']:
+                        if st.button("⏹️", key=f"stop_{row['job_key']}_{batch_key}", help=f"Stop {batch_key.replace('_', ' ')}"):
+                            get_stream_supervisor().stop_batch(batch_key, st.session_state['session_id'])
+                            if batch_key in st.session_state.get('batch_streams', {}):
+                                st.session_state['batch_streams'][batch_key]['streaming'] = False
+                            st.rerun()
+        
+        tier_decisions = get_encoder_tier_manager().recent_decisions(st.session_state['session_id'])
+        if tier_decisions:
+            with st.expander(f"🎚️ Adaptive encoder decisions ({len(tier_decisions)})"):
+                for decision in tier_decisions[:20]:
+                    st.text(f"[{decision['time'].strftime('%H:%M:%S')}] {decision['message']}")
+
+def render_live_metrics():
+    """Counters from the log bus, resource sampler and log writer"""
+    st.metric("Live Log Entries", get_log_bus().count(st.session_state['session_id'], LOG_BUS_STREAM))
+
+    # Host resource usage from the sampler's in-memory tier
+    host_usage = get_resource_sampler().latest(RESOURCE_HOST)
+    if host_usage:
+        col_host1, col_host2 = st.columns(2)
+        with col_host1:
+            st.metric("Host CPU", f"{host_usage['cpu_percent']:.0f}%")
+        with col_host2:
+            st.metric("Host Memory", f"{host_usage['rss_mb'] / 1024:.1f} GB", help=f"{host_usage['threads']} encoder threads")
+    
+    # Log writer statistics
+    writer_stats = get_log_writer().stats()
+    col_stat1, col_stat2 = st.columns(2)
+    with col_stat1:
+        st.metric("Queued Log Rows", writer_stats['queued'])
+    with col_stat2:
+        st.metric("Dropped Log Rows", writer_stats['dropped'])
+    if writer_stats['last_error']:
+        st.warning(f"Log writer error: {writer_stats['last_error']}")
+
+    # Batch statistics
+    if 'batch_streams' in st.session_state:
+        active_batches = sum(1 for batch in st.session_state['batch_streams'].values() if batch.get('streaming', False))
+        st.metric("Active Batches", active_batches)
+
+def render_live_logs():
+    """Tail of the live log bus and per-batch encoder health"""
+    apply_stream_events()
+    
+    # Live logs container
+    log_container = st.container()
+    with log_container:
+        # Show last 50 live logs
+        recent_logs = read_live_logs(LOG_BUS_STREAM, 50)
+        if recent_logs:
+            logs_text = "\n".join(recent_logs)
+            st.text_area("Live Logs", logs_text, height=300, disabled=True)
+        else:
+            st.info("No live logs available. Start streaming to see real-time logs.")
+    
+    # Batch logs if available
+    if 'batch_streams' in st.session_state:
+        for batch_key, batch_data in st.session_state['batch_streams'].items():
+            if batch_data.get('streaming', False):
+                batch_index = batch_key.replace('batch_', '')
+                with st.expander(f"🔄 Batch {batch_index} Logs"):
+                    recent_batch_logs = read_live_logs(batch_key, 20)  # Last 20 logs per batch
+                    batch_logs_text = "\n".join(recent_batch_logs)
+                    st.text_area(f"Batch {batch_index} Logs", batch_logs_text, height=150, disabled=True)
+                    
+                    # Encoder health chart from the progress samples received this session
+                    samples = batch_data.get('progress_history')
+                    if samples:
+                        st.line_chart({
+                            'speed': [sample['speed'] for sample in samples],
+                            'fps': [sample['fps'] for sample in samples]
+                        }, height=150)
+
 def main():
     # Page configuration must be the first Streamlit command
     st.set_page_config(
@@ -878,8 +5225,8 @@ def main():
     if 'session_id' not in st.session_state:
         st.session_state['session_id'] = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     
-    if 'live_logs' not in st.session_state:
-        st.session_state['live_logs'] = []
+    # Pick up encoder progress published since the last rerun
+    apply_stream_events()
     
     st.title("🎥 Advanced YouTube Live Streaming Platform")
     st.markdown("---")
@@ -1006,6 +5353,31 @@ def main():
         
         
         
+        # Media library location
+        st.markdown("---")
+        st.subheader("📂 Media Library")
+        media_library = get_media_library()
+        library_root = st.text_input("Folder", value=media_library.root, help="Indexed in the background; new, changed and removed videos are picked up automatically")
+        library_recursive = st.checkbox("Include subfolders", value=media_library.recursive)
+        if os.path.isdir(library_root):
+            media_library.set_root(library_root, library_recursive)
+        else:
+            st.error(f"❌ Folder not found: {library_root}")
+        # Give the first scan of a folder a moment so the page opens with a full list
+        media_library.wait_ready(MEDIA_LIBRARY_FIRST_SCAN_WAIT)
+        library_stats = media_library.stats()
+        if library_stats['scanned_at']:
+            st.caption(
+                f"{library_stats['files']} videos · {library_stats['total_bytes'] / 1024 ** 3:.1f} GB · "
+                f"{library_stats['unprobed']} awaiting metadata · scanned {library_stats['scanned_at'].strftime('%H:%M:%S')} in {library_stats['scan_seconds']:.2f}s"
+            )
+        else:
+            st.caption("🔍 Indexing...")
+        if library_stats['last_error']:
+            st.warning(f"Media library error: {library_stats['last_error']}")
+        if st.button("🔄 Rescan Library"):
+            media_library.refresh()
+        
         # Log Management
         st.markdown("---")
         st.subheader("📊 Log Management")
@@ -1017,19 +5389,53 @@ def main():
         
         with col_log2:
             if st.button("🗑️ Clear Session Logs"):
-                st.session_state['live_logs'] = []
+                clear_live_logs(LOG_BUS_STREAM)
                 st.success("Logs cleared!")
         
-        # Export logs
-        if st.button("📥 Export All Logs"):
-            all_logs = get_logs_from_database(limit=1000)
-            if all_logs:
-                logs_text = "\n".join([f"[{log[0]}] {log[1]}: {log[2]}" for log in all_logs])
+        # Retention: aged-out rows are archived and deleted in the background
+        retention = get_retention_engine().status()
+        policies = ", ".join(f"{log_type} {days}d" for log_type, days in LOG_RETENTION_DAYS.items())
+        st.caption(f"🗄️ Retention: {policies}, others {LOG_RETENTION_DEFAULT_DAYS}d, progress {PROGRESS_RETENTION_DAYS}d, resource rollups {ROLLUP_RETENTION_DAYS}d, stalls {STALL_RETENTION_DAYS}d")
+        if retention['running']:
+            st.caption("🧹 Retention pass running...")
+        elif retention['last_result']:
+            result = retention['last_result']
+            st.caption(f"Last pass {retention['last_run'].strftime('%H:%M')}: archived {result['archived']} rows to `{RETENTION_ARCHIVE_DIR}/`, freed {result['vacuumed_pages']} pages")
+        if retention['last_error']:
+            st.warning(f"Retention error: {retention['last_error']}")
+        if st.button("🧹 Run Retention Now"):
+            get_retention_engine().trigger()
+        
+        # Export logs: streamed to a gzip file on disk, served on download
+        with st.expander("📥 Export Logs"):
+            export_format = st.radio("Format", LOG_EXPORT_FORMATS, format_func=str.upper, horizontal=True)
+            export_type = st.selectbox("Type", ["All", "INFO", "ERROR", "FFMPEG", "ADAPT"], key="export_type")
+            export_session = st.checkbox("Current session only", key="export_session")
+            export_dates = st.date_input("Date range", value=(), key="export_dates", help="Leave empty for all dates")
+            
+            if st.button("📦 Prepare Export"):
+                try:
+                    with st.spinner("Exporting logs..."):
+                        st.session_state['log_export'] = export_logs(
+                            export_format,
+                            session_id=st.session_state['session_id'] if export_session else None,
+                            log_type=None if export_type == "All" else export_type,
+                            since=datetime.combine(export_dates[0], datetime.min.time()) if len(export_dates) >= 1 else None,
+                            until=datetime.combine(export_dates[-1], datetime.min.time()) + timedelta(days=1) if len(export_dates) >= 1 else None
+                        )
+                except (sqlite3.Error, OSError) as e:
+                    st.error(f"Error exporting logs: {e}")
+            
+            export_path, export_rows = st.session_state.get('log_export', (None, 0))
+            if export_path and export_path.exists():
+                st.caption(f"{export_rows} rows · {export_path.stat().st_size / 1024:.1f} KB compressed")
                 st.download_button(
                     label="💾 Download Logs",
-                    data=logs_text,
-                    file_name=f"streaming_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                    mime="text/plain"
+                    # Opened only when clicked, so reruns never load the file
+                    data=lambda: open(export_path, "rb"),
+                    file_name=export_path.name,
+                    mime="application/gzip",
+                    on_click="ignore"
                 )
     
     # Main content area
@@ -1038,27 +5444,46 @@ def main():
     with col1:
         st.header("🎥 Video & Streaming Setup")
         
-        # Video selection
-        video_files = [f for f in os.listdir('.') if f.endswith(('.mp4', '.flv', '.avi', '.mov', '.mkv'))]
+        # Video selection from the background-indexed media library
+        media_library = get_media_library()
+        video_files = media_library.files()
         
         if video_files:
             st.write("📁 Available videos:")
             selected_video = st.selectbox("Select video", video_files)
+            media_info = (media_library.get(selected_video) or {}).get('info')
+            if media_info:
+                st.caption(
+                    f"📐 {media_info['width']}x{media_info['height']} · {media_info['video_codec']}/{media_info['audio_codec']} · "
+                    f"{(media_info['fps'] or 0):.2f} fps · {timedelta(seconds=int(media_info['duration'] or 0))}"
+                )
         else:
             selected_video = None
-            st.info("No video files found in current directory")
+            st.info(f"No video files found in {media_library.root}" if media_library.stats()['scanned_at'] else "🔍 Indexing media library...")
         
         # Video upload - MODIFIED FOR MULTIPLE UPLOADS
         uploaded_files = st.file_uploader("Or upload new videos", type=['mp4', '.flv', '.avi', '.mov', '.mkv'], accept_multiple_files=True)
 
         if uploaded_files:
             uploaded_video_paths = []
+            # Each attached file is ingested once; later reruns reuse the result
+            ingested_uploads = st.session_state.setdefault('ingested_uploads', {})
             for uploaded_file in uploaded_files:
-                with open(uploaded_file.name, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                st.success(f"✅ Video {uploaded_file.name} uploaded successfully!")
-                uploaded_video_paths.append(uploaded_file.name)
-                log_to_database(st.session_state['session_id'], "INFO", f"Video uploaded: {uploaded_file.name}")
+                upload_id = (uploaded_file.file_id, media_library.root)
+                if upload_id not in ingested_uploads:
+                    try:
+                        upload_path, status = ingest_upload(uploaded_file, media_library.root)
+                    except OSError as e:
+                        st.error(f"❌ Failed to save {uploaded_file.name}: {e}")
+                        continue
+                    media_library.add(upload_path)
+                    ingested_uploads[upload_id] = upload_path
+                    if status == "duplicate":
+                        st.success(f"✅ Video {uploaded_file.name} already in the library, linked without rewriting")
+                    else:
+                        st.success(f"✅ Video {uploaded_file.name} uploaded successfully!")
+                    log_to_database(st.session_state['session_id'], "INFO", f"Video uploaded: {uploaded_file.name} ({status})")
+                uploaded_video_paths.append(ingested_uploads[upload_id])
             
             # Store all uploaded video paths in session state
             st.session_state['uploaded_video_paths'] = uploaded_video_paths
@@ -1462,6 +5887,45 @@ def main():
         # Advanced settings
         with st.expander("⚙️ Advanced Settings"):
             custom_rtmp = st.text_input("🌐 Custom RTMP URL (optional)")
+            
+            supervisor = get_stream_supervisor()
+            supervisor.stall_window = st.number_input(
+                "🧊 Stall timeout (s)",
+                min_value=5,
+                max_value=300,
+                value=int(supervisor.stall_window),
+                help="Encoders that report no progress for this long are killed and resumed near their last position"
+            )
+            
+            # Offline testing target: a local RTMP receiver that measures every stream
+            sink_publish_url = None
+            if st.checkbox("🧪 Local ingest sink (offline testing)", help="Receive streams locally instead of sending them to YouTube"):
+                ingest_sink = get_ingest_sink()
+                try:
+                    ingest_sink.start()
+                except OSError as e:
+                    st.error(f"❌ {e}")
+                if st.checkbox("Publish batches to local ingest sink", help="Batch streaming publishes every batch to the sink under its own key and creates no YouTube broadcasts"):
+                    sink_publish_url = ingest_sink.url
+                st.caption(f"For a single stream, set the Custom RTMP URL to `{ingest_sink.url}/<key>`")
+                ingest_streams = ingest_sink.snapshot()
+                if ingest_streams:
+                    st.dataframe([
+                        {
+                            'Stream': path,
+                            'Connected': stream['connected'],
+                            'kbps': round(stream['bitrate_kbps']),
+                            'Avg kbps': round(stream['average_bitrate_kbps']),
+                            'FPS': round(stream['fps'], 1) if stream['fps'] else None,
+                            'Jitter ms': round(stream['frame_jitter_ms'], 1) if stream['frame_jitter_ms'] is not None else None,
+                            'Max gap ms': stream['max_timestamp_gap_ms'],
+                            'Disconnects': stream['disconnects']
+                        }
+                        for path, stream in sorted(ingest_streams.items())
+                    ])
+                    if st.button("🧹 Reset Ingest Stats"):
+                        ingest_sink.reset()
+                        st.rerun()
             enable_dvr = st.checkbox("📹 Enable DVR", value=True)
             enable_content_encryption = st.checkbox("🔐 Enable Content Encryption")
             
@@ -1483,12 +5947,8 @@ def main():
         # Manual Live Stream Settings for Each Batch
         st.subheader("🔧 Batch Configuration")
         with st.expander("🛠️ Configure Each Batch Settings"):
-            # Get all available videos including uploaded ones
-            all_videos = [f for f in os.listdir('.') if f.endswith(('.mp4', '.flv', '.avi', '.mov', '.mkv'))]
-            if 'uploaded_video_paths' in st.session_state:
-                all_videos.extend(st.session_state['uploaded_video_paths'])
-                # Remove duplicates
-                all_videos = list(set(all_videos))
+            # Uploads are indexed as soon as they are written
+            all_videos = list(media_library.files())
             
             # Initialize batch configurations
             if 'batch_configs' not in st.session_state:
@@ -1532,9 +5992,35 @@ def main():
                         index=0
                     )
                 
+                # Playlist mode: several videos through one long-lived encoder
+                batch_playlist = None
+                batch_shuffle = False
+                if st.checkbox(f"🎞️ Playlist mode for Batch {i+1}", key=f"batch_playlist_mode_{i}"):
+                    col_playlist1, col_playlist2 = st.columns([3, 1])
+                    with col_playlist1:
+                        batch_playlist = st.multiselect(
+                            f"📃 Playlist for Batch {i+1} (in order)",
+                            all_videos,
+                            default=[batch_video] if batch_video in all_videos else [],
+                            key=f"batch_playlist_{i}"
+                        )
+                    with col_playlist2:
+                        batch_shuffle = st.checkbox("🔀 Shuffle", key=f"batch_shuffle_{i}")
+                    
+                    # Edits apply to a running stream at the next item, without reconnecting
+                    playlist_id = make_job_key(st.session_state['session_id'], i+1)
+                    running_playlist = get_playlist_store().get(playlist_id)
+                    if running_playlist:
+                        if get_playlist_store().update(playlist_id, batch_playlist, batch_shuffle):
+                            st.success(f"✅ Batch {i+1} playlist updated; changes apply after the current video")
+                        if running_playlist['current']:
+                            st.caption(f"▶️ Now playing: {running_playlist['current']} · Up next: {', '.join(running_playlist['order'][:3]) or 'new pass'}")
+                
                 # Store batch configuration
                 st.session_state['batch_configs'][f"batch_{i+1}"] = {
                     'video': batch_video,
+                    'playlist': batch_playlist,
+                    'shuffle': batch_shuffle,
                     'title': batch_title,
                     'description': batch_description,
                     'privacy': batch_privacy,
@@ -1602,29 +6088,53 @@ def main():
                     "audio_codec": audio_codec
                 }
                 st.session_state['video_settings'] = video_settings
+                
+                # What this host sustained for the selected profile in the last benchmark
+                capacity = get_capacity_report().get(get_encoding_profile({**video_settings, "preset": "veryfast"}))
+                if capacity:
+                    st.caption(
+                        f"🧪 This host sustains about **{capacity['max_realtime_streams']}** concurrent real-time streams "
+                        f"with this profile ({capacity['cpu_seconds_per_second']:.2f} CPU s per second, {capacity['peak_rss_mb']:.0f} MB each)"
+                    )
+                else:
+                    st.caption("🧪 Profile not benchmarked on this host yet")
+        
+        with st.expander("🧪 Host Capacity Benchmark"):
+            st.caption(f"Encodes {BENCHMARK_CLIP_SECONDS}s of up to {BENCHMARK_MAX_CLIPS} library clips for every profile in the matrix. Also available as `python app.py benchmark`.")
+            benchmark_runner = get_benchmark_runner()
+            busy = any(row['state'] in ('starting', 'running') for row in get_stream_supervisor().snapshot())
+            col_bench1, col_bench2 = st.columns(2)
+            with col_bench1:
+                if st.button("▶️ Run Benchmark", disabled=benchmark_runner.running() or busy, help="Unavailable while encoders are running" if busy else None):
+                    benchmark_runner.start()
+                    st.rerun()
+            with col_bench2:
+                if benchmark_runner.running() and st.button("⏹️ Stop Benchmark"):
+                    benchmark_runner.stop()
+            if benchmark_runner.last_error:
+                st.error(f"Benchmark gagal: {benchmark_runner.last_error}")
+            if benchmark_runner.log:
+                st.text_area("Benchmark Log", "\n".join(benchmark_runner.log), height=150, disabled=True)
+            
+            capacity_report = get_capacity_report()
+            if capacity_report:
+                st.dataframe([
+                    {
+                        'Profile': profile,
+                        'CPU s/s': round(report['cpu_seconds_per_second'], 2),
+                        'Peak RSS MB': round(report['peak_rss_mb']),
+                        'FPS': round(report['achieved_fps']),
+                        'Speed': f"{report['speed']:.2f}x",
+                        'Max Streams': report['max_realtime_streams'],
+                        'Measured': report['measured_at'][:16]
+                    }
+                    for profile, report in capacity_report.items()
+                ])
     
     with col2:
         st.header("📊 Status & Controls")
         
-        # Streaming status
-        streaming = st.session_state.get('streaming', False)
-        if streaming:
-            st.error("🔴 LIVE")
-            
-            # Live stats
-            if 'stream_start_time' in st.session_state:
-                duration = datetime.now() - st.session_state['stream_start_time']
-                st.metric("⏱️ Duration", str(duration).split('.')[0])
-        else:
-            st.success("⚫ OFFLINE")
-        
-        # Batch Streaming Status
-        if 'batch_streams' in st.session_state:
-            active_batches = sum(1 for batch in st.session_state['batch_streams'].values() if batch.get('streaming', False))
-            if active_batches > 0:
-                st.warning(f"🔴 BATCH LIVE ({active_batches} active)")
-            else:
-                st.success("⚫ BATCH OFFLINE")
+        run_live_fragment(render_stream_status)
         
         # Control buttons
         if st.button("▶️ Start Streaming", type="primary"):
@@ -1652,15 +6162,9 @@ def main():
                 # Start streaming
                 st.session_state['streaming'] = True
                 st.session_state['stream_start_time'] = datetime.now()
-                st.session_state['live_logs'] = []
+                clear_live_logs(LOG_BUS_STREAM)
                 
-                def log_callback(msg):
-                    if 'live_logs' not in st.session_state:
-                        st.session_state['live_logs'] = []
-                    st.session_state['live_logs'].append(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
-                    # Keep only last 100 logs in memory
-                    if len(st.session_state['live_logs']) > 100:
-                        st.session_state['live_logs'] = st.session_state['live_logs'][-100:]
+                log_callback, progress_callback = make_stream_callbacks(st.session_state['session_id'])
                 
                 # Ambil durasi dari pilihan pengguna
                 duration_limit = None
@@ -1676,30 +6180,39 @@ def main():
                 # Get video settings from session state
                 video_settings = st.session_state.get('video_settings', None)
                 
-                st.session_state['ffmpeg_thread'] = threading.Thread(
-                    target=run_ffmpeg, 
-                    args=(video_path, stream_key, is_shorts, log_callback, custom_rtmp or None, st.session_state['session_id'], duration_limit, video_settings), 
-                    daemon=True
+                # Supervisor owns the FFmpeg process; admission decides when it starts
+                queue_position = start_supervised_stream(
+                    st.session_state['session_id'],
+                    0,
+                    video_path,
+                    {"batch_0": custom_rtmp or f"rtmp://a.rtmp.youtube.com/live2/{stream_key}"},
+                    log_callback,
+                    progress_callback,
+                    is_shorts=is_shorts,
+                    duration_limit=duration_limit,
+                    video_settings=video_settings
                 )
-                st.session_state['ffmpeg_thread'].start()
+                if queue_position:
+                    st.info(f"⏳ Waiting for CPU capacity (queue position {queue_position})")
                 st.success("🚀 Streaming started!")
                 log_to_database(st.session_state['session_id'], "INFO", f"Streaming started: {video_path}")
                 st.rerun()
         
         # Batch Start Streaming Button
         if st.button("🔄 Start Batch Streaming", type="primary", help="Start multiple live streams simultaneously with different settings"):
-            if 'youtube_service' not in st.session_state:
+            if 'youtube_service' not in st.session_state and not sink_publish_url:
                 st.error("❌ YouTube service not available!")
                 return
             
-            service = st.session_state['youtube_service']
+            service = st.session_state.get('youtube_service')
             batch_count = st.session_state.get('batch_count_slider', 3)  # Use the slider value
             
             # Get video settings
             video_settings = st.session_state.get('video_settings', None)
             
-            # Create and start batch streams
+            # Create live broadcasts for every batch first
             success_count = 0
+            batch_starts = []
             for i in range(batch_count):
                 batch_key = f"batch_{i+1}"
                 if batch_key in st.session_state.get('batch_configs', {}):
@@ -1715,28 +6228,45 @@ def main():
                         'made_for_kids': batch_config['made_for_kids']
                     }
                     
-                    live_info = auto_create_live_broadcast(
-                        service,
-                        use_custom_settings=True,
-                        custom_settings=batch_settings,
-                        session_id=st.session_state['session_id'],
-                        batch_index=i+1
-                    )
-                    
-                    if live_info:
-                        # Start streaming for this batch with its specific video
-                        if auto_start_streaming(
-                            batch_config['video'],
-                            live_info['stream_key'],
+                    if sink_publish_url:
+                        # Offline publishing to the local ingest sink: no YouTube broadcast needed
+                        live_info = {'stream_key': f"{st.session_state['session_id'][:8]}_batch_{i+1}"}
+                    else:
+                        live_info = auto_create_live_broadcast(
+                            service,
+                            use_custom_settings=True,
+                            custom_settings=batch_settings,
                             session_id=st.session_state['session_id'],
-                            video_settings=video_settings,
                             batch_index=i+1
-                        ):
-                            success_count += 1
-                        else:
-                            st.error(f"❌ Failed to start streaming for batch {i+1}")
+                        )
+                    
+                    if live_info:
+                        batch_video = batch_config['video']
+                        if batch_config.get('playlist'):
+                            playlist_id = make_job_key(st.session_state['session_id'], i+1)
+                            get_playlist_store().update(playlist_id, batch_config['playlist'], batch_config.get('shuffle', False))
+                            batch_video = PLAYLIST_SCHEME + playlist_id
+                        batch_starts.append((i+1, batch_video, live_info['stream_key']))
                     else:
                         st.error(f"❌ Failed to create live broadcast for batch {i+1}")
+            
+            # Start one encoder per (video, encoding profile) group
+            for batch_video, members in group_batches_by_encoding(batch_starts, video_settings):
+                (first_index, first_key), shared = members[0], members[1:]
+                if auto_start_streaming(
+                    batch_video,
+                    first_key,
+                    session_id=st.session_state['session_id'],
+                    video_settings=video_settings,
+                    batch_index=first_index,
+                    shared_batches=shared,
+                    rtmp_app=sink_publish_url
+                ):
+                    success_count += len(members)
+                    if shared:
+                        st.info(f"♻️ Batches {', '.join(str(index) for index, _ in members)} share one encoder for {batch_video}")
+                else:
+                    st.error(f"❌ Failed to start streaming for batch {', '.join(str(index) for index, _ in members)}")
                 
             if success_count > 0:
                 st.success(f"🎉 Started {success_count} batch streams successfully!")
@@ -1747,7 +6277,7 @@ def main():
             st.session_state['streaming'] = False
             if 'stream_start_time' in st.session_state:
                 del st.session_state['stream_start_time']
-            os.system("pkill ffmpeg")
+            get_stream_supervisor().stop_batch("batch_0", st.session_state['session_id'])
             if os.path.exists("temp_video.mp4"):
                 os.remove("temp_video.mp4")
             st.warning("⏸️ Streaming stopped!")
@@ -1756,17 +6286,16 @@ def main():
         
         # Stop Batch Streaming Button
         if st.button("⏹️ Stop All Batch Streaming", type="secondary"):
-            if 'ffmpeg_threads' in st.session_state:
-                for thread in st.session_state['ffmpeg_threads'].values():
-                    if thread.is_alive():
-                        # Note: In practice, you'd want a more graceful shutdown
-                        pass
-                os.system("pkill ffmpeg")
+            stopped = get_stream_supervisor().stop_session(st.session_state['session_id'], exclude=("batch_0",))
+            if stopped or st.session_state.get('batch_streams'):
                 st.session_state['batch_streams'] = {}
-                st.session_state['ffmpeg_threads'] = {}
                 st.warning("⏹️ All batch streaming stopped!")
+                log_to_database(st.session_state['session_id'], "INFO", f"All batch streaming stopped by user ({len(stopped)} encoders)")
                 st.rerun()
         
+        # Supervised encoders: state, restarts, uptime and core placement per batch
+        run_live_fragment(render_encoder_supervisor)
+        
         # Live broadcast info
         if 'live_broadcast_info' in st.session_state:
             st.subheader("📺 Live Broadcast")
@@ -1793,14 +6322,19 @@ def main():
         session_logs = get_logs_from_database(st.session_state['session_id'], 50)
         st.metric("Session Logs", len(session_logs))
         
-        if 'live_logs' in st.session_state:
-            st.metric("Live Log Entries", len(st.session_state['live_logs']))
-        
-        # Batch statistics
-        if 'batch_streams' in st.session_state:
-            active_batches = sum(1 for batch in st.session_state['batch_streams'].values() if batch.get('streaming', False))
-            st.metric("Active Batches", active_batches)
+        run_live_fragment(render_live_metrics)
         
+        # Transcode cache statistics
+        cache_stats = get_transcode_cache_stats()
+        transcode_worker = get_transcode_worker()
+        col_cache1, col_cache2 = st.columns(2)
+        with col_cache1:
+            st.metric("Cached Encodes", cache_stats['entries'], help=f"{cache_stats['size_bytes'] / 1024 ** 3:.1f} GB of {TRANSCODE_CACHE_MAX_BYTES / 1024 ** 3:.0f} GB")
+        with col_cache2:
+            st.metric("Pending Pre-transcodes", transcode_worker.pending_count())
+        if transcode_worker.last_error:
+            st.warning(f"Pre-transcode error: {transcode_worker.last_error}")
+
         # Channel info display
         if 'channel_config' in st.session_state:
             config = st.session_state['channel_config']
@@ -1838,9 +6372,12 @@ def main():
         if duration_option == "⏱️ Custom Waktu":
             st.info(f"⏰ Streaming akan berhenti otomatis setelah {timedelta(seconds=total_custom_seconds)}")
         elif duration_option == "🎬 Ikuti Panjang Video" and video_path:
-            video_duration = get_video_duration(video_path)
+            # Never probe on a rerun: read the cache and let the worker pool fill it
+            video_duration = get_video_duration(video_path, wait=False)
             if video_duration:
                 st.info(f"⏰ Streaming akan berhenti otomatis setelah {timedelta(seconds=int(video_duration))}")
+            else:
+                st.caption("🔍 Membaca durasi video...")
     
     # Live Logs Section
     st.markdown("---")
@@ -1852,33 +6389,9 @@ def main():
     with tab1:
         st.subheader("Real-time Streaming Logs")
         
-        # Live logs container
-        log_container = st.container()
-        with log_container:
-            if 'live_logs' in st.session_state and st.session_state['live_logs']:
-                # Show last 50 live logs
-                recent_logs = st.session_state['live_logs'][-50:]
-                logs_text = "\n".join(recent_logs)
-                st.text_area("Live Logs", logs_text, height=300, disabled=True, key="live_logs_display")
-            else:
-                st.info("No live logs available. Start streaming to see real-time logs.")
-        
-        # Batch logs if available
-        if 'batch_streams' in st.session_state:
-            for batch_key, batch_data in st.session_state['batch_streams'].items():
-                if batch_data.get('streaming', False) and 'live_logs' in batch_data:
-                    batch_index = batch_key.replace('batch_', '')
-                    with st.expander(f"🔄 Batch {batch_index} Logs"):
-                        recent_batch_logs = batch_data['live_logs'][-20:]  # Last 20 logs per batch
-                        batch_logs_text = "\n".join(recent_batch_logs)
-                        st.text_area(f"Batch {batch_index} Logs", batch_logs_text, height=150, disabled=True, key=f"batch_{batch_index}_logs")
-        
-        # Auto-refresh toggle
-        auto_refresh = st.checkbox("🔄 Auto-refresh logs", value=streaming)
-        
-        if auto_refresh and (streaming or ('batch_streams' in st.session_state and any(b.get('streaming', False) for b in st.session_state['batch_streams'].values()))):
-            time.sleep(2)
-            st.rerun()
+        # Only the log panels rerun on refresh, not the whole page
+        auto_refresh = st.checkbox("🔄 Auto-refresh logs", value=get_live_refresh_interval() is not None)
+        st.fragment(render_live_logs, run_every=LIVE_REFRESH_SECONDS if auto_refresh else None)()
     
     with tab2:
         st.subheader("Current Session History")
@@ -1904,36 +6417,114 @@ def main():
     with tab3:
         st.subheader("All Historical Logs")
         
-        # Filter options
-        col_filter1, col_filter2 = st.columns(2)
+        col_search1, col_search2 = st.columns([3, 1])
+        with col_search1:
+            search_text = st.text_input("Search messages", placeholder='e.g. "Connection reset" rtmp (all terms must match)')
+        with col_search2:
+            search_order = st.selectbox("Sort matches", ["Relevance", "Newest"])
+        
+        # Filter options, all applied in SQL before the page limit
+        col_filter1, col_filter2, col_filter3 = st.columns(3)
         
         with col_filter1:
             log_limit = st.selectbox("Show logs", [50, 100, 200, 500], index=1)
+            log_type_filter = st.selectbox("Filter by type", ["All", "INFO", "ERROR", "FFMPEG", "ADAPT"])
         
         with col_filter2:
-            log_type_filter = st.selectbox("Filter by type", ["All", "INFO", "ERROR", "FFMPEG"])
+            session_filter = st.checkbox("Current session only")
+            batch_filter = st.text_input("Batch", placeholder="e.g. 2")
+            channel_filter = st.text_input("Channel", placeholder="exact channel name")
+        
+        with col_filter3:
+            video_filter = st.text_input("Video file", placeholder="exact file name")
+            date_range = st.date_input("Date range", value=(), help="Leave empty for all dates")
         
-        all_logs = get_logs_from_database(limit=log_limit)
+        log_filters = {
+            'session_id': st.session_state['session_id'] if session_filter else None,
+            'log_type': None if log_type_filter == "All" else log_type_filter,
+            'batch_index': int(batch_filter) if batch_filter.strip().isdigit() else None,
+            'channel_name': channel_filter.strip() or None,
+            'video_file': video_filter.strip() or None,
+            'since': datetime.combine(date_range[0], datetime.min.time()) if len(date_range) >= 1 else None,
+            'until': datetime.combine(date_range[-1], datetime.min.time()) + timedelta(days=1) if len(date_range) >= 1 else None
+        }
         
-        if all_logs:
-            # Filter by type if selected
-            if log_type_filter != "All":
-                all_logs = [log for log in all_logs if log[1] == log_type_filter]
+        if search_text.strip():
+            # Ranked full-text search; the filters above narrow the matches
+            try:
+                results = search_logs(search_text, limit=log_limit, order="relevance" if search_order == "Relevance" else "newest", **log_filters)
+            except sqlite3.OperationalError as e:
+                if "no such table" in str(e):
+                    st.warning("Full-text search needs SQLite with FTS5, which this build does not have.")
+                else:
+                    st.error(f"Error searching logs: {e}")
+                results = []
             
-            # Display in expandable sections
-            for i, log in enumerate(all_logs[:50]):  # Limit display to 50 for performance
-                timestamp, log_type, message, video_file, channel_name = log
-                
-                with st.expander(f"{log_type} - {timestamp} - {message[:50]}..."):
-                    st.write(f"**Timestamp:** {timestamp}")
-                    st.write(f"**Type:** {log_type}")
-                    st.write(f"**Message:** {message}")
-                    if video_file:
-                        st.write(f"**Video File:** {video_file}")
-                    if channel_name:
-                        st.write(f"**Channel:** {channel_name}")
+            st.caption(f"{len(results)} match(es) for {build_fts_query(search_text)}")
+            for log in results:
+                with st.expander(f"{log['log_type']} - {log['timestamp']} - {log['message'][:50]}...", expanded=True):
+                    st.markdown(format_search_highlight(log['highlighted']))
+                    details = [f"Session {log['session_id']}"]
+                    if log['batch_index'] is not None:
+                        details.append(f"Batch {log['batch_index']}")
+                    if log['channel_name']:
+                        details.append(f"Channel {log['channel_name']}")
+                    if log['video_file']:
+                        details.append(log['video_file'])
+                    st.caption(" · ".join(details))
         else:
-            st.info("No historical logs available.")
+            # Keyset pagination: remember the cursor of every page shown so far
+            page_state = st.session_state.setdefault('log_pages', {'filters': None, 'cursors': [None]})
+            filter_key = (tuple(sorted((key, str(value)) for key, value in log_filters.items())), log_limit)
+            if page_state['filters'] != filter_key:
+                page_state.update(filters=filter_key, cursors=[None])
+        
+            try:
+                all_logs, next_cursor = query_logs(limit=log_limit, before=page_state['cursors'][-1], **log_filters)
+            except sqlite3.Error as e:
+                st.error(f"Error getting logs from database: {e}")
+                all_logs, next_cursor = [], None
+        
+            col_page1, col_page2, col_page3 = st.columns([1, 2, 1])
+            with col_page1:
+                if st.button("⬅️ Newer", disabled=len(page_state['cursors']) == 1):
+                    page_state['cursors'].pop()
+                    st.rerun()
+            with col_page2:
+                st.caption(f"Page {len(page_state['cursors'])}")
+            with col_page3:
+                if st.button("Older ➡️", disabled=next_cursor is None):
+                    page_state['cursors'].append(next_cursor)
+                    st.rerun()
+        
+            if all_logs:
+                # Display in expandable sections
+                for log in all_logs:
+                    timestamp, log_type, message, video_file, channel_name = (log[column] for column in ('timestamp', 'log_type', 'message', 'video_file', 'channel_name'))
+                
+                    with st.expander(f"{log_type} - {timestamp} - {message[:50]}..."):
+                        st.write(f"**Timestamp:** {timestamp}")
+                        st.write(f"**Type:** {log_type}")
+                        st.write(f"**Message:** {message}")
+                        if video_file:
+                            st.write(f"**Video File:** {video_file}")
+                        if channel_name:
+                            st.write(f"**Channel:** {channel_name}")
+                        if log['batch_index'] is not None:
+                            st.write(f"**Batch:** {log['batch_index']}")
+            else:
+                st.info("No historical logs available.")
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ["benchmark"]:
+        benchmark_cli(sys.argv[2:])
+    elif sys.argv[1:2] == ["ingest-sink"]:
+        ingest_sink_cli(sys.argv[2:])
+    elif sys.argv[1:2] == ["soak"]:
+        soak_cli(sys.argv[2:])
+    elif sys.argv[1:2] == ["retention"]:
+        retention_cli(sys.argv[2:])
+    elif sys.argv[1:2] == ["export"]:
+        export_cli(sys.argv[2:])
+    else:
+        main()
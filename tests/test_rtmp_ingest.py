@@ -0,0 +1,248 @@
+"""Byte-level tests for the local RTMP ingest sink: AMF0, chunk parsing and the publish handshake"""
+import asyncio
+import struct
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app  # noqa: E402
+
+
+# Fixture builders
+
+def amf0_string(value):
+    encoded = value.encode('utf-8')
+    return b"\x02" + struct.pack(">H", len(encoded)) + encoded
+
+
+def amf0_number(value):
+    return b"\x00" + struct.pack(">d", value)
+
+
+def chunk_message(csid, msg_type, payload, timestamp=0, stream_id=0, chunk_size=128):
+    """One message as a type 0 chunk followed by type 3 continuation chunks"""
+    extended = timestamp >= 0xFFFFFF
+    header = bytes([csid]) + min(timestamp, 0xFFFFFF).to_bytes(3, 'big') + len(payload).to_bytes(3, 'big') + bytes([msg_type]) + stream_id.to_bytes(4, 'little')
+    extra = timestamp.to_bytes(4, 'big') if extended else b""
+    parts = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)] or [b""]
+    out = header + extra + parts[0]
+    for part in parts[1:]:
+        # Continuation chunks repeat the extended timestamp when the message had one
+        out += bytes([0xC0 | csid]) + extra + part
+    return out
+
+
+def read_messages(data, count, chunk_size=128):
+    """Parse count messages from raw chunk bytes with the sink's own reader"""
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        state = {'chunk_size': chunk_size, 'channels': {}, 'received': 0, 'acked': 0, 'window': None}
+        sink = app.RtmpIngestSink()
+        return [await sink._read_message(reader, state) for _ in range(count)]
+    return asyncio.run(run())
+
+
+# AMF0
+
+def test_amf0_decodes_connect_command():
+    payload = (
+        amf0_string("connect") + amf0_number(1)
+        + b"\x03" + struct.pack(">H", 3) + b"app" + amf0_string("live")
+        + struct.pack(">H", 5) + b"tcUrl" + amf0_string("rtmp://127.0.0.1/live")
+        + struct.pack(">H", 5) + b"audio" + b"\x01\x01"
+        + b"\x00\x00\x09"
+    )
+    assert app.amf0_decode_all(payload) == ["connect", 1.0, {"app": "live", "tcUrl": "rtmp://127.0.0.1/live", "audio": True}]
+
+
+def test_amf0_decodes_publish_command():
+    payload = amf0_string("publish") + amf0_number(5) + b"\x05" + amf0_string("key?token=1") + amf0_string("live")
+    assert app.amf0_decode_all(payload) == ["publish", 5.0, None, "key?token=1", "live"]
+
+
+def test_amf0_decodes_ecma_and_strict_arrays_dates_and_long_strings():
+    ecma = b"\x08" + struct.pack(">I", 1) + struct.pack(">H", 5) + b"width" + amf0_number(1920) + b"\x00\x00\x09"
+    strict = b"\x0A" + struct.pack(">I", 2) + amf0_number(1) + b"\x06"
+    date = b"\x0B" + struct.pack(">d", 1.5e12) + b"\x00\x00"
+    long_string = b"\x0C" + struct.pack(">I", 3) + b"abc"
+    assert app.amf0_decode_all(ecma + strict + date + long_string) == [{"width": 1920.0}, [1.0, None], 1.5e12, "abc"]
+
+
+def test_amf0_round_trips_what_the_sink_sends():
+    values = ["_result", 1, {"level": "status", "code": "NetConnection.Connect.Success", "objectEncoding": 0}, None, True]
+    assert app.amf0_decode_all(app.amf0_encode(*values)) == values
+
+
+def test_amf0_unknown_marker_is_rejected():
+    with pytest.raises(ValueError, match="marker 0x11"):
+        app.amf0_decode_all(amf0_string("connect") + b"\x11")
+
+
+@pytest.mark.parametrize("data", [
+    amf0_number(1)[:5],
+    amf0_string("publish")[:5],
+    b"\x02\x00",
+    b"\x03" + struct.pack(">H", 3) + b"app" + amf0_string("live"),
+    b"\x0A" + struct.pack(">I", 3) + amf0_number(1),
+    b"\x0B" + struct.pack(">d", 0),
+], ids=["number", "string body", "string length", "object end", "strict array", "date"])
+def test_amf0_truncated_values_are_rejected(data):
+    with pytest.raises(ValueError, match="Truncated"):
+        app.amf0_decode_all(data)
+
+
+# Chunk stream
+
+def test_message_split_across_chunks_is_reassembled():
+    payload = bytes(range(256)) * 2
+    [(msg_type, stream_id, timestamp, body)] = read_messages(chunk_message(6, 9, payload, timestamp=40, stream_id=1), 1)
+    assert (msg_type, stream_id, timestamp, body) == (9, 1, 40, payload)
+
+
+def test_interleaved_chunk_streams_are_reassembled_separately():
+    video = chunk_message(6, 9, b"v" * 200, timestamp=10, stream_id=1)
+    audio = chunk_message(4, 8, b"a" * 20, timestamp=12, stream_id=1)
+    # First video chunk, the whole audio message, then the video continuation
+    data = video[:12 + 128] + audio + video[12 + 128:]
+    messages = read_messages(data, 2)
+    assert messages == [(8, 1, 12, b"a" * 20), (9, 1, 10, b"v" * 200)]
+
+
+def test_extended_timestamp_on_first_and_continuation_chunks():
+    payload = b"x" * 300
+    [(_, _, timestamp, body)] = read_messages(chunk_message(6, 9, payload, timestamp=0x1000000 + 5), 1)
+    assert (timestamp, body) == (0x1000000 + 5, payload)
+
+
+def test_type_1_and_2_headers_carry_timestamp_deltas():
+    first = chunk_message(6, 9, b"\x17\x01", timestamp=1000, stream_id=1)
+    # Type 1: delta, length and type; type 2: delta only (same length and type)
+    second = bytes([0x40 | 6]) + (33).to_bytes(3, 'big') + (2).to_bytes(3, 'big') + b"\x09" + b"\x27\x01"
+    third = bytes([0x80 | 6]) + (34).to_bytes(3, 'big') + b"\x27\x01"
+    timestamps = [message[2] for message in read_messages(first + second + third, 3)]
+    assert timestamps == [1000, 1033, 1067]
+
+
+def test_two_and_three_byte_basic_headers():
+    # csid 0 adds 64 to the next byte; csid 1 adds 64 plus a little-endian 16-bit value
+    two_byte = chunk_message(0, 9, b"abc")[:1] + b"\x06" + chunk_message(0, 9, b"abc")[1:]
+    three_byte = chunk_message(1, 8, b"de")[:1] + b"\x10\x01" + chunk_message(1, 8, b"de")[1:]
+    messages = read_messages(two_byte + three_byte, 2)
+    assert [(message[0], message[3]) for message in messages] == [(9, b"abc"), (8, b"de")]
+
+
+@pytest.mark.parametrize("cut", [1, 5, 12, 12 + 64, 12 + 128 + 1], ids=["basic header", "message header", "no payload", "first chunk", "continuation"])
+def test_truncated_chunk_raises_incomplete_read(cut):
+    data = chunk_message(6, 9, b"v" * 200)[:cut]
+    with pytest.raises(asyncio.IncompleteReadError):
+        read_messages(data, 1)
+
+
+# Handshake and publish against a running sink
+
+async def publish_session(port, commands, media=(), close_cleanly=True):
+    """Handshake, send commands and media, return the decoded server replies"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    c1 = bytes(8) + bytes(range(256)) * 6
+    writer.write(b"\x03" + c1[:1536])
+    s0 = await reader.readexactly(1)
+    s1 = await reader.readexactly(1536)
+    s2 = await reader.readexactly(1536)
+    writer.write(s1)
+
+    replies = []
+    state = {'chunk_size': 128, 'channels': {}, 'received': 0, 'acked': 0, 'window': None}
+    sink_reader = app.RtmpIngestSink()
+    for command, expected_replies in commands:
+        writer.write(command)
+        await writer.drain()
+        for _ in range(expected_replies):
+            msg_type, _, _, payload = await asyncio.wait_for(sink_reader._read_message(reader, state), 5)
+            if msg_type == 1:
+                state['chunk_size'] = struct.unpack(">I", payload)[0]
+            replies.append((msg_type, app.amf0_decode_all(payload) if msg_type == 20 else payload))
+    for chunk in media:
+        writer.write(chunk)
+    if close_cleanly:
+        writer.write(chunk_message(3, 20, amf0_string("deleteStream") + amf0_number(6) + b"\x05" + amf0_number(1)))
+    await writer.drain()
+    writer.close()
+    return s0, s1, s2, c1, replies
+
+
+def connect_command(app_name="live"):
+    return chunk_message(3, 20, amf0_string("connect") + amf0_number(1) + app.amf0_encode({"app": app_name, "type": "nonprivate"}))
+
+
+def publish_commands(stream_name="key"):
+    return [
+        (connect_command(), 4),
+        (chunk_message(3, 20, amf0_string("createStream") + amf0_number(4) + b"\x05"), 1),
+        (chunk_message(8, 20, amf0_string("publish") + amf0_number(5) + b"\x05" + amf0_string(stream_name) + amf0_string("live"), stream_id=1), 1),
+    ]
+
+
+@pytest.fixture
+def sink():
+    sink = app.RtmpIngestSink(port=0)
+    sink.start()
+    sink.port = sink.server.sockets[0].getsockname()[1]
+    yield sink
+    sink.stop()
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_handshake_echoes_c1_and_sends_plain_s1(sink):
+    s0, s1, s2, c1, _ = asyncio.run(publish_session(sink.port, []))
+    assert s0 == b"\x03"
+    assert s1[4:8] == bytes(4)
+    assert s2 == c1[:1536]
+
+
+def test_connect_and_publish_are_acknowledged(sink):
+    media = [
+        chunk_message(6, 9, b"\x17\x00" + bytes(20), timestamp=0, stream_id=1),
+        chunk_message(6, 9, b"\x17\x01" + bytes(300), timestamp=0, stream_id=1),
+        chunk_message(6, 9, b"\x27\x01" + bytes(300), timestamp=33, stream_id=1),
+        chunk_message(4, 8, b"\xaf\x01" + bytes(10), timestamp=20, stream_id=1),
+    ]
+    *_, replies = asyncio.run(publish_session(sink.port, publish_commands("key?token=1"), media))
+
+    assert [msg_type for msg_type, _ in replies] == [5, 6, 1, 20, 20, 20]
+    assert replies[3][1][0] == "_result"
+    assert replies[3][1][3]["code"] == "NetConnection.Connect.Success"
+    assert replies[4][1] == ["_result", 4.0, None, 1.0]
+    assert replies[5][1][0] == "onStatus"
+    assert replies[5][1][3]["code"] == "NetStream.Publish.Start"
+
+    assert wait_for(lambda: sink.snapshot().get("live/key", {}).get("disconnects") == 1)
+    stream = sink.snapshot()["live/key"]
+    assert stream["publishes"] == 1
+    assert stream["unexpected_disconnects"] == 0
+    assert (stream["video_frames"], stream["keyframes"], stream["audio_frames"]) == (2, 1, 1)
+    assert stream["max_timestamp_gap_ms"] == 33
+
+
+def test_dropped_publisher_counts_as_unexpected_disconnect(sink):
+    asyncio.run(publish_session(sink.port, publish_commands(), close_cleanly=False))
+    assert wait_for(lambda: sink.snapshot().get("live/key", {}).get("disconnects") == 1)
+    assert sink.snapshot()["live/key"]["unexpected_disconnects"] == 1
+
+
+def test_unknown_amf0_marker_closes_the_connection(sink):
+    bad_connect = chunk_message(3, 20, amf0_string("connect") + amf0_number(1) + b"\x11")
+    asyncio.run(publish_session(sink.port, [(bad_connect, 0)], close_cleanly=False))
+    assert wait_for(lambda: sink.last_error is not None)
+    assert "Unsupported AMF0 marker 0x11" in sink.last_error